@@ -1,6 +1,7 @@
 import hashlib
 import secrets
-from typing import Optional
+import time
+from typing import Optional, Dict, Tuple
 from fastapi import Header, HTTPException
 from database import db, ADMIN_EMAIL
 
@@ -15,6 +16,23 @@ def generate_token() -> str:
     return secrets.token_hex(32)
 
 
+# Cache court des utilisateurs authentifiés: token -> (user, expiration monotonic)
+_USER_CACHE_TTL = 60
+_USER_CACHE_MAX = 4096
+_user_cache: Dict[str, Tuple[dict, float]] = {}
+
+
+def invalidate_user_cache(token: Optional[str] = None, user_id: Optional[str] = None):
+    """Retire du cache un token, tous les tokens d'un utilisateur, ou tout le cache"""
+    if token is not None:
+        _user_cache.pop(token, None)
+    elif user_id is not None:
+        for key in [k for k, (u, _) in _user_cache.items() if u.get("id") == user_id]:
+            del _user_cache[key]
+    else:
+        _user_cache.clear()
+
+
 async def get_current_user(authorization: Optional[str] = Header(None)):
     """Obtient l'utilisateur courant a partir du token d'autorisation"""
     if not authorization:
@@ -22,6 +40,10 @@ async def get_current_user(authorization: Optional[str] = Header(None)):
     
     token = authorization.replace("Bearer ", "") if authorization.startswith("Bearer ") else authorization
     
+    cached = _user_cache.get(token)
+    if cached and cached[1] > time.monotonic():
+        return dict(cached[0])
+    
     token_doc = await db.tokens.find_one({"token": token})
     if not token_doc:
         raise HTTPException(status_code=401, detail="Token invalide")
@@ -30,7 +52,11 @@ async def get_current_user(authorization: Optional[str] = Header(None)):
     if not user:
         raise HTTPException(status_code=401, detail="Utilisateur non trouve")
     
-    return user
+    if len(_user_cache) >= _USER_CACHE_MAX:
+        _user_cache.pop(next(iter(_user_cache)))
+    _user_cache[token] = (user, time.monotonic() + _USER_CACHE_TTL)
+    
+    return dict(user)
 
 
 async def get_optional_user(authorization: Optional[str] = Header(None)):
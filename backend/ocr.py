@@ -20,10 +20,52 @@ import logging
 import os
 import base64
 import requests
+import threading
 from typing import Dict, Tuple, Optional
 
+try:
+    import tesserocr
+    TESSEROCR_AVAILABLE = True
+except ImportError:
+    TESSEROCR_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
+
+# ============ TESSERACT ============
+
+# Une instance libtesseract par thread et par langue (l'API C n'est pas thread-safe)
+_tess_local = threading.local()
+
+
+def tesseract_image_to_string(image: np.ndarray, lang: str = "eng+fra", psm: int = 6) -> str:
+    """
+    OCR Tesseract (OEM 3).
+    
+    Avec tesserocr, l'API C garde les modèles de langue chargés entre les appels
+    (pas de sous-processus ni de rechargement des traineddata).
+    Sinon, fallback sur le CLI via pytesseract.
+    """
+    if TESSEROCR_AVAILABLE:
+        apis = getattr(_tess_local, "apis", None)
+        if apis is None:
+            apis = _tess_local.apis = {}
+        api = apis.get(lang)
+        if api is None:
+            try:
+                api = tesserocr.PyTessBaseAPI(lang=lang, oem=tesserocr.OEM.DEFAULT)
+            except RuntimeError as e:
+                # traineddata introuvables pour libtesseract: rester sur le CLI
+                logger.warning(f"tesserocr indisponible ({lang}): {e}, fallback pytesseract")
+                api = False
+            apis[lang] = api
+        if api:
+            api.SetPageSegMode(psm)
+            api.SetImage(Image.fromarray(image))
+            return api.GetUTF8Text()
+    
+    return pytesseract.image_to_string(image, lang=lang, config=f"--psm {psm} --oem 3")
+
 # ============ GOOGLE CLOUD VISION OCR ============
 
 GOOGLE_VISION_ENDPOINT = "https://vision.googleapis.com/v1/images:annotate"
@@ -194,6 +236,8 @@ def google_vision_ocr_from_numpy(cv_image: np.ndarray, api_key: Optional[str] =
     Wrapper pour appeler Google Vision OCR depuis une image numpy/OpenCV.
     
     Convertit l'image en JPEG avant l'envoi pour optimiser la taille.
+    Les images en niveaux de gris sont encodées en JPEG 1 canal
+    (pas de plans de chrominance inutiles).
     
     Args:
         cv_image: Image numpy (BGR ou Grayscale)
@@ -202,13 +246,8 @@ def google_vision_ocr_from_numpy(cv_image: np.ndarray, api_key: Optional[str] =
     Returns:
         Résultat OCR
     """
-    # Convertir en JPEG
-    if len(cv_image.shape) == 2:
-        # Grayscale - convertir en BGR pour l'encodage
-        cv_image = cv2.cvtColor(cv_image, cv2.COLOR_GRAY2BGR)
-    
-    # Encoder en JPEG avec qualité optimale pour OCR
-    _, buffer = cv2.imencode('.jpg', cv_image, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    # Encoder en JPEG avec qualité optimale pour OCR + tables Huffman optimisées
+    _, buffer = cv2.imencode('.jpg', cv_image, [cv2.IMWRITE_JPEG_QUALITY, 95, cv2.IMWRITE_JPEG_OPTIMIZE, 1])
     image_bytes = buffer.tobytes()
     
     return google_vision_ocr_from_bytes(image_bytes, api_key)
@@ -537,13 +576,13 @@ def preprocess_for_ocr(zone_img: np.ndarray) -> np.ndarray:
     if len(zone_img.shape) == 3:
         gray = cv2.cvtColor(zone_img, cv2.COLOR_BGR2GRAY)
     else:
-        gray = zone_img.copy()
+        gray = zone_img  # fastNlMeansDenoising ne modifie pas son entrée
     
     # Débruitage léger
     denoised = cv2.fastNlMeansDenoising(gray, h=10)
     
     # Binarisation avec Otsu (meilleur que seuillage adaptatif pour photos)
-    _, binary = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    _, binary = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=denoised)
     
     return binary
 
@@ -596,11 +635,7 @@ def ocr_zone(zone_img: np.ndarray, lang: str = "eng+fra", psm: int = 6) -> str:
     """
     try:
         processed = preprocess_for_ocr(zone_img)
-        text = pytesseract.image_to_string(
-            processed,
-            lang=lang,
-            config=f"--psm {psm} --oem 3"
-        )
+        text = tesseract_image_to_string(processed, lang=lang, psm=psm)
         return text.strip()
     except Exception as e:
         logger.error(f"OCR zone error: {e}")
@@ -609,11 +644,41 @@ def ocr_zone(zone_img: np.ndarray, lang: str = "eng+fra", psm: int = 6) -> str:
 
 # ============ PIPELINE COMPLET ============
 
-def load_image_from_bytes(file_bytes: bytes) -> Optional[np.ndarray]:
-    """Charge une image depuis bytes"""
+# Décodage JPEG réduit par libjpeg (mise à l'échelle DCT), du plus fort au plus faible
+_JPEG_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def _jpeg_decode_flag(file_bytes: bytes, max_dim: Optional[int]) -> int:
+    """
+    Choisit le facteur de réduction JPEG le plus fort qui garde le grand côté
+    >= max_dim (le redimensionnement INTER_AREA final reste fait par l'appelant).
+    """
+    if not max_dim or file_bytes[:2] != b'\xff\xd8':
+        return cv2.IMREAD_COLOR
+    try:
+        # Lecture de l'en-tête seulement (pas de décodage des pixels)
+        longest = max(Image.open(io.BytesIO(file_bytes)).size)
+    except Exception:
+        return cv2.IMREAD_COLOR
+    for factor, flag in _JPEG_REDUCED_FLAGS:
+        if longest // factor >= max_dim:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def load_image_from_bytes(file_bytes: bytes, max_dim: Optional[int] = None) -> Optional[np.ndarray]:
+    """
+    Charge une image depuis bytes.
+    `max_dim`: taille cible du grand côté; pour un JPEG nettement plus grand,
+    libjpeg décode directement à 1/2, 1/4 ou 1/8 (4-16x moins de pixels).
+    """
     try:
         nparr = np.frombuffer(file_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        image = cv2.imdecode(nparr, _jpeg_decode_flag(file_bytes, max_dim))
         return image
     except Exception as e:
         logger.error(f"Failed to load image: {e}")
@@ -630,13 +695,14 @@ def resize_if_needed(image: np.ndarray, max_dim: int = 2500) -> np.ndarray:
     return image
 
 
-def process_image_ocr_pipeline(file_bytes: bytes) -> Dict[str, str]:
+def process_image_ocr_pipeline(file_bytes: bytes, image: Optional[np.ndarray] = None) -> Dict[str, str]:
     """
     Pipeline OCR complet par zones:
     
     Image → Load → Resize → Warp → Zones → OCR ciblé
     
     Si les zones échouent, fallback sur OCR global.
+    `image`: image BGR déjà décodée (évite de re-décoder file_bytes)
     
     Returns: Dict avec le texte de chaque zone
     """
@@ -651,7 +717,8 @@ def process_image_ocr_pipeline(file_bytes: bytes) -> Dict[str, str]:
     }
     
     # 1. Charger l'image
-    image = load_image_from_bytes(file_bytes)
+    if image is None:
+        image = load_image_from_bytes(file_bytes)
     if image is None:
         logger.error("Failed to decode image")
         return result
@@ -707,7 +774,7 @@ def process_image_ocr_pipeline(file_bytes: bytes) -> Dict[str, str]:
         logger.info(f"Using zones only (zones={result['zones_processed']})")
     else:
         # Zones insuffisantes, ajouter OCR global
-        global_text = process_image_global_ocr(file_bytes)
+        global_text = process_image_global_ocr(file_bytes, image)
         result["full_text"] = global_text
         result["parse_method"] = "ocr_global"
         logger.info(f"Using global OCR fallback (zones={result['zones_processed']}, global_len={len(global_text)})")
@@ -717,13 +784,14 @@ def process_image_ocr_pipeline(file_bytes: bytes) -> Dict[str, str]:
     return result
 
 
-def process_image_global_ocr(file_bytes: bytes) -> str:
+def process_image_global_ocr(file_bytes: bytes, image: Optional[np.ndarray] = None) -> str:
     """
     OCR global sur toute l'image (fallback si ROI ne fonctionne pas)
     Utilise un prétraitement optimisé pour les photos de factures
     """
     try:
-        image = load_image_from_bytes(file_bytes)
+        if image is None:
+            image = load_image_from_bytes(file_bytes)
         if image is None:
             return ""
         
@@ -737,14 +805,10 @@ def process_image_global_ocr(file_bytes: bytes) -> str:
         denoised = cv2.fastNlMeansDenoising(gray, h=10)
         
         # Binarisation Otsu
-        _, binary = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        _, binary = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=denoised)
         
         # OCR avec config optimisée pour documents
-        text = pytesseract.image_to_string(
-            binary,
-            lang="eng+fra",
-            config="--oem 3 --psm 6"
-        )
+        text = tesseract_image_to_string(binary, lang="eng+fra", psm=6)
         
         return text.strip()
         
@@ -1,42 +1,66 @@
+import asyncio
 from fastapi import APIRouter, HTTPException, Header, UploadFile, File
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from typing import Optional, List, Dict, Any
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
+from pymongo import ReturnDocument
 from database import db, ADMIN_EMAIL, ROOT_DIR, logger
-from dependencies import get_current_user, require_admin
+from dependencies import get_current_user, require_admin, invalidate_user_cache
 
 router = APIRouter()
 
 
 # ============ Other Admin Endpoints ============
 
-@router.get("/admin/users")
+def _owner_count_lookup(collection: str, field: str) -> dict:
+    """$lookup qui ne ramène que le nombre de documents de l'utilisateur"""
+    return {"$lookup": {
+        "from": collection,
+        "localField": "id",
+        "foreignField": "owner_id",
+        "pipeline": [{"$count": "n"}],
+        "as": field
+    }}
+
+
+# Utilisateurs + nombre de contacts/soumissions en une seule agrégation (MongoDB 5.0+)
+# La réponse est construite par le $project (valeurs par défaut, is_admin);
+# les dates restent des datetime et sont sérialisées en ISO par orjson
+_USERS_WITH_COUNTS_PIPELINE = [
+    # Seuls les champs renvoyés sont lus (pas de password_hash ni réglages)
+    {"$project": {
+        "_id": 0, "id": 1, "name": 1, "email": 1, "created_at": 1,
+        "last_login": 1, "is_blocked": 1, "is_admin": 1
+    }},
+    _owner_count_lookup("contacts", "contacts_count"),
+    _owner_count_lookup("submissions", "submissions_count"),
+    {"$project": {
+        "_id": 0,
+        "id": 1,
+        "name": {"$ifNull": ["$name", ""]},
+        "email": {"$ifNull": ["$email", ""]},
+        "created_at": {"$ifNull": ["$created_at", None]},
+        "last_login": {"$ifNull": ["$last_login", None]},
+        "is_blocked": {"$ifNull": ["$is_blocked", False]},
+        "is_admin": {"$or": [{"$ifNull": ["$is_admin", False]}, {"$eq": ["$email", ADMIN_EMAIL]}]},
+        "contacts_count": {"$ifNull": [{"$arrayElemAt": ["$contacts_count.n", 0]}, 0]},
+        "submissions_count": {"$ifNull": [{"$arrayElemAt": ["$submissions_count.n", 0]}, 0]}
+    }}
+]
+
+
+@router.get("/admin/users", response_class=ORJSONResponse)
 async def get_all_users(authorization: Optional[str] = Header(None)):
     """Récupère tous les utilisateurs (admin seulement)"""
     await require_admin(authorization)
     
-    users = []
-    async for user in db.users.find({}, {"_id": 0, "password_hash": 0}):
-        user_id = user.get("id")
-        
-        # Count contacts and submissions for this user
-        contacts_count = await db.contacts.count_documents({"owner_id": user_id})
-        submissions_count = await db.submissions.count_documents({"owner_id": user_id})
-        
-        users.append({
-            "id": user_id,
-            "name": user.get("name", ""),
-            "email": user.get("email", ""),
-            "created_at": user.get("created_at", datetime.utcnow()).isoformat() if user.get("created_at") else None,
-            "last_login": user.get("last_login").isoformat() if user.get("last_login") else None,
-            "is_blocked": user.get("is_blocked", False),
-            "is_admin": user.get("is_admin", False) or user.get("email") == ADMIN_EMAIL,
-            "contacts_count": contacts_count,
-            "submissions_count": submissions_count
-        })
-    
-    return users
+    users = await db.users.aggregate(_USERS_WITH_COUNTS_PIPELINE).to_list(None)
+    return ORJSONResponse(users)
+
+# Champs nécessaires au message de confirmation block/unblock
+_BLOCK_PROJECTION = {"_id": 0, "name": 1}
+
 
 @router.put("/admin/users/{user_id}/block")
 async def block_user(user_id: str, authorization: Optional[str] = Header(None)):
@@ -47,23 +71,22 @@ async def block_user(user_id: str, authorization: Optional[str] = Header(None)):
     if admin.get("id") == user_id:
         raise HTTPException(status_code=400, detail="Vous ne pouvez pas vous bloquer vous-même")
     
-    # Find user
-    user = await db.users.find_one({"id": user_id})
+    # Bloquer en une seule requête; les administrateurs sont exclus par le filtre
+    user = await db.users.find_one_and_update(
+        {"id": user_id, "email": {"$ne": ADMIN_EMAIL}, "is_admin": {"$ne": True}},
+        {"$set": {"is_blocked": True}},
+        projection=_BLOCK_PROJECTION,
+        return_document=ReturnDocument.BEFORE
+    )
     if not user:
-        raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
-    
-    # Cannot block an admin
-    if user.get("email") == ADMIN_EMAIL or user.get("is_admin", False):
+        # Aucun document modifié: utilisateur inexistant ou administrateur
+        if not await db.users.find_one({"id": user_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
         raise HTTPException(status_code=400, detail="Impossible de bloquer un administrateur")
     
-    # Block user
-    await db.users.update_one(
-        {"id": user_id},
-        {"$set": {"is_blocked": True}}
-    )
-    
     # Delete all tokens for this user (force logout)
     await db.tokens.delete_many({"user_id": user_id})
+    invalidate_user_cache(user_id=user_id)
     
     return {"success": True, "message": f"Utilisateur {user.get('name')} bloqué"}
 
@@ -72,16 +95,14 @@ async def unblock_user(user_id: str, authorization: Optional[str] = Header(None)
     """Débloque un utilisateur (admin seulement)"""
     await require_admin(authorization)
     
-    # Find user
-    user = await db.users.find_one({"id": user_id})
-    if not user:
-        raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
-    
     # Unblock user
-    await db.users.update_one(
+    user = await db.users.find_one_and_update(
         {"id": user_id},
-        {"$set": {"is_blocked": False}}
+        {"$set": {"is_blocked": False}},
+        projection=_BLOCK_PROJECTION
     )
+    if not user:
+        raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
     
     return {"success": True, "message": f"Utilisateur {user.get('name')} débloqué"}
 
@@ -90,10 +111,13 @@ async def get_admin_stats(authorization: Optional[str] = Header(None)):
     """Récupère les statistiques globales (admin seulement)"""
     await require_admin(authorization)
     
-    total_users = await db.users.count_documents({})
-    blocked_users = await db.users.count_documents({"is_blocked": True})
-    total_contacts = await db.contacts.count_documents({})
-    total_submissions = await db.submissions.count_documents({})
+    # Totaux depuis les métadonnées des collections (O(1)), requêtes en parallèle
+    total_users, blocked_users, total_contacts, total_submissions = await asyncio.gather(
+        db.users.estimated_document_count(),
+        db.users.count_documents({"is_blocked": True}),
+        db.contacts.estimated_document_count(),
+        db.submissions.estimated_document_count()
+    )
     
     return {
         "total_users": total_users,
@@ -123,7 +147,21 @@ async def get_parsing_stats(authorization: Optional[str] = Header(None)):
     await require_admin(authorization)
     
     try:
-        total = await db.parsing_metrics.count_documents({})
+        # Un seul aller-retour: total, répartition par statut et moyennes
+        stats = {}
+        async for stats in db.parsing_metrics.aggregate([
+            {"$facet": {
+                "total": [{"$count": "n"}],
+                "by_status": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}],
+                "avgs": [{"$group": {
+                    "_id": None,
+                    "avg_score": {"$avg": "$score"},
+                    "avg_time": {"$avg": "$duration_sec"}
+                }}]
+            }}
+        ]):
+            break
+        total = stats["total"][0]["n"] if stats.get("total") else 0
         
         if total == 0:
             return {
@@ -137,21 +175,14 @@ async def get_parsing_stats(authorization: Optional[str] = Header(None)):
                 "message": "Aucun scan enregistré"
             }
         
-        auto = await db.parsing_metrics.count_documents({"status": "auto"})
-        review = await db.parsing_metrics.count_documents({"status": "review"})
-        vision = await db.parsing_metrics.count_documents({"status": "vision"})
-        
-        # Aggregations pour moyennes
-        avg_score_result = await db.parsing_metrics.aggregate([
-            {"$group": {"_id": None, "avg": {"$avg": "$score"}}}
-        ]).to_list(1)
+        by_status = {row["_id"]: row["count"] for row in stats["by_status"]}
+        auto = by_status.get("auto", 0)
+        review = by_status.get("review", 0)
+        vision = by_status.get("vision", 0)
         
-        avg_time_result = await db.parsing_metrics.aggregate([
-            {"$group": {"_id": None, "avg": {"$avg": "$duration_sec"}}}
-        ]).to_list(1)
-        
-        avg_score = round(avg_score_result[0]["avg"], 2) if avg_score_result else 0
-        avg_time = round(avg_time_result[0]["avg"], 2) if avg_time_result else 0
+        avgs = stats["avgs"]
+        avg_score = round(avgs[0]["avg_score"], 2) if avgs else 0
+        avg_time = round(avgs[0]["avg_time"], 2) if avgs else 0
         
         auto_rate = round(auto / total * 100, 2)
         review_rate = round(review / total * 100, 2)
@@ -180,6 +211,44 @@ async def get_parsing_stats(authorization: Optional[str] = Header(None)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Étapes statiques des agrégations de métriques (seul le $match varie par requête)
+# Regroupement par jour ($dateTrunc, MongoDB 5.0+), taux et arrondis calculés côté serveur
+_HISTORY_GROUP = {"$group": {
+    "_id": {"$dateTrunc": {"date": "$timestamp", "unit": "day"}},
+    "total": {"$sum": 1},
+    "avg_score": {"$avg": "$score"},
+    "avg_duration": {"$avg": "$duration_sec"},
+    "auto_count": {"$sum": {"$cond": [{"$eq": ["$status", "auto"]}, 1, 0]}},
+    "review_count": {"$sum": {"$cond": [{"$eq": ["$status", "review"]}, 1, 0]}},
+    "vision_count": {"$sum": {"$cond": [{"$eq": ["$status", "vision"]}, 1, 0]}}
+}}
+
+_HISTORY_SORT = {"$sort": {"_id": 1}}
+
+_HISTORY_PROJECT = {"$project": {
+    "_id": 0,
+    "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$_id"}},
+    "total": 1,
+    "avg_score": {"$round": [{"$ifNull": ["$avg_score", 0]}, 2]},
+    "avg_duration_sec": {"$round": [{"$ifNull": ["$avg_duration", 0]}, 2]},
+    "auto_rate": {"$round": [{"$multiply": [{"$divide": ["$auto_count", "$total"]}, 100]}, 2]},
+    "review_rate": {"$round": [{"$multiply": [{"$divide": ["$review_count", "$total"]}, 100]}, 2]},
+    "vision_rate": {"$round": [{"$multiply": [{"$divide": ["$vision_count", "$total"]}, 100]}, 2]}
+}}
+
+_SCAN_STATS_GROUP = {"$group": {
+    "_id": None,
+    "total": {"$sum": 1},
+    "avg_score": {"$avg": "$score"},
+    "avg_duration": {"$avg": "$duration_sec"},
+    "total_cost": {"$sum": {"$ifNull": ["$cost_estimate", 0]}},
+    "success_count": {"$sum": {"$cond": [{"$gte": ["$score", 70]}, 1, 0]}},
+    "google_vision_count": {"$sum": {"$cond": [{"$regexMatch": {"input": {"$ifNull": ["$parse_method", ""]}, "regex": "google_vision"}}, 1, 0]}},
+    "tesseract_count": {"$sum": {"$cond": [{"$regexMatch": {"input": {"$ifNull": ["$parse_method", ""]}, "regex": "tesseract|pdfplumber"}}, 1, 0]}},
+    "gpt4_vision_count": {"$sum": {"$cond": [{"$regexMatch": {"input": {"$ifNull": ["$parse_method", ""]}, "regex": "vision_optimized"}}, 1, 0]}}
+}}
+
+
 @router.get("/admin/parsing-history")
 async def get_parsing_history(
     days: int = 7,
@@ -193,40 +262,17 @@ async def get_parsing_history(
     await require_admin(authorization)
     
     try:
-        from_date = datetime.now() - timedelta(days=days)
+        from_date = datetime.utcnow() - timedelta(days=days)
         
         pipeline = [
             {"$match": {"timestamp": {"$gte": from_date}}},
-            {"$group": {
-                "_id": {
-                    "year": {"$year": "$timestamp"},
-                    "month": {"$month": "$timestamp"},
-                    "day": {"$dayOfMonth": "$timestamp"}
-                },
-                "total": {"$sum": 1},
-                "avg_score": {"$avg": "$score"},
-                "avg_duration": {"$avg": "$duration_sec"},
-                "auto_count": {"$sum": {"$cond": [{"$eq": ["$status", "auto"]}, 1, 0]}},
-                "review_count": {"$sum": {"$cond": [{"$eq": ["$status", "review"]}, 1, 0]}},
-                "vision_count": {"$sum": {"$cond": [{"$eq": ["$status", "vision"]}, 1, 0]}}
-            }},
-            {"$sort": {"_id.year": 1, "_id.month": 1, "_id.day": 1}}
+            _HISTORY_GROUP,
+            _HISTORY_SORT,
+            _HISTORY_PROJECT
         ]
         
-        results = await db.parsing_metrics.aggregate(pipeline).to_list(100)
-        
-        history = []
-        for r in results:
-            date_str = f"{r['_id']['year']}-{r['_id']['month']:02d}-{r['_id']['day']:02d}"
-            history.append({
-                "date": date_str,
-                "total": r["total"],
-                "avg_score": round(r["avg_score"], 2) if r["avg_score"] else 0,
-                "avg_duration_sec": round(r["avg_duration"], 2) if r["avg_duration"] else 0,
-                "auto_rate": round(r["auto_count"] / r["total"] * 100, 2) if r["total"] else 0,
-                "review_rate": round(r["review_count"] / r["total"] * 100, 2) if r["total"] else 0,
-                "vision_rate": round(r["vision_count"] / r["total"] * 100, 2) if r["total"] else 0
-            })
+        # Documents déjà au format de la réponse
+        history = await db.parsing_metrics.aggregate(pipeline).to_list(100)
         
         return {
             "period_days": days,
@@ -240,6 +286,12 @@ async def get_parsing_history(
 
 # ============ User Scan History Endpoints (Non-Admin) ============
 
+_SCAN_HISTORY_PROJECTION = {
+    "_id": 0, "timestamp": 1, "vin": 1, "stock_no": 1, "brand": 1, "model": 1,
+    "ep_cost": 1, "pdco": 1, "score": 1, "status": 1, "parse_method": 1,
+    "duration_sec": 1, "cost_estimate": 1, "vin_valid": 1, "success": 1
+}
+
 @router.get("/scans/history")
 async def get_user_scan_history(
     limit: int = 50,
@@ -254,10 +306,11 @@ async def get_user_scan_history(
     
     try:
         # Récupérer les derniers scans de l'utilisateur
+        # Seulement les champs retournés, et tout le résultat en un seul lot
         cursor = db.parsing_metrics.find(
             {"owner_id": user["id"]},
-            {"_id": 0}
-        ).sort("timestamp", -1).limit(limit)
+            _SCAN_HISTORY_PROJECTION
+        ).sort("timestamp", -1).limit(limit).batch_size(max(limit, 0))
         
         scans = []
         async for scan in cursor:
@@ -309,7 +362,7 @@ async def get_user_scan_stats(
     user = await get_current_user(authorization)
     
     try:
-        from_date = datetime.now() - timedelta(days=days)
+        from_date = datetime.utcnow() - timedelta(days=days)
         
         # Filtrer par utilisateur et période
         match_filter = {
@@ -317,10 +370,13 @@ async def get_user_scan_stats(
             "timestamp": {"$gte": from_date}
         }
         
-        # Compter total
-        total = await db.parsing_metrics.count_documents(match_filter)
+        # Aggregation pour statistiques (aucun document → aucun groupe)
+        pipeline = [{"$match": match_filter}, _SCAN_STATS_GROUP]
+        r = None
+        async for r in db.parsing_metrics.aggregate(pipeline):
+            break
         
-        if total == 0:
+        if r is None:
             return {
                 "period_days": days,
                 "total_scans": 0,
@@ -332,43 +388,21 @@ async def get_user_scan_stats(
                 "message": "Aucun scan dans cette période"
             }
         
-        # Aggregation pour statistiques
-        pipeline = [
-            {"$match": match_filter},
-            {"$group": {
-                "_id": None,
-                "total": {"$sum": 1},
-                "avg_score": {"$avg": "$score"},
-                "avg_duration": {"$avg": "$duration_sec"},
-                "total_cost": {"$sum": {"$ifNull": ["$cost_estimate", 0]}},
-                "success_count": {"$sum": {"$cond": [{"$gte": ["$score", 70]}, 1, 0]}},
-                "google_vision_count": {"$sum": {"$cond": [{"$regexMatch": {"input": {"$ifNull": ["$parse_method", ""]}, "regex": "google_vision"}}, 1, 0]}},
-                "tesseract_count": {"$sum": {"$cond": [{"$regexMatch": {"input": {"$ifNull": ["$parse_method", ""]}, "regex": "tesseract|pdfplumber"}}, 1, 0]}},
-                "gpt4_vision_count": {"$sum": {"$cond": [{"$regexMatch": {"input": {"$ifNull": ["$parse_method", ""]}, "regex": "vision_optimized"}}, 1, 0]}}
-            }}
-        ]
-        
-        results = await db.parsing_metrics.aggregate(pipeline).to_list(1)
-        
-        if results:
-            r = results[0]
-            return {
-                "period_days": days,
-                "total_scans": r["total"],
-                "success_rate": round(r["success_count"] / r["total"] * 100, 1) if r["total"] else 0,
-                "avg_score": round(r["avg_score"], 1) if r["avg_score"] else 0,
-                "avg_duration_sec": round(r["avg_duration"], 2) if r["avg_duration"] else 0,
-                "total_cost_estimate": round(r["total_cost"], 4),
-                "cost_savings_vs_gpt4": round(r["google_vision_count"] * 0.0185, 2),  # Économie par rapport à GPT-4
-                "methods_breakdown": {
-                    "google_vision_hybrid": r["google_vision_count"],
-                    "tesseract_pdfplumber": r["tesseract_count"],
-                    "gpt4_vision": r["gpt4_vision_count"]
-                },
-                "free_quota_remaining": max(0, 1000 - r["google_vision_count"])  # 1000 gratuits/mois Google
-            }
-        
-        return {"period_days": days, "total_scans": 0, "message": "Pas de données"}
+        return {
+            "period_days": days,
+            "total_scans": r["total"],
+            "success_rate": round(r["success_count"] / r["total"] * 100, 1) if r["total"] else 0,
+            "avg_score": round(r["avg_score"], 1) if r["avg_score"] else 0,
+            "avg_duration_sec": round(r["avg_duration"], 2) if r["avg_duration"] else 0,
+            "total_cost_estimate": round(r["total_cost"], 4),
+            "cost_savings_vs_gpt4": round(r["google_vision_count"] * 0.0185, 2),  # Économie par rapport à GPT-4
+            "methods_breakdown": {
+                "google_vision_hybrid": r["google_vision_count"],
+                "tesseract_pdfplumber": r["tesseract_count"],
+                "gpt4_vision": r["gpt4_vision_count"]
+            },
+            "free_quota_remaining": max(0, 1000 - r["google_vision_count"])  # 1000 gratuits/mois Google
+        }
         
     except Exception as e:
         logger.error(f"Error getting user scan stats: {e}")
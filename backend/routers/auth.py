@@ -3,7 +3,7 @@ from typing import Optional
 from datetime import datetime
 from database import db, ADMIN_EMAIL
 from models import UserRegister, UserLogin, User
-from dependencies import hash_password, generate_token, get_current_user
+from dependencies import hash_password, generate_token, get_current_user, invalidate_user_cache
 
 router = APIRouter()
 
@@ -90,6 +90,7 @@ async def login_user(credentials: UserLogin):
 async def logout_user(token: str):
     """Logout user by deleting token"""
     await db.tokens.delete_one({"token": token})
+    invalidate_user_cache(token=token)
     return {"success": True}
 
 
@@ -115,6 +116,8 @@ async def demo_login():
         {"email": demo_email},
         {"$set": {"is_admin": True, "last_login": datetime.utcnow()}}
     )
+    # is_admin vient peut-être de changer: pas de droits périmés dans le cache des tokens
+    invalidate_user_cache(user_id=demo_user["id"])
 
     token = generate_token()
     await db.tokens.insert_one({
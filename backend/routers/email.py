@@ -1,15 +1,14 @@
 from fastapi import APIRouter, HTTPException, Header
 from typing import Optional, Dict, Any
 from datetime import datetime
-import base64
 import json
 from database import db, ROOT_DIR, SMTP_EMAIL, logger
 from models import SendCalculationEmailRequest, SendReportEmailRequest
 from dependencies import get_current_user, get_optional_user, get_rate_for_term
 from services.email_service import send_email
 from services.window_sticker import (
-    fetch_window_sticker, save_window_sticker_to_db,
-    convert_pdf_to_images, WINDOW_STICKER_URLS,
+    fetch_window_sticker, save_window_sticker_to_db, save_window_sticker_preview,
+    convert_pdf_to_images_async, window_sticker_pdf_bytes, window_sticker_pdf_url,
     generate_lease_email_html, generate_window_sticker_html
 )
 
@@ -61,7 +60,7 @@ async def get_window_sticker(vin: str, authorization: Optional[str] = Header(Non
     user = await get_current_user(authorization)
     
     # Vérifier si déjà en cache dans MongoDB
-    cached = await db.window_stickers.find_one({"vin": vin}, {"_id": 0, "pdf_base64": 0})
+    cached = await db.window_stickers.find_one({"vin": vin}, {"_id": 1, "size_bytes": 1})
     if cached:
         logger.info(f"Window Sticker trouvé en cache pour VIN={vin}")
         return {
@@ -77,7 +76,8 @@ async def get_window_sticker(vin: str, authorization: Optional[str] = Header(Non
     
     if result["success"]:
         # Sauvegarder dans MongoDB
-        await save_window_sticker_to_db(vin, result["pdf_base64"], user["id"])
+        if result["method"] != "cache":
+            await save_window_sticker_to_db(vin, result["pdf_bytes"], user["id"])
         
         return {
             "success": True,
@@ -98,13 +98,12 @@ async def get_window_sticker_pdf(vin: str):
     """
     from fastapi.responses import Response
     
-    doc = await db.window_stickers.find_one({"vin": vin})
+    doc = await db.window_stickers.find_one({"vin": vin}, {"_id": 0, "pdf": 1, "pdf_base64": 1})
+    pdf_bytes = window_sticker_pdf_bytes(doc)
     
-    if not doc or "pdf_base64" not in doc:
+    if not pdf_bytes:
         raise HTTPException(status_code=404, detail="Window Sticker non trouvé")
     
-    pdf_bytes = base64.b64decode(doc["pdf_base64"])
-    
     return Response(
         content=pdf_bytes,
         media_type="application/pdf",
@@ -139,7 +138,7 @@ async def send_calculation_email(request: SendCalculationEmailRequest, authoriza
         
         # ============ WINDOW STICKER ============
         window_sticker_pdf = None
-        window_sticker_images = []  # Liste des images converties du PDF
+        window_sticker_image = None  # JPEG de la 1re page du PDF (image inline CID)
         window_sticker_url = None
         vin = request.vin or vehicle.get("vin", "")
         
@@ -147,37 +146,37 @@ async def send_calculation_email(request: SendCalculationEmailRequest, authoriza
             logger.info(f"Récupération Window Sticker pour VIN={vin}")
             
             # Vérifier cache MongoDB
-            cached = await db.window_stickers.find_one({"vin": vin})
-            
-            if cached and "pdf_base64" in cached:
-                window_sticker_pdf = base64.b64decode(cached["pdf_base64"])
+            cached = await db.window_stickers.find_one(
+                {"vin": vin}, {"_id": 0, "pdf": 1, "pdf_base64": 1, "preview_jpeg": 1}
+            )
+            window_sticker_pdf = window_sticker_pdf_bytes(cached)
+            if window_sticker_pdf:
                 logger.info(f"Window Sticker trouvé en cache: {len(window_sticker_pdf)} bytes")
             else:
                 # Télécharger depuis Chrysler/Stellantis
                 ws_result = await fetch_window_sticker(vin, vehicle.get("brand"))
                 if ws_result["success"]:
-                    window_sticker_pdf = base64.b64decode(ws_result["pdf_base64"])
+                    window_sticker_pdf = ws_result["pdf_bytes"]
                     # Sauvegarder dans MongoDB
-                    await save_window_sticker_to_db(vin, ws_result["pdf_base64"], "system")
+                    if ws_result["method"] != "cache":
+                        await save_window_sticker_to_db(vin, ws_result["pdf_bytes"], "system")
                     logger.info(f"Window Sticker téléchargé et sauvegardé: {len(window_sticker_pdf)} bytes")
                 else:
                     logger.warning(f"Window Sticker non disponible: {ws_result.get('error')}")
             
-            # Convertir le PDF en images pour l'email
-            if window_sticker_pdf:
-                window_sticker_images = convert_pdf_to_images(window_sticker_pdf, max_pages=2, dpi=120)
-                logger.info(f"Window Sticker converti en {len(window_sticker_images)} image(s)")
+            # Image inline: aperçu déjà rendu en cache, sinon rendu de la 1re page
+            # du PDF (seule page affichée) puis mémorisé pour les prochains envois
+            if window_sticker_pdf and cached and cached.get("preview_jpeg"):
+                window_sticker_image = bytes(cached["preview_jpeg"])
+            elif window_sticker_pdf:
+                images = await convert_pdf_to_images_async(window_sticker_pdf, max_pages=1, dpi=120)
+                if images:
+                    window_sticker_image = images[0]["jpeg"]
+                    await save_window_sticker_preview(vin, images[0])
+                    logger.info(f"Window Sticker converti en image ({images[0]['size_kb']} KB)")
             
             # Construire l'URL du Window Sticker (basé sur la marque)
-            brand_lower = vehicle.get("brand", "jeep").lower()
-            if "chrysler" in brand_lower:
-                window_sticker_url = f"https://www.chrysler.com/hostd/windowsticker/getWindowStickerPdf.do?vin={vin}"
-            elif "dodge" in brand_lower:
-                window_sticker_url = f"https://www.dodge.com/hostd/windowsticker/getWindowStickerPdf.do?vin={vin}"
-            elif "ram" in brand_lower:
-                window_sticker_url = f"https://www.ramtrucks.com/hostd/windowsticker/getWindowStickerPdf.do?vin={vin}"
-            else:
-                window_sticker_url = f"https://www.jeep.com/hostd/windowsticker/getWindowStickerPdf.do?vin={vin}"
+            window_sticker_url = window_sticker_pdf_url(vin, vehicle.get("brand"))
         
         # Get comparison data
         comparison = None
@@ -388,7 +387,7 @@ async def send_calculation_email(request: SendCalculationEmailRequest, authoriza
                     {generate_lease_email_html(request.lease_data, freq, freq_label, fmt, fmt2)}
                     
                     <!-- WINDOW STICKER SECTION WITH IMAGES -->
-                    {generate_window_sticker_html(vin, window_sticker_images, window_sticker_url, window_sticker_pdf)}
+                    {generate_window_sticker_html(vin, [window_sticker_image] if window_sticker_image else [], window_sticker_url, window_sticker_pdf)}
                 </div>
                 
                 <div class="footer">
@@ -408,17 +407,16 @@ async def send_calculation_email(request: SendCalculationEmailRequest, authoriza
         # Envoyer l'email avec ou sans Window Sticker en pièce jointe
         # Préparer les images inline pour CID
         inline_images = []
-        if window_sticker_images and len(window_sticker_images) > 0:
-            img = window_sticker_images[0]
+        if window_sticker_image:
             inline_images.append({
                 'cid': f'windowsticker_{vin}',
-                'data': base64.b64decode(img['base64']),
+                'data': window_sticker_image,
                 'subtype': 'jpeg',
                 'filename': f'WindowSticker_{vin}.jpg'
             })
         
         if window_sticker_pdf:
-            send_email(
+            await send_email(
                 request.client_email, 
                 subject, 
                 html_body, 
@@ -429,7 +427,7 @@ async def send_calculation_email(request: SendCalculationEmailRequest, authoriza
             )
             return {"success": True, "message": f"Email envoyé à {request.client_email}" + (f" (CC: {user_email})" if user_email else "")}
         else:
-            send_email(
+            await send_email(
                 request.client_email, 
                 subject, 
                 html_body, 
@@ -518,7 +516,7 @@ async def send_import_report(request: SendReportEmailRequest):
         
         subject = f"✅ Import {month_name} {request.program_year} - {request.programs_count} programmes"
         
-        send_email(SMTP_EMAIL, subject, html_body)
+        await send_email(SMTP_EMAIL, subject, html_body)
         
         return {"success": True, "message": "Rapport envoyé par email"}
         
@@ -537,7 +535,7 @@ async def test_email():
             <p style="color: #666;">CalcAuto AiPro</p>
         </div>
         """
-        send_email(SMTP_EMAIL, "🧪 Test CalcAuto AiPro - Email OK", html_body)
+        await send_email(SMTP_EMAIL, "🧪 Test CalcAuto AiPro - Email OK", html_body)
         return {"success": True, "message": f"Email de test envoyé à {SMTP_EMAIL}"}
     except Exception as e:
 
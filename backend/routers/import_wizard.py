@@ -13,7 +13,7 @@ from models import (
     PDFExtractRequest, ProgramPreview, ExtractedDataResponse,
     SaveProgramsRequest, FinancingRates, VehicleProgram
 )
-from dependencies import get_current_user
+from dependencies import get_current_user, invalidate_user_cache
 from services.email_service import send_email
 
 try:
@@ -1958,6 +1958,7 @@ async def save_programs(request: SaveProgramsRequest):
     
     # Force logout all users after data change
     await db.tokens.delete_many({})
+    invalidate_user_cache()
     logger.info(f"[PDF IMPORT] Tokens invalides pour forcer reconnexion")
 
     return {
@@ -2096,7 +2097,7 @@ async def send_import_report_email(programs_count: int, program_month: int, prog
     
     subject = f"✅ Import {month_name} {program_year} - {programs_count} programmes"
     
-    send_email(SMTP_EMAIL, subject, html_body)
+    await send_email(SMTP_EMAIL, subject, html_body)
 
 async def cleanup_old_programs():
     """Supprime les programmes de plus de 6 mois"""
@@ -1,9 +1,13 @@
 from fastapi import APIRouter, HTTPException, Header
-from typing import Optional, List, Dict, Any
+from fastapi.responses import ORJSONResponse
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from typing import Optional, List, Dict, Any, NamedTuple
 from datetime import datetime
 import uuid
 import json
-from database import db, logger
+import heapq
+from database import client, db, logger
 from models import (
     InventoryVehicle, InventoryCreate, InventoryUpdate,
     VehicleOption, ProductCode
@@ -14,6 +18,99 @@ from routers.invoice import get_full_vehicle_info, _CODE_PROGRAM_MAPPING
 
 router = APIRouter()
 
+
+# ============ Financing Index (précalculé au chargement) ============
+
+class _CodeRow(NamedTuple):
+    """Code produit avec champs de recherche normalisés et réponse prête"""
+    code: str
+    brand_lc: str
+    model_lc: str
+    trim_lc: str
+    year: Optional[str]
+    result: Dict[str, Any]
+
+
+def _build_financing_index():
+    """Construit les lignes de recherche et le résumé par marque une seule fois"""
+    rows = []
+    by_brand = {}
+    best_deals = []
+    
+    for code, data in _CODE_PROGRAM_MAPPING.items():
+        vehicle = data.get("vehicle", {})
+        financing = data.get("financing", {})
+        consumer_cash = financing.get("consumer_cash", 0)
+        bonus_cash = financing.get("bonus_cash", 0)
+        total_rebates = consumer_cash + bonus_cash
+        
+        rows.append(_CodeRow(
+            code=code,
+            brand_lc=(vehicle.get("brand") or "").lower(),
+            model_lc=(vehicle.get("model") or "").lower(),
+            trim_lc=(vehicle.get("trim") or "").lower(),
+            year=vehicle.get("year"),
+            result={
+                "code": code,
+                "vehicle": vehicle,
+                "financing": {
+                    "consumer_cash": consumer_cash,
+                    "bonus_cash": bonus_cash,
+                    "total_rebates": total_rebates,
+                    "option1_available": any(v for v in financing.get("option1_rates", {}).values() if v is not None),
+                    "option2_available": any(v for v in financing.get("option2_rates", {}).values() if v is not None)
+                }
+            }
+        ))
+        
+        brand = vehicle.get("brand", "Unknown")
+        summary = by_brand.setdefault(brand, {
+            "count": 0,
+            "max_consumer_cash": 0,
+            "max_bonus_cash": 0,
+            "models": set()
+        })
+        summary["count"] += 1
+        summary["max_consumer_cash"] = max(summary["max_consumer_cash"], consumer_cash)
+        summary["max_bonus_cash"] = max(summary["max_bonus_cash"], bonus_cash)
+        model_name = vehicle.get("model", "")
+        summary["models"].add(model_name)
+        
+        # Collecter les meilleures offres
+        if total_rebates > 5000:
+            best_deals.append({
+                "code": code,
+                "brand": brand,
+                "model": model_name,
+                "trim": vehicle.get("trim", ""),
+                "total_rebate": total_rebates,
+                "consumer_cash": consumer_cash,
+                "bonus_cash": bonus_cash
+            })
+    
+    # Figer les modèles en tuples triés (une seule fois, pas par requête)
+    for summary in by_brand.values():
+        summary["models"] = tuple(sorted(summary["models"]))
+    
+    best_deals = heapq.nlargest(10, best_deals, key=lambda x: x["total_rebate"])
+    return rows, by_brand, best_deals
+
+
+_CODE_INDEX, _BRAND_SUMMARY, _BEST_DEALS = _build_financing_index()
+
+# Réponse complète de /financing/summary (le mapping ne change pas à l'exécution)
+_FINANCING_SUMMARY = {
+    "success": True,
+    "total_codes": len(_CODE_PROGRAM_MAPPING),
+    "by_brand": _BRAND_SUMMARY,
+    "best_deals": _BEST_DEALS
+}
+
+# Lignes regroupées par marque (minuscule) pour les recherches filtrées par marque
+_CODE_INDEX_BY_BRAND: Dict[str, List[_CodeRow]] = {}
+for _row in _CODE_INDEX:
+    _CODE_INDEX_BY_BRAND.setdefault(_row.brand_lc, []).append(_row)
+
 # ============ Inventory Endpoints ============
 
 @router.get("/inventory")
@@ -69,14 +166,16 @@ async def create_inventory_vehicle(vehicle: InventoryCreate, authorization: Opti
     """Ajoute un véhicule à l'inventaire et télécharge le Window Sticker automatiquement"""
     user = await get_current_user(authorization)
     
-    # Check if stock_no already exists
-    existing = await db.inventory.find_one({"stock_no": vehicle.stock_no, "owner_id": user["id"]})
-    if existing:
+    # Vérification explicite du stock_no (IXSCAN sur l'index unique): reste
+    # valable si l'index n'a pas pu être créé à cause de doublons existants
+    if await db.inventory.find_one({"stock_no": vehicle.stock_no, "owner_id": user["id"]}, {"_id": 1}):
         raise HTTPException(status_code=400, detail=f"Le numéro de stock {vehicle.stock_no} existe déjà dans l'inventaire")
     
     # Check if VIN already exists (if provided)
     if vehicle.vin:
-        existing_vin = await db.inventory.find_one({"vin": vehicle.vin, "owner_id": user["id"]})
+        existing_vin = await db.inventory.find_one(
+            {"vin": vehicle.vin, "owner_id": user["id"]}, {"_id": 0, "stock_no": 1}
+        )
         if existing_vin:
             raise HTTPException(status_code=400, detail=f"Le VIN {vehicle.vin} existe déjà (Stock #{existing_vin.get('stock_no')})")
     
@@ -84,19 +183,6 @@ async def create_inventory_vehicle(vehicle: InventoryCreate, authorization: Opti
     # NOTE: E.P. FCA inclut DÉJÀ la déduction du holdback, donc net_cost = E.P.
     net_cost = vehicle.ep_cost if vehicle.ep_cost else 0
     
-    # ===== TÉLÉCHARGER LE WINDOW STICKER AUTOMATIQUEMENT =====
-    window_sticker_available = False
-    if vehicle.vin and len(vehicle.vin) == 17:
-        try:
-            logger.info(f"Téléchargement Window Sticker pour VIN={vehicle.vin}")
-            ws_result = await fetch_window_sticker(vehicle.vin, vehicle.brand)
-            if ws_result["success"]:
-                await save_window_sticker_to_db(vehicle.vin, ws_result["pdf_base64"], user["id"])
-                window_sticker_available = True
-                logger.info(f"Window Sticker sauvegardé pour VIN={vehicle.vin}")
-        except Exception as e:
-            logger.warning(f"Erreur téléchargement Window Sticker: {e}")
-    
     vehicle_data = InventoryVehicle(
         owner_id=user["id"],
         stock_no=vehicle.stock_no,
@@ -117,7 +203,26 @@ async def create_inventory_vehicle(vehicle: InventoryCreate, authorization: Opti
         color=vehicle.color
     )
     
-    await db.inventory.insert_one(vehicle_data.dict())
+    # Insertion concurrente du même stock_no: rejetée par l'index unique (owner_id, stock_no)
+    try:
+        await db.inventory.insert_one(vehicle_data.dict())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail=f"Le numéro de stock {vehicle.stock_no} existe déjà dans l'inventaire")
+    
+    # ===== TÉLÉCHARGER LE WINDOW STICKER AUTOMATIQUEMENT =====
+    window_sticker_available = False
+    if vehicle.vin and len(vehicle.vin) == 17:
+        try:
+            logger.info(f"Téléchargement Window Sticker pour VIN={vehicle.vin}")
+            ws_result = await fetch_window_sticker(vehicle.vin, vehicle.brand)
+            if ws_result["success"]:
+                if ws_result["method"] != "cache":
+                    await save_window_sticker_to_db(vehicle.vin, ws_result["pdf_bytes"], user["id"])
+                    logger.info(f"Window Sticker sauvegardé pour VIN={vehicle.vin}")
+                window_sticker_available = True
+        except Exception as e:
+            logger.warning(f"Erreur téléchargement Window Sticker: {e}")
+    
     return {
         "success": True, 
         "vehicle": vehicle_data.dict(), 
@@ -130,54 +235,62 @@ async def create_inventory_bulk(vehicles: List[InventoryCreate], authorization:
     """Import en masse de véhicules"""
     user = await get_current_user(authorization)
     
-    added = 0
-    updated = 0
+    ops = []
     errors = []
     
     for vehicle in vehicles:
+        # Calculate net_cost
+        # NOTE: E.P. FCA inclut DÉJÀ la déduction du holdback, donc net_cost = E.P.
+        net_cost = vehicle.ep_cost if vehicle.ep_cost else 0
+        
+        vehicle_data = {
+            "id": str(uuid.uuid4()),
+            "owner_id": user["id"],
+            "stock_no": vehicle.stock_no,
+            "vin": vehicle.vin,
+            "brand": vehicle.brand,
+            "model": vehicle.model,
+            "trim": vehicle.trim,
+            "year": vehicle.year,
+            "type": vehicle.type,
+            "pdco": vehicle.pdco,
+            "ep_cost": vehicle.ep_cost,
+            "holdback": vehicle.holdback,
+            "net_cost": net_cost,
+            "msrp": vehicle.msrp,
+            "asking_price": vehicle.asking_price,
+            "km": vehicle.km,
+            "color": vehicle.color,
+            "status": "disponible",
+            "sold_price": None,
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow()
+        }
+        
+        # Upsert: update if exists, insert if not
+        ops.append(UpdateOne(
+            {"stock_no": vehicle.stock_no, "owner_id": user["id"]},
+            {"$set": vehicle_data},
+            upsert=True
+        ))
+    
+    # Un seul aller-retour; ordered=False: une erreur n'arrête pas les autres véhicules
+    added = 0
+    updated = 0
+    if ops:
         try:
-            # Calculate net_cost
-            # NOTE: E.P. FCA inclut DÉJÀ la déduction du holdback, donc net_cost = E.P.
-            net_cost = vehicle.ep_cost if vehicle.ep_cost else 0
-            
-            vehicle_data = {
-                "id": str(uuid.uuid4()),
-                "owner_id": user["id"],
-                "stock_no": vehicle.stock_no,
-                "vin": vehicle.vin,
-                "brand": vehicle.brand,
-                "model": vehicle.model,
-                "trim": vehicle.trim,
-                "year": vehicle.year,
-                "type": vehicle.type,
-                "pdco": vehicle.pdco,
-                "ep_cost": vehicle.ep_cost,
-                "holdback": vehicle.holdback,
-                "net_cost": net_cost,
-                "msrp": vehicle.msrp,
-                "asking_price": vehicle.asking_price,
-                "km": vehicle.km,
-                "color": vehicle.color,
-                "status": "disponible",
-                "sold_price": None,
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }
-            
-            # Upsert: update if exists, insert if not
-            result = await db.inventory.update_one(
-                {"stock_no": vehicle.stock_no, "owner_id": user["id"]},
-                {"$set": vehicle_data},
-                upsert=True
-            )
-            
-            if result.upserted_id:
-                added += 1
-            else:
-                updated += 1
-                
-        except Exception as e:
-            errors.append({"stock_no": vehicle.stock_no, "error": str(e)})
+            result = await db.inventory.bulk_write(ops, ordered=False)
+            added = result.upserted_count
+            updated = result.matched_count
+        except BulkWriteError as bwe:
+            details = bwe.details
+            added = details.get("nUpserted", 0)
+            updated = details.get("nMatched", 0)
+            for write_error in details.get("writeErrors", []):
+                errors.append({
+                    "stock_no": vehicles[write_error["index"]].stock_no,
+                    "error": write_error.get("errmsg", "")
+                })
     
     return {
         "success": True,
@@ -215,13 +328,18 @@ async def delete_inventory_vehicle(stock_no: str, authorization: Optional[str] =
     """Supprime un véhicule de l'inventaire"""
     user = await get_current_user(authorization)
     
-    result = await db.inventory.delete_one({"stock_no": stock_no, "owner_id": user["id"]})
-    
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Véhicule non trouvé")
-    
-    # Also delete associated options
-    await db.vehicle_options.delete_many({"stock_no": stock_no})
+    # Véhicule + options supprimés dans une même transaction (pas d'options orphelines).
+    # Les options ne sont indexées que par stock_no: on ne les supprime qu'une fois
+    # le véhicule de cet utilisateur effectivement supprimé.
+    async with await client.start_session() as session:
+        async with session.start_transaction():
+            result = await db.inventory.delete_one(
+                {"stock_no": stock_no, "owner_id": user["id"]}, session=session
+            )
+            if result.deleted_count == 0:
+                raise HTTPException(status_code=404, detail="Véhicule non trouvé")
+            
+            await db.vehicle_options.delete_many({"stock_no": stock_no}, session=session)
     
     return {"success": True, "message": f"Véhicule {stock_no} supprimé"}
 
@@ -254,7 +372,7 @@ async def add_vehicle_option(stock_no: str, option: VehicleOption, authorization
     user = await get_current_user(authorization)
     
     # Verify vehicle exists and belongs to user
-    vehicle = await db.inventory.find_one({"stock_no": stock_no, "owner_id": user["id"]})
+    vehicle = await db.inventory.find_one({"stock_no": stock_no, "owner_id": user["id"]}, {"_id": 1})
     if not vehicle:
         raise HTTPException(status_code=404, detail="Véhicule non trouvé")
     
@@ -269,35 +387,43 @@ async def get_inventory_stats(authorization: Optional[str] = Header(None)):
     """Statistiques d'inventaire"""
     user = await get_current_user(authorization)
     
-    total = await db.inventory.count_documents({"owner_id": user["id"]})
-    disponible = await db.inventory.count_documents({"owner_id": user["id"], "status": "disponible"})
-    reserve = await db.inventory.count_documents({"owner_id": user["id"], "status": "réservé"})
-    vendu = await db.inventory.count_documents({"owner_id": user["id"], "status": "vendu"})
-    neuf = await db.inventory.count_documents({"owner_id": user["id"], "type": "neuf"})
-    occasion = await db.inventory.count_documents({"owner_id": user["id"], "type": "occasion"})
-    
-    # Calculate total value
+    # Un seul passage: compteurs par statut/type + valeur totale du disponible
     pipeline = [
-        {"$match": {"owner_id": user["id"], "status": "disponible"}},
-        {"$group": {"_id": None, "total_msrp": {"$sum": "$msrp"}, "total_cost": {"$sum": "$net_cost"}}}
+        {"$match": {"owner_id": user["id"]}},
+        {"$facet": {
+            "by_status": [{"$group": {"_id": "$status", "n": {"$sum": 1}}}],
+            "by_type": [{"$group": {"_id": "$type", "n": {"$sum": 1}}}],
+            "totals": [
+                {"$match": {"status": "disponible"}},
+                {"$group": {"_id": None, "total_msrp": {"$sum": "$msrp"}, "total_cost": {"$sum": "$net_cost"}}}
+            ],
+            "total": [{"$count": "n"}]
+        }}
     ]
-    result = await db.inventory.aggregate(pipeline).to_list(1)
-    totals = result[0] if result else {"total_msrp": 0, "total_cost": 0}
+    # $facet renvoie un seul document: lu directement, sans liste intermédiaire
+    facets = {}
+    async for facets in db.inventory.aggregate(pipeline):
+        break
+    
+    by_status = {row["_id"]: row["n"] for row in facets.get("by_status", [])}
+    by_type = {row["_id"]: row["n"] for row in facets.get("by_type", [])}
+    total = facets["total"][0]["n"] if facets.get("total") else 0
+    totals = facets["totals"][0] if facets.get("totals") else {"total_msrp": 0, "total_cost": 0}
     
     return {
         "total": total,
-        "disponible": disponible,
-        "reserve": reserve,
-        "vendu": vendu,
-        "neuf": neuf,
-        "occasion": occasion,
+        "disponible": by_status.get("disponible", 0),
+        "reserve": by_status.get("réservé", 0),
+        "vendu": by_status.get("vendu", 0),
+        "neuf": by_type.get("neuf", 0),
+        "occasion": by_type.get("occasion", 0),
         "total_msrp": totals.get("total_msrp", 0),
         "total_cost": totals.get("total_cost", 0),
         "potential_profit": totals.get("total_msrp", 0) - totals.get("total_cost", 0)
     }
 
 # Product codes reference
-@router.get("/product-codes")
+@router.get("/product-codes", response_class=ORJSONResponse)
 async def get_product_codes():
     """Récupère le référentiel des codes produits (depuis fichier JSON + DB)"""
     # D'abord, charger depuis le fichier JSON master
@@ -323,14 +449,15 @@ async def get_product_codes():
     
     # Ensuite, charger depuis MongoDB (priorité aux données DB)
     try:
-        async for code_doc in db.product_codes.find({}, {"_id": 0}):
+        cursor = db.product_codes.find({}, {"_id": 0}).batch_size(1000)
+        for code_doc in await cursor.to_list(length=None):
             code = code_doc.get("code")
             if code:
                 all_codes[code] = code_doc
     except Exception as e:
         print(f"Erreur chargement DB: {e}")
     
-    return list(all_codes.values())
+    return ORJSONResponse(list(all_codes.values()))
 
 @router.post("/product-codes")
 async def add_product_code(code: ProductCode, authorization: Optional[str] = Header(None)):
@@ -350,7 +477,7 @@ async def get_product_code_financing(code: str):
     Récupère les informations de financement pour un code produit.
     Retourne: consumer cash, bonus cash, taux Option 1 et Option 2.
     """
-    code = code.upper().strip()
+    code = code.strip().upper()
     
     # Obtenir les infos complètes (véhicule + financement)
     full_info = get_full_vehicle_info(code)
@@ -377,41 +504,31 @@ async def lookup_financing_by_vehicle(
     Recherche les programmes de financement par marque/modèle/trim/année.
     Retourne tous les codes produits correspondants avec leurs promotions.
     """
-    results = []
+    brand_lc = brand.lower() if brand else None
+    model_lc = model.lower() if model else None
+    trim_lc = trim.lower() if trim else None
     
-    for code, data in _CODE_PROGRAM_MAPPING.items():
-        vehicle = data.get("vehicle", {})
-        financing = data.get("financing", {})
-        
+    candidates = _CODE_INDEX_BY_BRAND.get(brand_lc, []) if brand_lc else _CODE_INDEX
+    
+    results = []
+    for row in candidates:
         # Filtrer par critères
-        if brand and vehicle.get("brand", "").lower() != brand.lower():
-            continue
-        if model and model.lower() not in vehicle.get("model", "").lower():
+        if model_lc and model_lc not in row.model_lc:
             continue
-        if trim and trim.lower() not in vehicle.get("trim", "").lower():
+        if trim_lc and trim_lc not in row.trim_lc:
             continue
-        if year and vehicle.get("year") != year:
+        if year and row.year != year:
             continue
         
-        results.append({
-            "code": code,
-            "vehicle": vehicle,
-            "financing": {
-                "consumer_cash": financing.get("consumer_cash", 0),
-                "bonus_cash": financing.get("bonus_cash", 0),
-                "total_rebates": financing.get("consumer_cash", 0) + financing.get("bonus_cash", 0),
-                "option1_available": any(v for v in financing.get("option1_rates", {}).values() if v is not None),
-                "option2_available": any(v for v in financing.get("option2_rates", {}).values() if v is not None)
-            }
-        })
+        results.append(row.result)
     
-    # Trier par total rebates (descending)
-    results.sort(key=lambda x: x["financing"]["total_rebates"], reverse=True)
+    # Top 50 par total rebates (descending)
+    top_results = heapq.nlargest(50, results, key=lambda x: x["financing"]["total_rebates"])
     
     return {
         "success": True,
         "count": len(results),
-        "results": results[:50]  # Limiter à 50 résultats
+        "results": top_results
     }
 
 @router.get("/financing/summary")
@@ -420,57 +537,5 @@ async def get_financing_summary():
     Retourne un résumé des programmes de financement disponibles.
     Utile pour afficher les meilleures offres.
     """
-    by_brand = {}
-    best_deals = []
-    
-    for code, data in _CODE_PROGRAM_MAPPING.items():
-        vehicle = data.get("vehicle", {})
-        financing = data.get("financing", {})
-        brand = vehicle.get("brand", "Unknown")
-        
-        if brand not in by_brand:
-            by_brand[brand] = {
-                "count": 0,
-                "max_consumer_cash": 0,
-                "max_bonus_cash": 0,
-                "models": set()
-            }
-        
-        by_brand[brand]["count"] += 1
-        by_brand[brand]["max_consumer_cash"] = max(
-            by_brand[brand]["max_consumer_cash"],
-            financing.get("consumer_cash", 0)
-        )
-        by_brand[brand]["max_bonus_cash"] = max(
-            by_brand[brand]["max_bonus_cash"],
-            financing.get("bonus_cash", 0)
-        )
-        by_brand[brand]["models"].add(vehicle.get("model", ""))
-        
-        # Collecter les meilleures offres
-        total_rebate = financing.get("consumer_cash", 0) + financing.get("bonus_cash", 0)
-        if total_rebate > 5000:
-            best_deals.append({
-                "code": code,
-                "brand": brand,
-                "model": vehicle.get("model", ""),
-                "trim": vehicle.get("trim", ""),
-                "total_rebate": total_rebate,
-                "consumer_cash": financing.get("consumer_cash", 0),
-                "bonus_cash": financing.get("bonus_cash", 0)
-            })
-    
-    # Convertir les sets en listes
-    for brand in by_brand:
-        by_brand[brand]["models"] = list(by_brand[brand]["models"])
-    
-    # Trier les meilleures offres
-    best_deals.sort(key=lambda x: x["total_rebate"], reverse=True)
-    
-    return {
-        "success": True,
-        "total_codes": len(_CODE_PROGRAM_MAPPING),
-        "by_brand": by_brand,
-        "best_deals": best_deals[:10]
-    }
+    return _FINANCING_SUMMARY
 
@@ -5,20 +5,31 @@ from typing import Optional, List, Dict, Any
 from datetime import datetime
 import uuid
 import json
+import asyncio
 import re
 import os
 import io
 import base64
+import copy
 import hashlib
+import mmap
+import sys
 import time
-import tempfile
-from database import db, OPENAI_API_KEY, ROOT_DIR, logger
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from types import MappingProxyType
+from pymongo import DeleteMany, InsertOne, ReturnDocument
+from database import client, db, OPENAI_API_KEY, ROOT_DIR, logger
 from models import InventoryVehicle, InvoiceScanRequest, ExcelExportRequest
 from dependencies import get_current_user
 from services.window_sticker import fetch_window_sticker, save_window_sticker_to_db
+from ocr import tesseract_image_to_string
+from validation import get_blocking_errors
+from services.metrics_buffer import parsing_metrics_buffer
 
 # OCR imports
-import pytesseract
+import pdfplumber
 from PIL import Image
 import cv2
 import numpy as np
@@ -32,6 +43,43 @@ except ImportError:
 
 router = APIRouter()
 
+# Grand côté maximal utile au scan (prétraitement Vision: 2000px, OCR zones: 1800px)
+_SCAN_IMAGE_MAX_DIM = 2000
+# Au-delà de cette taille, le décodage base64 et le hash sont faits dans un thread
+_BASE64_INLINE_MAX = 256 * 1024
+
+# Pool dédié au travail CPU du scan (pdfplumber, OpenCV, Tesseract) pour ne pas
+# bloquer la boucle d'événements. OpenCV et tesserocr (Tesseract en processus)
+# libèrent le GIL pendant leurs appels C++, des threads suffisent.
+_OCR_POOL = ThreadPoolExecutor(max_workers=max(2, (os.cpu_count() or 2) // 2), thread_name_prefix="ocr")
+
+
+async def _run_ocr(fn, *args):
+    """Exécute une étape bloquante du pipeline OCR dans _OCR_POOL"""
+    return await asyncio.get_running_loop().run_in_executor(_OCR_POOL, fn, *args)
+
+
+# Au-delà de cette taille, un upload est lu via mmap de son fichier temporaire
+_UPLOAD_MMAP_MIN = 5 * 1024 * 1024
+
+
+async def _read_upload(file: UploadFile):
+    """
+    Contenu d'un fichier uploadé.
+    Starlette spoule déjà les gros uploads sur disque: au-delà de _UPLOAD_MMAP_MIN,
+    on mappe ce fichier en lecture seule au lieu de le recopier en mémoire.
+    Le mmap se comporte comme des bytes pour le pipeline (slice, hash, numpy,
+    base64) et est libéré avec la requête.
+    """
+    if (file.size or 0) <= _UPLOAD_MMAP_MIN:
+        return await file.read()
+    
+    try:
+        await file.seek(0)
+        return mmap.mmap(file.file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, io.UnsupportedOperation):
+        return await file.read()
+
 # ============ Invoice Scanner with AI ============
 
 import re
@@ -50,6 +98,19 @@ VIN_TRANSLATION = {
 # Poids par position pour calcul check digit
 VIN_WEIGHTS = [8,7,6,5,4,3,2,10,0,9,8,7,6,5,4,3,2]
 
+# Contribution pondérée (valeur × poids) de chaque octet, par position.
+# La position 9 (check digit) a un poids de 0, donc contribue toujours 0.
+_VIN_CONTRIB = tuple(
+    tuple(VIN_TRANSLATION.get(chr(b), 0) * VIN_WEIGHTS[i] for b in range(256))
+    for i in range(17)
+)
+
+# Check digit attendu (octet ASCII) pour chaque reste modulo 11
+_VIN_CHECK_CHARS = b"0123456789X"
+
+# Octets interdits dans un VIN (I, O, Q)
+_VIN_FORBIDDEN = frozenset(b"IOQ")
+
 # Corrections OCR communes
 VIN_OCR_CORRECTIONS = {
     "O": "0",  # O ressemble à 0
@@ -61,6 +122,27 @@ VIN_OCR_CORRECTIONS = {
     "B": "8",  # B peut ressembler à 8
 }
 
+# Candidats de correction OCR précompilés en octets (utilisés par auto_correct_vin)
+_VIN_OCR_CORRECTION_BYTES = {old: ord(new) for old, new in VIN_OCR_CORRECTIONS.items()}
+
+# Permutations communes FCA, dans l'ordre d'essai
+_VIN_COMMON_SWAPS = tuple((old, ord(new)) for old, new in [
+    ("P", "J"), ("J", "P"),
+    ("P", "S"), ("S", "P"),  # P et S se ressemblent
+    ("5", "S"), ("S", "5"),  # 5 et S se ressemblent
+    ("7", "T"), ("T", "7"),
+    ("X", "K"), ("K", "X"),
+    ("6", "G"), ("G", "6"),
+    ("Y", "T"), ("T", "Y"),
+    ("0", "D"), ("D", "0"),
+    ("8", "B"), ("B", "8"),
+])
+
+# Corrections de l'année (position 10): caractère lu → remplacements, dans l'ordre d'essai
+_VIN_YEAR_SWAPS = {}
+for _old, _new in [("P", "S"), ("S", "P"), ("R", "S"), ("S", "R"), ("P", "R"), ("T", "7")]:
+    _VIN_YEAR_SWAPS.setdefault(_old, []).append(ord(_new))
+
 # Codes année (10e caractère)
 VIN_YEAR_CODES = {
     'A': 2010, 'B': 2011, 'C': 2012, 'D': 2013, 'E': 2014,
@@ -89,37 +171,60 @@ VIN_WMI_MAP = {
 
 def compute_vin_check_digit(vin: str) -> str:
     """Calcule le check digit (9e caractère) d'un VIN"""
-    total = 0
-    for i, char in enumerate(vin.upper()):
-        if i == 8:  # Skip position du check digit
-            continue
-        value = VIN_TRANSLATION.get(char, 0)
-        total += value * VIN_WEIGHTS[i]
+    buf = vin.upper().encode("ascii", "replace")
+    total = sum(_VIN_CONTRIB[i][b] for i, b in enumerate(buf))
     
     remainder = total % 11
     return "X" if remainder == 10 else str(remainder)
 
 
-def validate_vin_checksum(vin: str) -> bool:
-    """Valide le check digit d'un VIN"""
-    vin = vin.upper()
+def _vin_buf_is_valid(buf) -> bool:
+    """Valide le check digit d'un VIN déjà en octets majuscules (17 octets)"""
+    # VIN ne peut pas contenir I, O, Q
+    if _VIN_FORBIDDEN.intersection(buf):
+        return False
+    
+    total = sum(_VIN_CONTRIB[i][b] for i, b in enumerate(buf))
+    return buf[8] == _VIN_CHECK_CHARS[total % 11]
+
+
+@lru_cache(maxsize=4096)
+def validate_vin_checksum(vin) -> bool:
+    """Valide le check digit d'un VIN (str ou bytes)"""
+    if isinstance(vin, str):
+        vin = vin.upper().encode("ascii", "replace")
+    else:
+        vin = vin.upper()
     
     if len(vin) != 17:
         return False
     
-    # VIN ne peut pas contenir I, O, Q
-    if any(c in "IOQ" for c in vin):
+    return _vin_buf_is_valid(vin)
+
+
+def _vin_delta_is_valid(buf, total: int, bad: frozenset, i: int, new_b: int) -> bool:
+    """
+    Valide le VIN comme si buf[i] valait new_b, à partir du total pondéré
+    déjà calculé: seule la contribution de la position i change.
+    """
+    if new_b in _VIN_FORBIDDEN or (bad and bad != {i}):
         return False
     
-    expected = compute_vin_check_digit(vin)
-    return vin[8] == expected
+    new_total = total - _VIN_CONTRIB[i][buf[i]] + _VIN_CONTRIB[i][new_b]
+    check = new_b if i == 8 else buf[8]
+    return check == _VIN_CHECK_CHARS[new_total % 11]
 
 
+@lru_cache(maxsize=4096)
 def auto_correct_vin(vin: str) -> tuple:
     """
     Corrige automatiquement les erreurs OCR communes dans un VIN.
     Essaie plusieurs stratégies de correction.
     
+    Le total pondéré est calculé une seule fois; chaque candidat est validé
+    par mise à jour incrémentale, et seul le candidat retenu est écrit dans
+    le bytearray.
+    
     Returns: (vin_corrigé, was_corrected)
     """
     vin = vin.upper().replace("-", "").replace(" ", "")
@@ -127,59 +232,56 @@ def auto_correct_vin(vin: str) -> tuple:
     if len(vin) != 17:
         return vin, False
     
+    buf = bytearray(vin.encode("ascii", "replace"))
+    
     # Déjà valide ?
-    if validate_vin_checksum(vin):
+    if _vin_buf_is_valid(buf):
         return vin, False
     
+    total = sum(_VIN_CONTRIB[i][b] for i, b in enumerate(buf))
+    bad = frozenset(i for i, b in enumerate(buf) if b in _VIN_FORBIDDEN)
+    
+    def accept(i: int, new_b: int) -> str:
+        buf[i] = new_b
+        return buf.decode()
+    
+    # Un seul passage sur le VIN: positions de chaque caractère
+    positions = {}
+    for i, char in enumerate(vin):
+        positions.setdefault(char, []).append(i)
+    
     # Stratégie 1: Corrections simples caractère par caractère
     for i, char in enumerate(vin):
-        if char in VIN_OCR_CORRECTIONS:
-            corrected = vin[:i] + VIN_OCR_CORRECTIONS[char] + vin[i+1:]
-            if validate_vin_checksum(corrected):
-                return corrected, True
+        new_b = _VIN_OCR_CORRECTION_BYTES.get(char)
+        if new_b is not None and _vin_delta_is_valid(buf, total, bad, i, new_b):
+            return accept(i, new_b), True
     
     # Stratégie 2: Permutations communes FCA (P↔J, S↔5, X↔K, etc.)
-    common_swaps = [
-        ("P", "J"), ("J", "P"),
-        ("P", "S"), ("S", "P"),  # P et S se ressemblent
-        ("5", "S"), ("S", "5"),  # 5 et S se ressemblent
-        ("7", "T"), ("T", "7"),
-        ("X", "K"), ("K", "X"),
-        ("6", "G"), ("G", "6"),
-        ("Y", "T"), ("T", "Y"),
-        ("0", "D"), ("D", "0"),
-        ("8", "B"), ("B", "8"),
-    ]
-    for old, new in common_swaps:
-        for i, char in enumerate(vin):
-            if char == old:
-                corrected = vin[:i] + new + vin[i+1:]
-                if validate_vin_checksum(corrected):
-                    return corrected, True
+    for old, new_b in _VIN_COMMON_SWAPS:
+        for i in positions.get(old, ()):
+            if _vin_delta_is_valid(buf, total, bad, i, new_b):
+                return accept(i, new_b), True
     
     # Stratégie 3: Corriger l'année (position 10) - très important
     # P souvent confondu avec S (2023 vs 2025)
     year_pos = 9  # Index 9 = position 10
-    year_swaps = [("P", "S"), ("S", "P"), ("R", "S"), ("S", "R"), ("P", "R"), ("T", "7")]
-    for old, new in year_swaps:
-        if vin[year_pos] == old:
-            test = vin[:year_pos] + new + vin[year_pos+1:]
-            if validate_vin_checksum(test):
-                return test, True
+    for new_b in _VIN_YEAR_SWAPS.get(vin[year_pos], ()):
+        if _vin_delta_is_valid(buf, total, bad, year_pos, new_b):
+            return accept(year_pos, new_b), True
     
     # Stratégie 4: Combinaisons multiples pour VINs Jeep/Ram
     # Position 5: K souvent lu comme X
-    if len(vin) >= 6 and vin[4] in ["X", "K"]:
-        swap = "K" if vin[4] == "X" else "X"
-        test = vin[:4] + swap + vin[5:]
-        if validate_vin_checksum(test):
-            return test, True
-        # Essayer avec correction année aussi
+    if vin[4] in ["X", "K"]:
+        swap = ord("K" if vin[4] == "X" else "X")
+        if _vin_delta_is_valid(buf, total, bad, 4, swap):
+            return accept(4, swap), True
+        # Essayer avec correction année aussi (total et octet de la position 5 mis à jour)
+        total_swapped = total - _VIN_CONTRIB[4][buf[4]] + _VIN_CONTRIB[4][swap]
+        buf[4] = swap
         for old, new in [("P", "S"), ("S", "P")]:
-            if vin[year_pos] == old:
-                test2 = test[:year_pos] + new + test[year_pos+1:]
-                if validate_vin_checksum(test2):
-                    return test2, True
+            if vin[year_pos] == old and _vin_delta_is_valid(buf, total_swapped, bad, year_pos, ord(new)):
+                return accept(year_pos, ord(new)), True
+        buf[4] = ord(vin[4])
     
     # Stratégie 5: Recalculer check digit si tout le reste semble OK
     expected_check = compute_vin_check_digit(vin)
@@ -272,11 +374,11 @@ def decode_vin(vin: str) -> dict:
 # ============ FCA Product Code Database ============
 
 # Charger la base de codes 2026 depuis le fichier JSON
-import json as _json
+import orjson
 _FCA_CODES_2026 = {}
 try:
-    with open(os.path.join(str(ROOT_DIR), 'data', 'fca_product_codes_2026.json'), 'r') as f:
-        _codes_raw = _json.load(f)
+    with open(os.path.join(str(ROOT_DIR), 'data', 'fca_product_codes_2026.json'), 'rb') as f:
+        _codes_raw = orjson.loads(f.read())
         for code, info in _codes_raw.items():
             _FCA_CODES_2026[code] = {
                 "brand": info.get("brand"),
@@ -293,8 +395,8 @@ except Exception as e:
 _CODE_PROGRAM_MAPPING = {}
 try:
     mapping_file = os.path.join(str(ROOT_DIR), 'data', 'code_program_mapping.json')
-    with open(mapping_file, 'r') as f:
-        _CODE_PROGRAM_MAPPING = _json.load(f)
+    with open(mapping_file, 'rb') as f:
+        _CODE_PROGRAM_MAPPING = orjson.loads(f.read())
     print(f"[FCA] Loaded {len(_CODE_PROGRAM_MAPPING)} code->program mappings")
 except Exception as e:
     print(f"[FCA] Warning: Could not load code->program mapping: {e}")
@@ -304,9 +406,10 @@ def get_financing_for_code(code: str) -> Optional[Dict[str, Any]]:
     Retourne les informations de financement pour un code produit.
     Inclut: consumer_cash, bonus_cash, taux Option 1 et Option 2.
     """
-    code = code.upper().strip()
-    if code in _CODE_PROGRAM_MAPPING:
-        return _CODE_PROGRAM_MAPPING[code]['financing']
+    code = code.strip().upper()
+    mapping = _CODE_PROGRAM_MAPPING.get(code)
+    if mapping is not None:
+        return mapping['financing']
     return None
 
 def get_full_vehicle_info(code: str) -> Optional[Dict[str, Any]]:
@@ -315,14 +418,16 @@ def get_full_vehicle_info(code: str) -> Optional[Dict[str, Any]]:
     - Détails du véhicule (marque, modèle, trim, etc.)
     - Informations de financement (consumer cash, bonus cash, taux)
     """
-    code = code.upper().strip()
-    if code in _CODE_PROGRAM_MAPPING:
-        return _CODE_PROGRAM_MAPPING[code]
+    code = code.strip().upper()
+    mapping = _CODE_PROGRAM_MAPPING.get(code)
+    if mapping is not None:
+        return mapping
     # Fallback: retourner juste les infos du véhicule sans financement
-    if code in _FCA_CODES_2026:
+    vehicle = _FCA_CODES_2026.get(code)
+    if vehicle is not None:
         return {
             'code': code,
-            'vehicle': _FCA_CODES_2026[code],
+            'vehicle': vehicle,
             'financing': None
         }
     return None
@@ -389,11 +494,45 @@ _FCA_FALLBACK_CODES = {
     "RUXL78": {"brand": "Chrysler", "model": "Pacifica", "trim": "Pinnacle", "body": "AWD", "description": "Chrysler Pacifica Pinnacle AWD"},
 }
 
-# Fusionner avec PRIORITÉ au fichier JSON (codes officiels 2025/2026)
-FCA_PRODUCT_CODES = {
-    **_FCA_FALLBACK_CODES,  # Codes fallback en premier (seront écrasés par JSON)
-    **_FCA_CODES_2026,      # Codes officiels du JSON en dernier (priorité maximale)
+# Vue combinée avec PRIORITÉ au fichier JSON (codes officiels 2025/2026),
+# sans copier les deux dictionnaires
+FCA_PRODUCT_CODES = ChainMap(
+    _FCA_CODES_2026,      # Codes officiels du JSON en premier (priorité maximale)
+    _FCA_FALLBACK_CODES,  # Codes fallback en dur
+)
+
+# Interner le vocabulaire fixe (marque, modèle, trim...): chaque véhicule décodé
+# référence alors la même chaîne au lieu d'une copie par code
+for _codes in (_FCA_CODES_2026, _FCA_FALLBACK_CODES):
+    for _info in _codes.values():
+        for _key in ("brand", "model", "trim", "body", "description"):
+            if isinstance(_info.get(_key), str):
+                _info[_key] = sys.intern(_info[_key])
+
+# Préfixes de codes produits connus (2 caractères) -> (marque, modèle)
+_PRODUCT_CODE_PREFIXES = {
+    "DJ": ("Ram", "2500"),
+    "DT": ("Ram", "1500"),
+    "DS": ("Ram", "1500"),
+    "D2": ("Ram", "3500"),
+    "JL": ("Jeep", "Wrangler"),
+    "WK": ("Jeep", "Grand Cherokee"),
+    "MP": ("Jeep", "Compass"),
+    "LD": ("Dodge", "Durango"),
+    "LA": ("Dodge", "Charger"),
+    "LC": ("Dodge", "Challenger"),
+    "RU": ("Chrysler", "Pacifica"),
+}
+
+# Gabarit du résultat de decode_product_code pour un code inconnu
+_EMPTY_PRODUCT_INFO = {
+    "brand": None,
+    "model": None,
+    "trim": None,
+    "body": None,
+    "description": None
 }
+_UNKNOWN_PRODUCT_INFO = MappingProxyType(_EMPTY_PRODUCT_INFO)
 
 # Codes d'options communes FCA
 FCA_OPTION_CODES = {
@@ -481,60 +620,32 @@ def calculate_holdback(brand: str, pdco: float, parsed_holdback: float = None) -
     # Si pas trouvé sur la facture, retourner 0
     return 0
 
-def decode_product_code(code: str) -> dict:
-    """Décode un code produit FCA et retourne les informations du véhicule"""
-    code = code.upper().strip()
+@lru_cache(maxsize=4096)
+def decode_product_code(code: str) -> MappingProxyType:
+    """
+    Décode un code produit FCA et retourne les informations du véhicule.
+    Le résultat est mis en cache: il est retourné en lecture seule.
+    """
+    code = code.strip().upper()
     
     # Chercher dans la base de données
-    if code in FCA_PRODUCT_CODES:
-        return FCA_PRODUCT_CODES[code]
+    product_info = FCA_PRODUCT_CODES.get(code)
+    if product_info is not None:
+        return MappingProxyType(product_info)
     
-    # Essayer de décoder le pattern si pas trouvé
-    result = {
-        "brand": None,
-        "model": None,
-        "trim": None,
-        "body": None,
-        "description": None
-    }
-    
-    # Patterns de préfixes connus
-    if code.startswith("DJ"):
-        result["brand"] = "Ram"
-        result["model"] = "2500"
-    elif code.startswith("DT") or code.startswith("DS"):
-        result["brand"] = "Ram"
-        result["model"] = "1500"
-    elif code.startswith("D2"):
-        result["brand"] = "Ram"
-        result["model"] = "3500"
-    elif code.startswith("JL"):
-        result["brand"] = "Jeep"
-        result["model"] = "Wrangler"
-    elif code.startswith("WK"):
-        result["brand"] = "Jeep"
-        result["model"] = "Grand Cherokee"
-    elif code.startswith("MP"):
-        result["brand"] = "Jeep"
-        result["model"] = "Compass"
-    elif code.startswith("LD"):
-        result["brand"] = "Dodge"
-        result["model"] = "Durango"
-    elif code.startswith("LA"):
-        result["brand"] = "Dodge"
-        result["model"] = "Charger"
-    elif code.startswith("LC"):
-        result["brand"] = "Dodge"
-        result["model"] = "Challenger"
-    elif code.startswith("RU"):
-        result["brand"] = "Chrysler"
-        result["model"] = "Pacifica"
+    # Essayer de décoder le pattern si pas trouvé (préfixes connus)
+    prefix_match = _PRODUCT_CODE_PREFIXES.get(code[:2])
+    if not prefix_match:
+        return _UNKNOWN_PRODUCT_INFO
     
-    return result
+    result = _EMPTY_PRODUCT_INFO.copy()
+    result["brand"], result["model"] = prefix_match
+    return MappingProxyType(result)
 
+@lru_cache(maxsize=4096)
 def decode_option_code(code: str) -> str:
     """Retourne la description d'un code d'option FCA"""
-    code = code.upper().strip()
+    code = code.strip().upper()
     return FCA_OPTION_CODES.get(code, None)
 
 def enrich_vehicle_data(vehicle_data: dict) -> dict:
@@ -542,7 +653,8 @@ def enrich_vehicle_data(vehicle_data: dict) -> dict:
     
     # Décoder le VIN si présent
     vin = vehicle_data.get("vin", "")
-    if vin and len(vin.replace("-", "")) == 17:
+    # decode_vin normalise lui-même le VIN: ici on ne fait que compter les tirets
+    if vin and len(vin) - vin.count("-") == 17:
         vin_info = decode_vin(vin)
         if vin_info["valid"]:
             # Mettre à jour l'année si pas déjà définie
@@ -553,11 +665,11 @@ def enrich_vehicle_data(vehicle_data: dict) -> dict:
                 vehicle_data["brand"] = vin_info["manufacturer"]
     
     # Chercher et décoder le code produit principal (première option ou MODEL/OPT)
-    options = vehicle_data.get("options", [])
+    options = vehicle_data.get("options") or ()
     if options:
         first_option = options[0]
         # PATCH: Utiliser "product_code" au lieu de "code"
-        code = first_option.get("product_code", first_option.get("code", ""))
+        code = first_option.get("product_code") or first_option.get("code") or ""
         
         # Vérifier si c'est un code de modèle (pas un code d'option)
         product_info = decode_product_code(code)
@@ -575,24 +687,27 @@ def enrich_vehicle_data(vehicle_data: dict) -> dict:
     # Enrichir les descriptions des options
     for option in options:
         # PATCH: Utiliser "product_code" au lieu de "code"
-        code = option.get("product_code", option.get("code", ""))
-        if not option.get("description") or len(option.get("description", "")) < 5:
-            desc = decode_option_code(code)
-            if desc:
-                option["description"] = desc
+        desc = option.get("description") or ""
+        if len(desc) < 5:
+            code = option.get("product_code") or option.get("code") or ""
+            new_desc = decode_option_code(code)
+            if new_desc:
+                option["description"] = new_desc
     
     return vehicle_data
 
 # PATCH: decode_fca_price() supprimé - utiliser clean_fca_price() uniquement
 # Fonction dupliquée de clean_fca_price() dans parser.py
 
+_NON_DIGIT_RE = re.compile(r'[^\d]')
+
 def decode_fca_holdback(raw_value: str) -> float:
     """Décode un holdback FCA - même règle que les prix
     Enlever premier 0 + deux derniers chiffres
     Exemple: 050000 → 50000 → 500 → 500$
     """
     # Remove any non-numeric characters
-    cleaned = re.sub(r'[^\d]', '', str(raw_value))
+    cleaned = _NON_DIGIT_RE.sub('', str(raw_value))
     
     if len(cleaned) >= 4:
         # Remove first 0 if present
@@ -603,7 +718,7 @@ def decode_fca_holdback(raw_value: str) -> float:
             cleaned = cleaned[:-2]
         try:
             return float(cleaned)
-        except:
+        except ValueError:
             return 0
     return 0
 
@@ -612,57 +727,154 @@ def decode_fca_holdback(raw_value: str) -> float:
 # =========================
 
 # Codes invalides à exclure des options
-INVALID_OPTION_CODES = {
+INVALID_OPTION_CODES = frozenset({
     "VIN", "GST", "TPS", "QUE", "INC", "PDCO", "PREF", 
     "MODEL", "TOTAL", "MSRP", "SUB", "KG", "GVW"
-}
+})
 
 # Cache des codes produits FCA (évite lookups répétés)
 FCA_PRODUCT_CACHE = {}
 
+# Patterns du parser structuré (compilés une seule fois au chargement)
+_VIN_RE = re.compile(r"\b([0-9A-HJ-NPR-Z]{17})\b")
+_VIN_DASH_RE = re.compile(r"\b([0-9A-HJ-NPR-Z]{9})[-\s]([A-HJ-NPR-Z0-9]{2})[-\s]([A-HJ-NPR-Z0-9]{6})\b")
+_MODEL_SECTION_RE = re.compile(r"MODEL/OPT[\s\S]{0,50}?\n\s*([A-Z]{2,4}[A-Z0-9]{2,4})")
+_MODEL_FALLBACK_RE = re.compile(r"\b(WL[A-Z]{2}\d{2}|JT[A-Z]{2}\d{2}|DT[A-Z0-9]{2}\d{2})\b")
+# E.P. / PDCO / PREF en une seule passe: le nom du groupe = clé dans data
+_FIN_RE = re.compile(
+    r"E\.P\.?\s*(?P<ep_cost>\d{7,10})"
+    r"|PDCO\s*(?P<pdco>\d{7,10})"
+    r"|PREF\*?\s*(?P<pref>\d{7,10})"
+)
+_HOLDBACK1_RE = re.compile(r"PREF\*?\s*\d{7,10}\s+(\d{6})\b")
+_HOLDBACK2_RE = re.compile(r"\b(0[3-9]\d{4})\b\s*(?:GVW|KG|$)")
+_SUBTOTAL_RE = re.compile(r"SUB\s*TOTAL\s*EXCLUDING\s*TAXES[\s\S]*?([\d,]+\.\d{2})", re.IGNORECASE)
+_TOTAL_FR_RE = re.compile(r"TOTAL\s+DE\s+LA\s+FACTURE\s+([\d,]+\.\d{2})")
+_TOTAL_EN_RE = re.compile(r"INVOICE\s*TOTAL[\s\S]*?([\d,]+\.\d{2})", re.IGNORECASE)
+_OPTION_RE = re.compile(r"\n\s*([A-Z0-9]{2,5})\s+([A-Z0-9][A-Z0-9 ,\-\/'\.]{4,}?)\s+(\d{6,10}|\*|SANS\s*FRAIS)")
+
+# Patterns du fallback regex Google Vision
+_STOCK5_RE = re.compile(r'\b(\d{5})\b')
+_VIN_COMPACT_RE = re.compile(r'1C4[A-Z0-9]{14}')
+_COLOR_RE = re.compile(r'\b(P[A-Z0-9]{2})\b')
+
+# Codes peinture FCA → nom français (fallback regex Google Vision)
+_FCA_COLOR_NAMES = MappingProxyType({
+    "PW7": "Blanc Vif", "PWZ": "Blanc Vif", "PXJ": "Noir Cristal", 
+    "PX8": "Noir Diamant", "PSC": "Gris Destroyer", 
+    "PWL": "Blanc Perle", "PGG": "Gris Granit", "PBF": "Bleu Patriote", 
+    "PGE": "Vert Sarge", "PRM": "Rouge Velours", "PAR": "Argent Billet",
+    "PYB": "Jaune Stinger", "PBJ": "Bleu Hydro", "PFQ": "Granite Cristal",
+    "PDN": "Gris Ceramique",
+})
+
 
 def generate_file_hash(file_bytes: bytes) -> str:
-    """Génère un hash SHA256 unique pour le fichier"""
-    return hashlib.sha256(file_bytes).hexdigest()
+    """
+    Génère un hash SHA256 unique pour le fichier.
+    Empreinte anti-doublon uniquement (pas d'usage cryptographique).
+    OpenSSL 3 utilise déjà les instructions SHA-NI quand le CPU les expose.
+    """
+    return hashlib.sha256(file_bytes, usedforsecurity=False).hexdigest()
 
 
-def compress_image_for_vision(file_bytes: bytes, max_size: int = 1024, quality: int = 70) -> str:
-    """
-    Compresse l'image pour réduire les tokens Vision API.
-    - Redimensionne à max 1024px
-    - Compression JPEG quality 70
-    - Retourne base64 optimisé
+# Champs fixes de la réponse d'un scan bloqué par la règle d'or (VIN/EP/PDCO)
+_BLOCKING_RESPONSE = MappingProxyType({
+    "success": False,
+    "review_required": True,
+    "message": "Données critiques manquantes ou invalides. Révision obligatoire."
+})
+
+# Cache des scans réussis: (owner_id, hash fichier, is_pdf) -> réponse
+# Un re-upload identique (retry utilisateur) ne relance ni OCR ni Google Vision.
+# Clé propre à chaque utilisateur: une facture (et le financement joint) n'est
+# jamais servie à un autre concessionnaire.
+_SCAN_RESULT_CACHE_MAX = 512
+_scan_result_cache: Dict[tuple, dict] = {}
+
+# Second niveau dans MongoDB (collection scan_cache): commun à tous les workers
+# et conservé aux redémarrages. Expiration par index TTL (voir ensure_indexes),
+# les promotions de financement jointes à la réponse changeant chaque mois.
+SCAN_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+
+def _scan_cache_id(cache_key: tuple) -> str:
+    owner_id, file_hash, is_pdf = cache_key
+    return f"{owner_id}:{file_hash}:{'pdf' if is_pdf else 'img'}"
+
+
+def _remember_scan_result(cache_key: tuple, result: dict):
+    """Mémorise une réponse dans le cache mémoire (éviction FIFO)"""
+    if len(_scan_result_cache) >= _SCAN_RESULT_CACHE_MAX:
+        _scan_result_cache.pop(next(iter(_scan_result_cache)))
+    _scan_result_cache[cache_key] = copy.deepcopy(result)
+
+
+async def _get_cached_scan(cache_key: tuple) -> Optional[dict]:
+    """Réponse d'un scan identique déjà réussi (mémoire, puis MongoDB)"""
+    cached = _scan_result_cache.get(cache_key)
+    if cached is not None:
+        return copy.deepcopy(cached)
     
-    Économie: ~60-70% de tokens en moins
-    """
     try:
-        image = Image.open(io.BytesIO(file_bytes))
-        
-        # Convertir en RGB si nécessaire
-        if image.mode in ('RGBA', 'P'):
-            image = image.convert('RGB')
-        
-        # Redimensionner proportionnellement
-        width, height = image.size
-        if max(width, height) > max_size:
-            ratio = max_size / max(width, height)
-            new_size = (int(width * ratio), int(height * ratio))
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-        
-        # Compression JPEG
-        buffer = io.BytesIO()
-        image.save(buffer, format='JPEG', quality=quality, optimize=True)
-        
-        compressed_bytes = buffer.getvalue()
-        original_size = len(file_bytes)
-        new_size = len(compressed_bytes)
-        
-        logger.info(f"Image compressed: {original_size/1024:.1f}KB → {new_size/1024:.1f}KB ({100-new_size*100/original_size:.0f}% reduction)")
-        
-        return base64.b64encode(compressed_bytes).decode('utf-8')
+        doc = await db.scan_cache.find_one({"_id": _scan_cache_id(cache_key)}, {"result": 1})
     except Exception as e:
-        logger.error(f"Compression error: {e}")
-        return base64.b64encode(file_bytes).decode('utf-8')
+        logger.warning(f"Lecture scan_cache impossible: {e}")
+        return None
+    if doc is None:
+        return None
+    
+    _remember_scan_result(cache_key, doc["result"])
+    return doc["result"]
+
+
+async def _store_scan_result(cache_key: tuple, result: dict):
+    """Mémorise une réponse de scan réussie (mémoire + MongoDB)"""
+    _remember_scan_result(cache_key, result)
+    try:
+        await db.scan_cache.replace_one(
+            {"_id": _scan_cache_id(cache_key)},
+            {"owner_id": cache_key[0], "file_hash": cache_key[1], "result": result, "created_at": datetime.utcnow()},
+            upsert=True
+        )
+    except Exception as e:
+        logger.warning(f"Écriture scan_cache impossible: {e}")
+
+
+def _metric_status(score) -> str:
+    """Statut de monitoring d'un scan selon son score (auto / review / vision)"""
+    if score >= 85:
+        return "auto"
+    if score >= 60:
+        return "review"
+    return "vision"
+
+
+def _log_cache_hit_metric(result: dict, user: dict, now: datetime, duration: float):
+    """Métrique d'un scan servi depuis le cache (ni OCR ni Vision, coût nul)"""
+    try:
+        vd = result.get("vehicle") or {}
+        score = (result.get("validation") or {}).get("score", 0)
+        parsing_metrics_buffer.push({
+            "timestamp": now,
+            "owner_id": user["id"],
+            "parse_method": "cache_hit",
+            "score": score,
+            "status": _metric_status(score),
+            "vin_valid": vd.get("vin_valid", False),
+            "vin": (vd.get("vin") or "")[:17],
+            "stock_no": vd.get("stock_no", ""),
+            "brand": vd.get("brand", ""),
+            "model": vd.get("model", ""),
+            "ep_cost": vd.get("ep_cost", 0),
+            "pdco": vd.get("pdco", 0),
+            "duration_sec": duration,
+            "cost_estimate": 0.0,
+            "success": True,
+            "cache_hit": True
+        })
+    except Exception as log_err:
+        logger.warning(f"Failed to log parsing metric: {log_err}")
 
 
 def clean_fca_price(raw_value: str) -> int:
@@ -672,21 +884,20 @@ def clean_fca_price(raw_value: str) -> int:
     - Enlever les deux derniers chiffres
     Exemple: 05662000 -> 56620
     """
-    raw_value = str(raw_value).strip()
-    raw_value = re.sub(r'[^\d]', '', raw_value)
+    digits = _NON_DIGIT_RE.sub('', str(raw_value))
     
-    if not raw_value:
-        return 0
+    if digits.startswith("0"):
+        digits = digits[1:]
     
-    if raw_value.startswith("0"):
-        raw_value = raw_value[1:]
+    if len(digits) >= 2:
+        digits = digits[:-2]
     
-    if len(raw_value) >= 2:
-        raw_value = raw_value[:-2]
+    if not digits:
+        return 0
     
     try:
-        return int(raw_value)
-    except:
+        return int(digits)
+    except ValueError:
         return 0
 
 
@@ -699,24 +910,50 @@ def clean_decimal_price(raw_value: str) -> float:
         return 0.0
 
 
+def extract_pdf_text_pymupdf(file_bytes: bytes) -> str:
+    """Extrait le texte d'un PDF avec PyMuPDF (lecture directe en mémoire)"""
+    try:
+        import fitz  # PyMuPDF
+        # PyMuPDF n'accepte pas un mmap tel quel, mais bien une memoryview
+        stream = memoryview(file_bytes) if isinstance(file_bytes, mmap.mmap) else file_bytes
+        doc = fitz.open(stream=stream, filetype="pdf")
+        try:
+            return "\n".join(page.get_text("text") for page in doc)
+        finally:
+            doc.close()
+    except Exception as e:
+        logger.error(f"Error extracting PDF text (PyMuPDF): {e}")
+        return ""
+
+
 def extract_pdf_text(file_bytes: bytes) -> str:
-    """Extrait le texte d'un PDF avec pdfplumber"""
-    text = ""
+    """
+    Extrait le texte d'un PDF.
+    pdfplumber reste le moteur principal: il reconstruit les lignes
+    (CODE DESCRIPTION MONTANT) dont dépend parse_fca_invoice_structured.
+    PyMuPDF prend le relais si pdfplumber échoue ou ne retourne rien.
+    """
+    pages_text = []
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(file_bytes)
-            tmp_path = tmp.name
-        
-        with pdfplumber.open(tmp_path) as pdf:
+        # Un upload mappé (mmap) est lu directement, sans copie dans un BytesIO
+        stream = file_bytes if isinstance(file_bytes, mmap.mmap) else io.BytesIO(file_bytes)
+        stream.seek(0)
+        with pdfplumber.open(stream) as pdf:
             for page in pdf.pages:
                 extracted = page.extract_text()
+                # Libérer le cache de layout de la page (PDF multi-pages)
+                page.close()
                 if extracted:
-                    text += extracted + "\n"
-        
-        os.unlink(tmp_path)
+                    pages_text.append(extracted)
     except Exception as e:
         logger.error(f"Error extracting PDF text: {e}")
     
+    # Une seule concaténation (pas de += quadratique page par page)
+    text = "".join(f"{page_text}\n" for page_text in pages_text)
+    
+    if not text.strip():
+        text = extract_pdf_text_pymupdf(file_bytes)
+    
     return text
 
 
@@ -754,11 +991,7 @@ def extract_text_from_image(file_bytes: bytes) -> str:
         thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
         
         # OCR avec Tesseract (anglais + français)
-        text = pytesseract.image_to_string(
-            thresh,
-            lang="eng+fra",
-            config="--psm 6 --oem 3"
-        )
+        text = tesseract_image_to_string(thresh, lang="eng+fra", psm=6)
         
         logger.info(f"OCR extracted {len(text)} chars")
         return text
@@ -769,6 +1002,25 @@ def extract_text_from_image(file_bytes: bytes) -> str:
         return ""
 
 
+def _find_vin_match(text: str):
+    """
+    Cherche le VIN 17 caractères.
+    Préfiltre str.find sur les WMI Stellantis connus (VIN_WMI_MAP), puis
+    _VIN_RE.match uniquement aux positions candidates; le plus tôt gagne.
+    Fallback: recherche regex complète (autres constructeurs).
+    """
+    best = None
+    for wmi in VIN_WMI_MAP:
+        pos = text.find(wmi)
+        while pos != -1 and (best is None or pos < best.start()):
+            match = _VIN_RE.match(text, pos)
+            if match:
+                best = match
+                break
+            pos = text.find(wmi, pos + 1)
+    return best or _VIN_RE.search(text)
+
+
 def parse_fca_invoice_structured(text: str) -> dict:
     """
     Parser structuré V4 pour factures FCA Canada.
@@ -792,13 +1044,13 @@ def parse_fca_invoice_structured(text: str) -> dict:
     # -------------------------
     # PATCH: Pattern VIN plus strict - 17 caractères exacts
     # Priorité 1: VIN standard 17 caractères (plus fiable)
-    vin_match = re.search(r"\b([0-9A-HJ-NPR-Z]{17})\b", text)
+    vin_match = _find_vin_match(text)
     if vin_match:
         data["vin"] = vin_match.group(1)
     
     # Fallback: VIN FCA avec tirets (format 1C4RJHBG6-S8-806264)
     if not data["vin"]:
-        vin_dash_match = re.search(r"\b([0-9A-HJ-NPR-Z]{9})[-\s]([A-HJ-NPR-Z0-9]{2})[-\s]([A-HJ-NPR-Z0-9]{6})\b", text)
+        vin_dash_match = _VIN_DASH_RE.search(text)
         if vin_dash_match:
             vin_raw = vin_dash_match.group(1) + vin_dash_match.group(2) + vin_dash_match.group(3)
             if len(vin_raw) == 17:
@@ -808,36 +1060,28 @@ def parse_fca_invoice_structured(text: str) -> dict:
     # Model Code - RESTREINT à la zone MODEL/OPT
     # Pattern: 5-7 caractères alphanumériques (ex: WLJP74, WLJH75, JTJL98)
     # -------------------------
-    model_section = re.search(r"MODEL/OPT[\s\S]{0,50}?\n\s*([A-Z]{2,4}[A-Z0-9]{2,4})", text)
+    model_section = _MODEL_SECTION_RE.search(text)
     if model_section:
         data["model_code"] = model_section.group(1)
     else:
         # Fallback: chercher pattern FCA standard (2-4 lettres + 2 chiffres)
-        model_match = re.search(r"\b(WL[A-Z]{2}\d{2}|JT[A-Z]{2}\d{2}|DT[A-Z0-9]{2}\d{2})\b", text)
+        model_match = _MODEL_FALLBACK_RE.search(text)
         if model_match:
             data["model_code"] = model_match.group(1)
     
     # -------------------------
-    # E.P. (Employee Price / Coût)
-    # Pattern: E.P. suivi de 7-10 chiffres
-    # -------------------------
-    ep_match = re.search(r"E\.P\.?\s*(\d{7,10})", text)
-    if ep_match:
-        data["ep_cost"] = clean_fca_price(ep_match.group(1))
-    
-    # -------------------------
-    # PDCO (Prix dealer / PDSF base)
-    # -------------------------
-    pdco_match = re.search(r"PDCO\s*(\d{7,10})", text)
-    if pdco_match:
-        data["pdco"] = clean_fca_price(pdco_match.group(1))
-    
-    # -------------------------
-    # PREF (Prix de référence)
+    # E.P. (Employee Price / Coût), PDCO (Prix dealer / PDSF base),
+    # PREF (Prix de référence) - première occurrence de chacun
+    # Pattern: code suivi de 7-10 chiffres
     # -------------------------
-    pref_match = re.search(r"PREF\*?\s*(\d{7,10})", text)
-    if pref_match:
-        data["pref"] = clean_fca_price(pref_match.group(1))
+    found = 0
+    for fin_match in _FIN_RE.finditer(text):
+        key = fin_match.lastgroup
+        if data[key] is None:
+            data[key] = clean_fca_price(fin_match.group(key))
+            found += 1
+            if found == 3:
+                break
     
     # -------------------------
     # HOLDBACK - AMÉLIORÉ
@@ -845,39 +1089,28 @@ def parse_fca_invoice_structured(text: str) -> dict:
     # Format: 6 chiffres commençant par 0 (ex: 070000 = 700$)
     # -------------------------
     # Méthode 1: Chercher après PREF
-    holdback_match = re.search(r"PREF\*?\s*\d{7,10}\s+(\d{6})\b", text)
+    holdback_match = _HOLDBACK1_RE.search(text)
     if holdback_match:
         data["holdback"] = clean_fca_price(holdback_match.group(1))
     else:
         # Méthode 2: Chercher un 0XXXXX isolé près de GVW/KG
-        holdback_match = re.search(r"\b(0[3-9]\d{4})\b\s*(?:GVW|KG|$)", text)
+        holdback_match = _HOLDBACK2_RE.search(text)
         if holdback_match:
             data["holdback"] = clean_fca_price(holdback_match.group(1))
     
     # -------------------------
     # SUBTOTAL EXCLUDING TAXES
     # -------------------------
-    subtotal_match = re.search(
-        r"SUB\s*TOTAL\s*EXCLUDING\s*TAXES[\s\S]*?([\d,]+\.\d{2})",
-        text,
-        re.IGNORECASE
-    )
+    subtotal_match = _SUBTOTAL_RE.search(text)
     if subtotal_match:
         data["subtotal_excl_tax"] = clean_decimal_price(subtotal_match.group(1))
     
     # -------------------------
     # INVOICE TOTAL / TOTAL DE LA FACTURE
     # -------------------------
-    total_match = re.search(
-        r"TOTAL\s+DE\s+LA\s+FACTURE\s+([\d,]+\.\d{2})",
-        text
-    )
+    total_match = _TOTAL_FR_RE.search(text)
     if not total_match:
-        total_match = re.search(
-            r"INVOICE\s*TOTAL[\s\S]*?([\d,]+\.\d{2})",
-            text,
-            re.IGNORECASE
-        )
+        total_match = _TOTAL_EN_RE.search(text)
     if total_match:
         data["invoice_total"] = clean_decimal_price(total_match.group(1))
     
@@ -885,13 +1118,10 @@ def parse_fca_invoice_structured(text: str) -> dict:
     # OPTIONS - PATTERN AMÉLIORÉ
     # Format: CODE (2-5 chars) + DESCRIPTION (5+ chars) + MONTANT (6-10 chiffres ou SANS FRAIS)
     # -------------------------
-    option_pattern = re.findall(
-        r"\n\s*([A-Z0-9]{2,5})\s+([A-Z0-9][A-Z0-9 ,\-\/'\.]{4,}?)\s+(\d{6,10}|\*|SANS\s*FRAIS)",
-        text
-    )
-    
-    for code, desc, amount in option_pattern:
-        if code.upper() in INVALID_OPTION_CODES:
+    for option_match in _OPTION_RE.finditer(text):
+        code, desc, amount = option_match.groups()
+        code = code.upper()
+        if code in INVALID_OPTION_CODES:
             continue
         
         # Nettoyer le montant
@@ -901,7 +1131,7 @@ def parse_fca_invoice_structured(text: str) -> dict:
             amt = clean_fca_price(amount)
         
         data["options"].append({
-            "product_code": code.upper(),
+            "product_code": code,
             "description": desc.strip()[:100],
             "amount": amt
         })
@@ -929,29 +1159,51 @@ async def scan_invoice(request: InvoiceScanRequest, authorization: Optional[str]
     - Validation VIN industrielle avec auto-correction
     - DOUBLE VÉRIFICATION: code produit validé contre base master 131 codes
     """
+    user = await get_current_user(authorization)
+    
+    # Décoder le base64 (hors boucle d'événements pour les gros fichiers)
+    try:
+        if len(request.image_base64) > _BASE64_INLINE_MAX:
+            file_bytes = await asyncio.get_running_loop().run_in_executor(
+                None, base64.b64decode, request.image_base64)
+        else:
+            file_bytes = base64.b64decode(request.image_base64)
+    except:
+        raise HTTPException(status_code=400, detail="Base64 invalide")
+    
+    return await _scan_invoice_bytes(file_bytes, request.is_pdf, user)
+
+
+async def _scan_invoice_bytes(file_bytes: bytes, is_pdf: bool, user: dict) -> dict:
+    """Pipeline de scan commun (JSON base64 et upload multipart) sur les octets bruts"""
     # Import des nouveaux modules OCR
-    from ocr import process_image_ocr_pipeline
+    from ocr import process_image_ocr_pipeline, load_image_from_bytes
     from parser import parse_invoice_text
     from vin_utils import validate_and_correct_vin
     from validation import validate_invoice_data as validate_invoice_full, calculate_validation_score
     from product_code_lookup import lookup_product_code, get_vehicle_info_from_invoice
     
-    user = await get_current_user(authorization)
-    
     try:
         start_time = time.time()
-        
-        # Décoder le base64
-        try:
-            file_bytes = base64.b64decode(request.image_base64)
-        except:
-            raise HTTPException(status_code=400, detail="Base64 invalide")
+        now = datetime.utcnow()
         
         # Générer le hash du fichier pour anti-doublon
-        file_hash = generate_file_hash(file_bytes)
+        # (gros fichiers: hashlib relâche le GIL, le calcul part dans le pool OCR)
+        if len(file_bytes) > _BASE64_INLINE_MAX:
+            file_hash = await _run_ocr(generate_file_hash, file_bytes)
+        else:
+            file_hash = generate_file_hash(file_bytes)
         
         # Détecter si c'est un PDF
-        is_pdf = file_bytes[:4] == b'%PDF' or request.is_pdf
+        is_pdf = file_bytes[:4] == b'%PDF' or is_pdf
+        
+        # Fichier déjà scanné avec succès → réponse en cache
+        cache_key = (user["id"], file_hash, is_pdf)
+        cached = await _get_cached_scan(cache_key)
+        if cached is not None:
+            logger.info(f"Scan cache hit: {file_hash[:12]}")
+            _log_cache_hit_metric(cached, user, now, round(time.time() - start_time, 3))
+            return cached
         
         vehicle_data = None
         parse_method = None
@@ -960,7 +1212,7 @@ async def scan_invoice(request: InvoiceScanRequest, authorization: Optional[str]
         # ===== NIVEAU 1: PDF → PARSER STRUCTURÉ (100% GRATUIT) =====
         if is_pdf:
             logger.info("PDF détecté → Parser pdfplumber + regex")
-            extracted_text = extract_pdf_text(file_bytes)
+            extracted_text = await _run_ocr(extract_pdf_text, file_bytes)
             
             if extracted_text and len(extracted_text) > 100:
                 parsed = parse_fca_invoice_structured(extracted_text)
@@ -975,7 +1227,7 @@ async def scan_invoice(request: InvoiceScanRequest, authorization: Optional[str]
                     vehicle_data = {
                         "vin": vin,
                         "model_code": model_code,
-                        "year": vin_info.get("year") or datetime.now().year,
+                        "year": vin_info.get("year") or now.year,
                         "brand": product_info.get("brand") or vin_info.get("manufacturer") or "Stellantis",
                         "model": product_info.get("model") or "",
                         "trim": product_info.get("trim") or "",
@@ -997,13 +1249,25 @@ async def scan_invoice(request: InvoiceScanRequest, authorization: Optional[str]
         
         # ===== NIVEAU 2: IMAGE → OCR SIMPLIFIÉ STABLE (ZÉRO ERREUR) =====
         decision = None
+        # Image décodée une seule fois, partagée entre OCR et Google Vision
+        cv_image = None
+        
+        # ----------- GOOGLE VISION EN PRIORITÉ -----------
+        # Si Google Vision est configuré, on l'utilise TOUJOURS pour meilleure précision:
+        # le résultat Tesseract serait ignoré, inutile de lancer l'OCR par zones.
+        google_api_key = os.environ.get("GOOGLE_VISION_API_KEY")
+        
+        if vehicle_data is None and not is_pdf and google_api_key:
+            logger.info("Google Vision API configurée → Utilisation prioritaire (OCR Tesseract ignoré)")
+            decision = "vision_required"  # Force Google Vision
         
-        if vehicle_data is None and not is_pdf:
+        elif vehicle_data is None and not is_pdf:
             logger.info("Image détectée → OCR Global simplifié")
             
             try:
                 # 1. Pipeline OCR par zones
-                ocr_result = process_image_ocr_pipeline(file_bytes)
+                cv_image = await _run_ocr(load_image_from_bytes, file_bytes, _SCAN_IMAGE_MAX_DIM)
+                ocr_result = await _run_ocr(process_image_ocr_pipeline, file_bytes, cv_image)
                 
                 # 2. Parser structuré sur le texte OCR
                 parsed = parse_invoice_text(ocr_result)
@@ -1024,13 +1288,7 @@ async def scan_invoice(request: InvoiceScanRequest, authorization: Optional[str]
                 ocr_score = validation_result["score"]
                 logger.info(f"OCR: score={ocr_score}, VIN={vin_corrected}, EP={parsed.get('ep_cost')}")
                 
-                # ----------- NOUVELLE LOGIQUE: GOOGLE VISION EN PRIORITÉ -----------
-                # Si Google Vision est configuré, on l'utilise TOUJOURS pour meilleure précision
-                google_api_key = os.environ.get("GOOGLE_VISION_API_KEY")
-                if google_api_key:
-                    logger.info("Google Vision API configurée → Utilisation prioritaire")
-                    decision = "vision_required"  # Force Google Vision
-                elif ocr_score >= 85:
+                if ocr_score >= 85:
                     decision = "auto_approved"
                 elif 60 <= ocr_score < 85:
                     decision = "review_required"
@@ -1074,7 +1332,7 @@ async def scan_invoice(request: InvoiceScanRequest, authorization: Optional[str]
                     "vin_corrected": vin_was_corrected,
                     "model_code": model_code,
                     "model_code_validated": master_lookup is not None,
-                    "year": vin_info.get("year") or datetime.now().year,
+                    "year": vin_info.get("year") or now.year,
                     "brand": extracted_brand,
                     "model": extracted_model,
                     "trim": extracted_trim,
@@ -1131,7 +1389,7 @@ async def scan_invoice(request: InvoiceScanRequest, authorization: Optional[str]
                 "vin_brand": vin_brand,
                 "model_code": model_code,
                 "model_code_validated": master_lookup is not None,  # Flag de validation
-                "year": vin_info.get("year") or datetime.now().year,
+                "year": vin_info.get("year") or now.year,
                 "brand": extracted_brand,
                 "model": extracted_model,
                 "trim": extracted_trim,
@@ -1168,7 +1426,6 @@ async def scan_invoice(request: InvoiceScanRequest, authorization: Optional[str]
                 from PIL import Image as PILImage
                 from ocr import (
                     camscanner_preprocess_for_vision, 
-                    load_image_from_bytes,
                     google_vision_ocr_from_numpy,
                     google_vision_ocr
                 )
@@ -1187,19 +1444,17 @@ async def scan_invoice(request: InvoiceScanRequest, authorization: Optional[str]
                     logger.warning("GOOGLE_VISION_API_KEY non configurée, fallback vers GPT-4 Vision")
                     raise ValueError("Google Vision API key not configured")
                 
-                # Décoder l'image
-                img_data = base64.b64decode(request.image_base64)
-                
                 # ====== PRÉTRAITEMENT CAMSCANNER ======
-                cv_image = load_image_from_bytes(img_data)
+                if cv_image is None:
+                    cv_image = await _run_ocr(load_image_from_bytes, file_bytes, _SCAN_IMAGE_MAX_DIM)
                 
                 if cv_image is not None:
                     logger.info("Applying CamScanner preprocessing for Google Vision...")
-                    preprocessed = camscanner_preprocess_for_vision(cv_image)
+                    preprocessed = await _run_ocr(camscanner_preprocess_for_vision, cv_image)
                     
                     # ====== OCR GOOGLE CLOUD VISION ======
                     logger.info("Calling Google Cloud Vision API...")
-                    vision_result = google_vision_ocr_from_numpy(preprocessed, google_api_key)
+                    vision_result = await asyncio.to_thread(google_vision_ocr_from_numpy, preprocessed, google_api_key)
                     
                     if not vision_result["success"]:
                         logger.error(f"Google Vision error: {vision_result['error']}")
@@ -1211,8 +1466,8 @@ async def scan_invoice(request: InvoiceScanRequest, authorization: Optional[str]
                 else:
                     # Fallback: envoyer l'image originale directement
                     logger.warning("CamScanner preprocessing failed, using original image")
-                    image_base64 = base64.b64encode(img_data).decode("utf-8")
-                    vision_result = google_vision_ocr(image_base64, google_api_key)
+                    image_base64 = await _run_ocr(base64.b64encode, file_bytes)
+                    vision_result = await asyncio.to_thread(google_vision_ocr, image_base64.decode("utf-8"), google_api_key)
                     
                     if not vision_result["success"]:
                         raise ValueError(f"Google Vision error: {vision_result['error']}")
@@ -1222,6 +1477,8 @@ async def scan_invoice(request: InvoiceScanRequest, authorization: Optional[str]
                 
                 # ====== STRUCTURATION GPT-4o (texte → JSON) ======
                 # Google Vision a lu le texte. GPT-4o le structure intelligemment.
+                # Les clients HTTP Vision/OpenAI sont synchrones: appels dans un thread
+                # pour ne pas bloquer la boucle d'événements pendant les secondes d'attente.
                 logger.info("Structuring invoice text with GPT-4o...")
                 
                 structured_data = None
@@ -1279,7 +1536,8 @@ Retourne UNIQUEMENT un JSON valide (pas de markdown, pas de commentaires):
   ]
 }}"""
                         
-                        gpt_response = client.chat.completions.create(
+                        gpt_response = await asyncio.to_thread(
+                            client.chat.completions.create,
                             model="gpt-4o",
                             messages=[{"role": "user", "content": gpt_prompt}],
                             temperature=0.0,
@@ -1387,12 +1645,12 @@ Retourne UNIQUEMENT un JSON valide (pas de markdown, pas de commentaires):
                     # Couleur: GPT-4o
                     color_code = structured_data.get("color_code", "")
                     color_desc_gpt = structured_data.get("color_description", "")
-                    final_color = color_desc_gpt or color_code
+                    final_color = color_desc_gpt or _FCA_COLOR_NAMES.get(color_code, color_code)
                     
                     # Stock
                     stock_no = parse_stock_number(full_text) or ""
                     if not stock_no:
-                        stock_match = re.search(r'\b(\d{5})\b', full_text)
+                        stock_match = _STOCK5_RE.search(full_text)
                         if stock_match:
                             stock_no = stock_match.group(1)
                     
@@ -1405,7 +1663,7 @@ Retourne UNIQUEMENT un JSON valide (pas de markdown, pas de commentaires):
                     
                     vin_raw = parse_vin(full_text)
                     if not vin_raw:
-                        vin_match = re.search(r'1C4[A-Z0-9]{14}', full_text.replace("-", "").replace(" ", "").upper())
+                        vin_match = _VIN_COMPACT_RE.search(full_text.replace("-", "").replace(" ", "").upper())
                         if vin_match:
                             vin_raw = vin_match.group()
                     vin_raw = str(vin_raw or "").replace("-", "").replace(" ", "").upper()[:17]
@@ -1442,13 +1700,13 @@ Retourne UNIQUEMENT un JSON valide (pas de markdown, pas de commentaires):
                     
                     stock_no = parse_stock_number(full_text) or ""
                     if not stock_no:
-                        stock_match = re.search(r'\b(\d{5})\b', full_text)
+                        stock_match = _STOCK5_RE.search(full_text)
                         if stock_match:
                             stock_no = stock_match.group(1)
                     
                     raw_color = ""
                     color_desc = ""
-                    color_match_re = re.search(r'\b(P[A-Z0-9]{2})\b', full_text)
+                    color_match_re = _COLOR_RE.search(full_text)
                     if color_match_re:
                         raw_color = color_match_re.group(1)
                         color_desc_match = re.search(
@@ -1458,15 +1716,7 @@ Retourne UNIQUEMENT un JSON valide (pas de markdown, pas de commentaires):
                         if color_desc_match:
                             color_desc = color_desc_match.group(1).strip().title()
                     
-                    color_map = {
-                        "PW7": "Blanc Vif", "PWZ": "Blanc Vif", "PXJ": "Noir Cristal", 
-                        "PX8": "Noir Diamant", "PSC": "Gris Destroyer", 
-                        "PWL": "Blanc Perle", "PGG": "Gris Granit", "PBF": "Bleu Patriote", 
-                        "PGE": "Vert Sarge", "PRM": "Rouge Velours", "PAR": "Argent Billet",
-                        "PYB": "Jaune Stinger", "PBJ": "Bleu Hydro", "PFQ": "Granite Cristal",
-                        "PDN": "Gris Ceramique",
-                    }
-                    final_color = color_desc or color_map.get(raw_color, raw_color)
+                    final_color = color_desc or _FCA_COLOR_NAMES.get(raw_color, raw_color)
                     parse_method_detail = "regex_fallback"
                     cost_estimate = "~$0.0015"
                 
@@ -1504,7 +1754,7 @@ Retourne UNIQUEMENT un JSON valide (pas de markdown, pas de commentaires):
                     "vin_consistent": vin_consistent,
                     "model_code": model_code,
                     "model_code_validated": master_lookup is not None,
-                    "year": vin_info.get("year") or datetime.now().year,
+                    "year": vin_info.get("year") or now.year,
                     "brand": product_info.get("brand") or vin_brand or "Stellantis",
                     "model": product_info.get("model") or "",
                     "trim": _build_trim_string(product_info),
@@ -1540,56 +1790,29 @@ Retourne UNIQUEMENT un JSON valide (pas de markdown, pas de commentaires):
                 raise HTTPException(status_code=500, detail=f"Erreur analyse OCR: {str(vision_err)}")
         
         # ===== RÈGLE D'OR : JAMAIS ENREGISTRER SI INVALIDE =====
-        # Le système n'enregistre jamais si :
-        # - VIN invalide (ou manquant)
-        # - EP manquant
-        # - PDCO manquant
-        # - EP >= PDCO
+        # Le système n'enregistre jamais si VIN invalide, EP/PDCO manquant ou EP >= PDCO
+        # (règles centralisées dans validation.get_blocking_errors)
         
         if vehicle_data:
-            vin = vehicle_data.get("vin", "")
-            ep = vehicle_data.get("ep_cost", 0) or 0
-            pdco = vehicle_data.get("pdco", 0) or 0
-            
-            blocking_errors = []
-            
-            if not vin or len(vin) != 17:
-                blocking_errors.append("VIN manquant ou invalide (doit être 17 caractères)")
-            
-            if not ep or ep <= 0:
-                blocking_errors.append("EP (Employee Price) manquant")
-            
-            if not pdco or pdco <= 0:
-                blocking_errors.append("PDCO (Dealer Price) manquant")
-            
-            if ep > 0 and pdco > 0 and ep >= pdco:
-                blocking_errors.append(f"EP ({ep}) doit être inférieur à PDCO ({pdco})")
+            blocking_errors = get_blocking_errors(vehicle_data)
             
             if blocking_errors:
                 return {
-                    "success": False,
-                    "review_required": True,
+                    **_BLOCKING_RESPONSE,
                     "blocking_errors": blocking_errors,
                     "vehicle": vehicle_data,
                     "validation": validation,
-                    "parse_method": parse_method,
-                    "message": "Données critiques manquantes ou invalides. Révision obligatoire."
+                    "parse_method": parse_method
                 }
         
         # ===== MONITORING: LOG PARSING METRICS =====
         try:
+            vd = vehicle_data or {}
             score = validation.get("score", 0) if validation else 0
-            duration = 0
-            if vehicle_data and vehicle_data.get("metrics"):
-                duration = vehicle_data["metrics"].get("parse_duration_sec", 0)
+            duration = (vd.get("metrics") or {}).get("parse_duration_sec", 0)
             
             # Déterminer le statut basé sur le score
-            if score >= 85:
-                status = "auto"
-            elif score >= 60:
-                status = "review"
-            else:
-                status = "vision"
+            status = _metric_status(score)
             
             # Estimer le coût basé sur la méthode utilisée
             cost_estimate = 0.0
@@ -1600,24 +1823,24 @@ Retourne UNIQUEMENT un JSON valide (pas de markdown, pas de commentaires):
             # OCR Tesseract = gratuit
             
             log_entry = {
-                "timestamp": datetime.now(),
+                "timestamp": now,
                 "owner_id": user["id"],
                 "parse_method": parse_method,
                 "score": score,
                 "status": status,
-                "vin_valid": vehicle_data.get("vin_valid") if vehicle_data else False,
-                "vin": vehicle_data.get("vin", "")[:17] if vehicle_data else "",
-                "stock_no": vehicle_data.get("stock_no", "") if vehicle_data else "",
-                "brand": vehicle_data.get("brand", "") if vehicle_data else "",
-                "model": vehicle_data.get("model", "") if vehicle_data else "",
-                "ep_cost": vehicle_data.get("ep_cost", 0) if vehicle_data else 0,
-                "pdco": vehicle_data.get("pdco", 0) if vehicle_data else 0,
+                "vin_valid": vd.get("vin_valid", False),
+                "vin": (vd.get("vin") or "")[:17],
+                "stock_no": vd.get("stock_no", ""),
+                "brand": vd.get("brand", ""),
+                "model": vd.get("model", ""),
+                "ep_cost": vd.get("ep_cost", 0),
+                "pdco": vd.get("pdco", 0),
                 "duration_sec": duration,
                 "cost_estimate": cost_estimate,
                 "success": True
             }
             
-            await db.parsing_metrics.insert_one(log_entry)
+            parsing_metrics_buffer.push(log_entry)
             logger.info(f"Parsing metric logged: status={status}, score={score}, method={parse_method}")
         except Exception as log_err:
             logger.warning(f"Failed to log parsing metric: {log_err}")
@@ -1637,7 +1860,7 @@ Retourne UNIQUEMENT un JSON valide (pas de markdown, pas de commentaires):
                 }
                 logger.info(f"Financing info added: Consumer Cash=${financing_info.get('consumer_cash', 0)}, Bonus=${financing_info.get('bonus_cash', 0)}")
         
-        return {
+        result = {
             "success": True,
             "vehicle": vehicle_data,
             "validation": validation,
@@ -1645,6 +1868,10 @@ Retourne UNIQUEMENT un JSON valide (pas de markdown, pas de commentaires):
             "has_financing": financing_info is not None
         }
         
+        await _store_scan_result(cache_key, result)
+        
+        return result
+        
     except HTTPException:
         raise
     except Exception as e:
@@ -1666,8 +1893,8 @@ async def scan_invoice_file(
     user = await get_current_user(authorization)
     
     try:
-        # Lire le fichier
-        file_bytes = await file.read()
+        # Lire le fichier (mmap du fichier temporaire pour les gros uploads)
+        file_bytes = await _read_upload(file)
         
         # Détecter le type de fichier
         is_pdf = (
@@ -1676,12 +1903,8 @@ async def scan_invoice_file(
             file_bytes[:4] == b'%PDF'
         )
         
-        # Convertir en base64 pour réutiliser la logique existante
-        file_base64 = base64.b64encode(file_bytes).decode('utf-8')
-        
-        # Appeler le scan existant
-        request = InvoiceScanRequest(image_base64=file_base64, is_pdf=is_pdf)
-        return await scan_invoice(request, authorization)
+        # Pipeline commun directement sur les octets (pas d'aller-retour base64)
+        return await _scan_invoice_bytes(file_bytes, is_pdf, user)
         
     except HTTPException:
         raise
@@ -1690,6 +1913,13 @@ async def scan_invoice_file(
         raise HTTPException(status_code=500, detail=f"Erreur: {str(e)}")
 
 
+# Champs du parsing OCR recopiés tels quels dans la réponse de /test-ocr
+_TEST_OCR_PARSED_KEYS = (
+    "vin", "model_code", "stock_no", "ep_cost", "pdco", "pref",
+    "holdback", "subtotal", "invoice_total"
+)
+
+
 @router.post("/test-ocr")
 async def test_ocr_pipeline(file: UploadFile = File(...)):
     """
@@ -1713,8 +1943,8 @@ async def test_ocr_pipeline(file: UploadFile = File(...)):
     try:
         start_time = time.time()
         
-        # Lire le fichier
-        file_bytes = await file.read()
+        # Lire le fichier (mmap du fichier temporaire pour les gros uploads)
+        file_bytes = await _read_upload(file)
         file_size = len(file_bytes)
         
         # Détecter le type
@@ -1744,7 +1974,7 @@ async def test_ocr_pipeline(file: UploadFile = File(...)):
         # ===== TEST NIVEAU 1: PDF =====
         if is_pdf:
             result["pipeline_used"] = "pdf_native"
-            extracted_text = extract_pdf_text(file_bytes)
+            extracted_text = await _run_ocr(extract_pdf_text, file_bytes)
             
             result["debug"]["pdf_text_length"] = len(extracted_text) if extracted_text else 0
             result["debug"]["pdf_text_preview"] = extracted_text[:500] if extracted_text else ""
@@ -1767,7 +1997,7 @@ async def test_ocr_pipeline(file: UploadFile = File(...)):
             result["pipeline_used"] = "ocr_zones"
             
             # Pipeline OCR par zones
-            ocr_result = process_image_ocr_pipeline(file_bytes)
+            ocr_result = await _run_ocr(process_image_ocr_pipeline, file_bytes)
             result["raw_ocr"] = {
                 "zones_processed": ocr_result.get("zones_processed", 0),
                 "vin_text": ocr_result.get("vin_text", "")[:200],
@@ -1778,20 +2008,11 @@ async def test_ocr_pipeline(file: UploadFile = File(...)):
             
             # Parser structuré
             parsed = parse_invoice_text(ocr_result)
-            result["parsed_data"] = {
-                "vin": parsed.get("vin"),
-                "model_code": parsed.get("model_code"),
-                "stock_no": parsed.get("stock_no"),
-                "ep_cost": parsed.get("ep_cost"),
-                "pdco": parsed.get("pdco"),
-                "pref": parsed.get("pref"),
-                "holdback": parsed.get("holdback"),
-                "subtotal": parsed.get("subtotal"),
-                "invoice_total": parsed.get("invoice_total"),
-                "options_count": len(parsed.get("options", [])),
-                "options": parsed.get("options", [])[:10],  # Limiter à 10
-                "fields_extracted": parsed.get("fields_extracted", 0)
-            }
+            options_list = parsed.get("options", [])
+            result["parsed_data"] = {k: parsed.get(k) for k in _TEST_OCR_PARSED_KEYS}
+            result["parsed_data"]["options_count"] = len(options_list)
+            result["parsed_data"]["options"] = options_list[:10]  # Limiter à 10
+            result["parsed_data"]["fields_extracted"] = parsed.get("fields_extracted", 0)
             
             # VIN analysis approfondi
             vin = parsed.get("vin", "")
@@ -1821,7 +2042,7 @@ async def test_ocr_pipeline(file: UploadFile = File(...)):
                 result["debug"]["recommendation"] = f"Score {score}/100 suffisant, pas besoin de fallback Vision"
             
             # Test OCR global (comparaison)
-            global_text = process_image_global_ocr(file_bytes)
+            global_text = await _run_ocr(process_image_global_ocr, file_bytes)
             result["debug"]["global_ocr_length"] = len(global_text)
             result["debug"]["global_ocr_preview"] = global_text[:300] if global_text else ""
         
@@ -1861,23 +2082,22 @@ async def scan_and_save_invoice(request: InvoiceScanRequest, authorization: Opti
     # ENRICHIR avec décodage VIN et codes produits
     vehicle_data = enrich_vehicle_data(vehicle_data)
     
-    # Check if stock_no already exists
+    # Numéro de stock requis
     stock_no = vehicle_data.get("stock_no", "")
     if not stock_no:
         raise HTTPException(status_code=400, detail="Numéro de stock non trouvé dans la facture")
     
-    existing = await db.inventory.find_one({"stock_no": stock_no, "owner_id": user["id"]})
-    
-    # Prepare vehicle document
+    # Prepare vehicle document (id/created_at fixés seulement à la création)
+    vehicle_id = str(uuid.uuid4())
+    now = datetime.utcnow()
     vehicle_doc = {
-        "id": str(uuid.uuid4()),
         "owner_id": user["id"],
         "stock_no": stock_no,
         "vin": vehicle_data.get("vin", ""),
         "brand": vehicle_data.get("brand", ""),
         "model": vehicle_data.get("model", ""),
         "trim": vehicle_data.get("trim", ""),
-        "year": vehicle_data.get("year", datetime.now().year),
+        "year": vehicle_data.get("year", now.year),
         "type": vehicle_data.get("type", "neuf"),
         "pdco": vehicle_data.get("pdco", 0) or 0,
         "ep_cost": vehicle_data.get("ep_cost", 0) or 0,
@@ -1889,38 +2109,39 @@ async def scan_and_save_invoice(request: InvoiceScanRequest, authorization: Opti
         "status": "disponible",
         "km": 0,
         "color": vehicle_data.get("color", ""),
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow()
+        "updated_at": now
     }
     
-    if existing:
-        # Update existing
-        await db.inventory.update_one(
-            {"stock_no": stock_no, "owner_id": user["id"]},
-            {"$set": vehicle_doc}
-        )
-        action = "mis à jour"
-    else:
-        # Insert new
-        await db.inventory.insert_one(vehicle_doc)
-        action = "ajouté"
-    
-    # Save options if present
     options = vehicle_data.get("options", [])
-    if options:
-        # Delete existing options
-        await db.vehicle_options.delete_many({"stock_no": stock_no})
-        # Insert new options
-        for idx, opt in enumerate(options):
-            await db.vehicle_options.insert_one({
-                "id": str(uuid.uuid4()),
-                "stock_no": stock_no,
-                # PATCH: Support "product_code" et "code" pour compatibilité
-                "product_code": opt.get("product_code", opt.get("code", "")),
-                "order": idx,
-                "description": opt.get("description", ""),
-                "amount": opt.get("amount", 0) or 0
-            })
+    option_ops = [DeleteMany({"stock_no": stock_no})] + [
+        InsertOne({
+            "id": str(uuid.uuid4()),
+            "stock_no": stock_no,
+            # PATCH: Support "product_code" et "code" pour compatibilité
+            "product_code": opt.get("product_code", opt.get("code", "")),
+            "order": idx,
+            "description": opt.get("description", ""),
+            "amount": opt.get("amount", 0) or 0
+        })
+        for idx, opt in enumerate(options)
+    ] if options else []
+    
+    # Upsert du véhicule + remplacement des options dans une même transaction
+    async with await client.start_session() as session:
+        async with session.start_transaction():
+            vehicle_doc = await db.inventory.find_one_and_update(
+                {"stock_no": stock_no, "owner_id": user["id"]},
+                {"$set": vehicle_doc, "$setOnInsert": {"id": vehicle_id, "created_at": now}},
+                projection={"_id": 0},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+                session=session
+            )
+            if option_ops:
+                # ordered: la suppression doit précéder les insertions
+                await db.vehicle_options.bulk_write(option_ops, session=session)
+    
+    action = "ajouté" if vehicle_doc.get("id") == vehicle_id else "mis à jour"
     
     return {
         "success": True,
@@ -10,7 +10,7 @@ from models import (
     CalculationRequest, PaymentComparison, CalculationResponse,
     ProgramPeriod, ImportRequest, FinancingRates
 )
-from dependencies import calculate_monthly_payment, get_rate_for_term
+from dependencies import calculate_monthly_payment, get_rate_for_term, invalidate_user_cache
 import pypdf
 import io
 
@@ -546,6 +546,7 @@ async def import_programs_excel(file: UploadFile = File(...), password: str = Fo
 
     # Force logout
     await db.tokens.delete_many({})
+    invalidate_user_cache()
     logger.info(f"[EXCEL IMPORT] {updated} modifies, {unchanged} inchanges, {created} crees, {len(errors)} erreurs")
 
     return {
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
 from fastapi.responses import StreamingResponse
 from database import db, ROOT_DIR, logger
+from dependencies import invalidate_user_cache
 import json
 import io
 
@@ -509,6 +510,7 @@ async def import_sci_lease_excel(file: UploadFile = File(...), password: str = F
 
     # Force logout
     r = await db.tokens.delete_many({})
+    invalidate_user_cache()
     logger.info(f"[SCI IMPORT] {updated_total} modifies, {unchanged_total} inchanges, {r.deleted_count} tokens invalides")
 
     return {
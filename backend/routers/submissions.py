@@ -420,7 +420,7 @@ async def compare_programs_with_submissions(authorization: Optional[str] = Heade
                 await db.better_offers.insert_one(offer.copy())
             
             try:
-                send_better_offers_notification(better_offers)
+                await send_better_offers_notification(better_offers)
             except Exception as e:
                 logger.error(f"Error sending better offers notification: {e}")
         
@@ -430,7 +430,7 @@ async def compare_programs_with_submissions(authorization: Optional[str] = Heade
         logger.error(f"Error in compare_programs: {e}")
         return {"better_offers": [], "count": 0, "error": str(e)}
 
-def send_better_offers_notification(offers: List[dict]):
+async def send_better_offers_notification(offers: List[dict]):
     """Envoie une notification par email des meilleures offres disponibles"""
     if not SMTP_EMAIL:
         return
@@ -484,7 +484,7 @@ def send_better_offers_notification(offers: List[dict]):
     </html>
     """
     
-    send_email(SMTP_EMAIL, f"🔔 CalcAuto - {len(offers)} client(s) à relancer!", html_body)
+    await send_email(SMTP_EMAIL, f"🔔 CalcAuto - {len(offers)} client(s) à relancer!", html_body)
 
 @router.get("/better-offers")
 async def get_better_offers(authorization: Optional[str] = Header(None)):
@@ -518,7 +518,7 @@ async def approve_better_offer(submission_id: str, authorization: Optional[str]
     
     # Send email to client
     try:
-        send_client_better_offer_email(offer)
+        await send_client_better_offer_email(offer)
         
         # Mark as sent
         await db.better_offers.update_one(
@@ -531,7 +531,7 @@ async def approve_better_offer(submission_id: str, authorization: Optional[str]
         logger.error(f"Error sending client email: {e}")
         raise HTTPException(status_code=500, detail=f"Erreur d'envoi: {str(e)}")
 
-def send_client_better_offer_email(offer: dict):
+async def send_client_better_offer_email(offer: dict):
     """Envoie un email au client pour l'informer d'une meilleure offre"""
     html_body = f"""
     <!DOCTYPE html>
@@ -571,7 +571,7 @@ def send_client_better_offer_email(offer: dict):
     </html>
     """
     
-    send_email(offer['client_email'], f"🎉 Économisez {offer['savings_monthly']:.2f}$/mois sur votre {offer['vehicle']}!", html_body)
+    await send_email(offer['client_email'], f"🎉 Économisez {offer['savings_monthly']:.2f}$/mois sur votre {offer['vehicle']}!", html_body)
 
 @router.post("/better-offers/{submission_id}/ignore")
 async def ignore_better_offer(submission_id: str, authorization: Optional[str] = Header(None)):
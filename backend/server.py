@@ -7,6 +7,9 @@ All business logic resides in the routers/ and services/ directories.
 from fastapi import FastAPI, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
 from database import client, db, logger
+from services.window_sticker import close_window_sticker_client
+from services.email_service import smtp_connection
+from services.metrics_buffer import parsing_metrics_buffer
 
 # Import all routers
 from routers.auth import router as auth_router
@@ -14,7 +17,7 @@ from routers.programs import router as programs_router
 from routers.submissions import router as submissions_router
 from routers.contacts import router as contacts_router
 from routers.inventory import router as inventory_router
-from routers.invoice import router as invoice_router
+from routers.invoice import router as invoice_router, SCAN_CACHE_TTL_SECONDS
 from routers.email import router as email_router
 from routers.import_wizard import router as import_wizard_router
 from routers.sci import router as sci_router
@@ -68,7 +71,81 @@ app.add_middleware(
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await parsing_metrics_buffer.stop()
     client.close()
+    await close_window_sticker_client()
+    smtp_connection.close()
+
+
+@app.on_event("startup")
+async def start_metrics_buffer():
+    """Demarre l'ecriture par lots des metriques de parsing"""
+    parsing_metrics_buffer.start()
+
+
+async def _log_duplicate_keys(collection, keys):
+    """Journalise les valeurs en double qui empechent la creation d'un index unique"""
+    fields = [keys] if isinstance(keys, str) else [k for k, _ in keys]
+    try:
+        duplicates = await collection.aggregate([
+            {"$group": {"_id": {f: f"${f}" for f in fields}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+            {"$sort": {"count": -1}},
+            {"$limit": 20}
+        ]).to_list(20)
+    except Exception as e:
+        logger.error(f"[INDEX] Impossible de lister les doublons de {collection.name}: {e}")
+        return
+    for dup in duplicates:
+        logger.error(f"[INDEX] Doublon {collection.name} {dup['_id']} ({dup['count']} documents) - a nettoyer")
+
+
+async def _create_index(collection, keys, **kwargs) -> bool:
+    """Cree un index; un echec est journalise sans empecher la creation des autres"""
+    try:
+        await collection.create_index(keys, **kwargs)
+        return True
+    except Exception as e:
+        logger.error(f"[INDEX] Erreur creation index {collection.name} {keys}: {e}")
+        if kwargs.get("unique"):
+            await _log_duplicate_keys(collection, keys)
+        return False
+
+
+@app.on_event("startup")
+async def ensure_indexes():
+    """Crée les index MongoDB des requêtes d'inventaire, de métriques, des caches de scans/stickers et des utilisateurs (idempotent)"""
+    # Chaque index est cree independamment: un index unique bloque par des
+    # doublons existants n'empeche pas les autres (dont le TTL du cache de scans)
+    results = [
+        # Inventaire
+        await _create_index(db.inventory, [("owner_id", 1), ("stock_no", 1)], unique=True),
+        await _create_index(
+            db.inventory, [("owner_id", 1), ("vin", 1)],
+            partialFilterExpression={"vin": {"$type": "string"}}
+        ),
+        await _create_index(db.inventory, [("owner_id", 1), ("status", 1)]),
+        await _create_index(db.inventory, [("owner_id", 1), ("type", 1)]),
+        await _create_index(db.vehicle_options, [("stock_no", 1)]),
+        # Historique/stats de scans par utilisateur + historique admin par jour
+        await _create_index(db.parsing_metrics, [("owner_id", 1), ("timestamp", -1)]),
+        await _create_index(db.parsing_metrics, [("timestamp", -1), ("status", 1)]),
+        # Cache partage des scans de factures (expiration automatique)
+        await _create_index(db.scan_cache, "created_at", expireAfterSeconds=SCAN_CACHE_TTL_SECONDS),
+        # Window Stickers: un document par VIN (cache consulté avant tout appel externe)
+        await _create_index(db.window_stickers, "vin", unique=True),
+        await _create_index(db.window_stickers, "created_at"),
+        # Authentification + administration des utilisateurs
+        await _create_index(db.users, "id", unique=True),
+        await _create_index(db.users, "email", unique=True),
+        # Index partiel: ne contient que les comptes bloques (stats admin)
+        await _create_index(db.users, "is_blocked", partialFilterExpression={"is_blocked": True}),
+        await _create_index(db.tokens, "token"),
+        await _create_index(db.tokens, "user_id"),
+        await _create_index(db.contacts, "owner_id"),
+        await _create_index(db.submissions, "owner_id"),
+    ]
+    logger.info(f"[INDEX] {sum(results)}/{len(results)} index OK")
 
 
 @app.on_event("startup")
@@ -1,14 +1,79 @@
+import asyncio
 import smtplib
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email.mime.image import MIMEImage
 from email import encoders
-from database import SMTP_EMAIL, SMTP_PASSWORD, SMTP_HOST, SMTP_PORT
+from database import SMTP_EMAIL, SMTP_PASSWORD, SMTP_HOST, SMTP_PORT, logger
 
-def send_email(to_email: str, subject: str, html_body: str, attachment_data: bytes = None, attachment_name: str = None, inline_images: list = None, cc_email: str = None):
+
+class SmtpConnection:
+    """
+    Connexion SMTP partagée (keep-alive) entre les envois.
+    STARTTLS + login une seule fois; la connexion est vérifiée par NOOP avant
+    chaque envoi et rouverte si le serveur l'a fermée (inactivité Gmail).
+    """
+    
+    def __init__(self, host: str, port: int, timeout: int = 30):
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+        self._server = None
+        self._lock = threading.Lock()
+    
+    def _connect(self):
+        server = smtplib.SMTP(self._host, self._port, timeout=self._timeout)
+        try:
+            server.starttls()
+            server.login(SMTP_EMAIL, SMTP_PASSWORD)
+        except Exception:
+            server.close()
+            raise
+        return server
+    
+    def _disconnect(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                self._server.close()
+            self._server = None
+    
+    def _is_alive(self) -> bool:
+        try:
+            return self._server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+    
+    def send_message(self, msg, recipients: list):
+        with self._lock:
+            if self._server is not None and not self._is_alive():
+                logger.info("[SMTP] Connexion expirée, reconnexion")
+                self._disconnect()
+            if self._server is None:
+                self._server = self._connect()
+            try:
+                self._server.send_message(msg, to_addrs=recipients)
+            except Exception:
+                # Pas de renvoi automatique (risque de doublon): connexion
+                # réinitialisée pour le prochain envoi, erreur remontée
+                self._disconnect()
+                raise
+    
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+
+smtp_connection = SmtpConnection(SMTP_HOST, SMTP_PORT)
+
+
+def send_email_sync(to_email: str, subject: str, html_body: str, attachment_data: bytes = None, attachment_name: str = None, inline_images: list = None, cc_email: str = None):
     """
     Envoie un email via Gmail SMTP avec support pour images inline (CID).
+    Version bloquante (scripts); depuis un endpoint, utiliser send_email.
     
     Args:
         to_email: Email du destinataire
@@ -60,11 +125,21 @@ def send_email(to_email: str, subject: str, html_body: str, attachment_data: byt
     if cc_email:
         recipients.append(cc_email)
     
-    # Connexion SMTP
-    with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-        server.starttls()
-        server.login(SMTP_EMAIL, SMTP_PASSWORD)
-        server.send_message(msg, to_addrs=recipients)
+    # Connexion SMTP partagée (réutilisée entre les envois)
+    smtp_connection.send_message(msg, recipients)
     
     return True
 
+
+async def send_email(to_email: str, subject: str, html_body: str, attachment_data: bytes = None, attachment_name: str = None, inline_images: list = None, cc_email: str = None):
+    """
+    Version async de send_email_sync: l'envoi SMTP (bloquant) s'execute dans
+    un thread pour ne pas geler la boucle d'evenements pendant le handshake/upload.
+    """
+    return await asyncio.to_thread(
+        send_email_sync, to_email, subject, html_body,
+        attachment_data=attachment_data,
+        attachment_name=attachment_name,
+        inline_images=inline_images,
+        cc_email=cc_email,
+    )
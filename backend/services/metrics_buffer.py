@@ -0,0 +1,91 @@
+"""
+Buffer des métriques de parsing (télémétrie des scans de factures)
+
+Les scans n'attendent plus l'acquittement MongoDB: chaque entrée est poussée
+dans une file en mémoire, puis écrite par lots via insert_many(ordered=False)
+avec un write concern non acquitté (w=0).
+Flush: dès que MAX_BATCH entrées sont en attente, ou toutes les FLUSH_INTERVAL s.
+"""
+import asyncio
+from typing import List, Optional
+
+from pymongo import WriteConcern
+
+from database import db, logger
+
+MAX_BATCH = 200
+FLUSH_INTERVAL = 0.2  # secondes
+
+
+class MetricsBuffer:
+    """File d'écriture par lots pour une collection de télémétrie"""
+
+    def __init__(self, collection_name: str, max_batch: int = MAX_BATCH, interval: float = FLUSH_INTERVAL):
+        self._collection = db[collection_name].with_options(write_concern=WriteConcern(w=0))
+        self._max_batch = max_batch
+        self._interval = interval
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._batch: List[dict] = []  # lot en cours (constitution ou écriture)
+
+    def start(self):
+        """Démarre le worker d'écriture (idempotent)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def push(self, doc: dict):
+        """Ajoute une entrée sans attendre MongoDB"""
+        self._queue.put_nowait(doc)
+        self.start()
+
+    def _drain(self, batch: List[dict]):
+        while len(batch) < self._max_batch and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+
+    async def _write(self, batch: List[dict]):
+        try:
+            await self._collection.insert_many(batch, ordered=False)
+        except Exception as e:
+            logger.warning(f"[METRICS] Échec écriture de {len(batch)} métriques: {e}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch = batch = [await self._queue.get()]
+            deadline = loop.time() + self._interval
+            while len(batch) < self._max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                # asyncio.timeout plutôt que wait_for: en 3.11, wait_for peut
+                # avaler l'annulation de stop() si get() aboutit au même moment
+                try:
+                    async with asyncio.timeout(remaining):
+                        batch.append(await self._queue.get())
+                except TimeoutError:
+                    break
+                self._drain(batch)
+            await self._write(batch)
+            # Vidé seulement après l'écriture: un arrêt pendant insert_many
+            # laisse le lot à stop(), qui l'écrit
+            self._batch = []
+
+    async def stop(self):
+        """Arrête le worker et écrit les entrées restantes (shutdown)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._batch:
+            pending, self._batch = self._batch, []
+            await self._write(pending)
+        while not self._queue.empty():
+            batch: List[dict] = []
+            self._drain(batch)
+            await self._write(batch)
+
+
+parsing_metrics_buffer = MetricsBuffer("parsing_metrics")
@@ -1,19 +1,228 @@
+import asyncio
 import base64
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Optional
+import httpx
+from bson import Binary
+from jinja2 import Environment
 from database import db, ROOT_DIR, logger
 
 # ============ WINDOW STICKER CONFIGURATION ============
-WINDOW_STICKER_URLS = {
-    "chrysler": "https://www.chrysler.com/hostd/windowsticker/getWindowStickerPdf.do?vin=",
-    "jeep": "https://www.jeep.com/hostd/windowsticker/getWindowStickerPdf.do?vin=",
-    "dodge": "https://www.dodge.com/hostd/windowsticker/getWindowStickerPdf.do?vin=",
-    "ram": "https://www.ramtrucks.com/hostd/windowsticker/getWindowStickerPdf.do?vin=",
-    "fiat": "https://www.fiatusa.com/hostd/windowsticker/getWindowStickerPdf.do?vin=",
-    "alfa": "https://www.alfaromeousa.com/hostd/windowsticker/getWindowStickerPdf.do?vin=",
+_WS_PDF_PATH = "/hostd/windowsticker/getWindowStickerPdf.do?vin="
+
+# Marque -> (URL du PDF sans le VIN, referer du site de la marque)
+WINDOW_STICKER_BRANDS = {
+    "chrysler": ("https://www.chrysler.com" + _WS_PDF_PATH, "https://www.chrysler.com/"),
+    "jeep": ("https://www.jeep.com" + _WS_PDF_PATH, "https://www.jeep.com/"),
+    "dodge": ("https://www.dodge.com" + _WS_PDF_PATH, "https://www.dodge.com/"),
+    "ram": ("https://www.ramtrucks.com" + _WS_PDF_PATH, "https://www.ramtrucks.com/"),
+    "fiat": ("https://www.fiatusa.com" + _WS_PDF_PATH, "https://www.fiatusa.com/"),
+    "alfa": ("https://www.alfaromeousa.com" + _WS_PDF_PATH, "https://www.alfaromeousa.com/"),
+}
+
+# Variantes de noms de marque (et modèles courants) -> clé de WINDOW_STICKER_BRANDS
+WINDOW_STICKER_BRAND_ALIASES = {
+    "alfa romeo": "alfa",
+    "ram trucks": "ram",
+    "ram truck": "ram",
+    "fiat usa": "fiat",
+    "grand cherokee": "jeep",
+    "cherokee": "jeep",
+    "wrangler": "jeep",
+    "gladiator": "jeep",
+    "compass": "jeep",
+    "grand wagoneer": "jeep",
+    "wagoneer": "jeep",
+    "pacifica": "chrysler",
+    "grand caravan": "chrysler",
+    "durango": "dodge",
+    "charger": "dodge",
+    "hornet": "dodge",
+    "1500": "ram",
+    "2500": "ram",
+    "3500": "ram",
+    "promaster": "ram",
+    "giulia": "alfa",
+    "stelvio": "alfa",
+    "tonale": "alfa",
+}
+
+# Ordre d'essai quand la marque est inconnue
+WINDOW_STICKER_BRAND_PRIORITY = ("jeep", "chrysler", "dodge", "ram", "fiat", "alfa")
+
+# Headers "humains" des téléchargements (le Referer est ajouté par marque)
+_WS_HTTP_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/122.0.0.0 Safari/537.36"
+    ),
+    "Accept": "application/pdf,application/octet-stream;q=0.9,*/*;q=0.8",
+    "Accept-Language": "fr-CA,fr;q=0.9,en;q=0.8",
+    "Connection": "keep-alive",
+    "Cache-Control": "no-cache",
 }
 
 
+def resolve_window_sticker_brand(brand: Optional[str]) -> Optional[str]:
+    """Clé de WINDOW_STICKER_BRANDS pour une marque (None si inconnue)"""
+    if not brand:
+        return None
+    brand_lower = brand.strip().lower()
+    if brand_lower in WINDOW_STICKER_BRANDS:
+        return brand_lower
+    if brand_lower in WINDOW_STICKER_BRAND_ALIASES:
+        return WINDOW_STICKER_BRAND_ALIASES[brand_lower]
+    # Marque composée ("Dodge Durango", "Chrysler Pacifica"): premier mot
+    first_word = brand_lower.split(maxsplit=1)[0] if brand_lower else ""
+    return first_word if first_word in WINDOW_STICKER_BRANDS else None
+
+
+def window_sticker_pdf_url(vin: str, brand: Optional[str]) -> str:
+    """URL directe du PDF Window Sticker (site Jeep si la marque est inconnue)"""
+    return WINDOW_STICKER_BRANDS[resolve_window_sticker_brand(brand) or "jeep"][0] + vin
+
+
+# Client HTTP partagé: garde les connexions TLS ouvertes entre les VINs (keep-alive)
+WS_CLIENT = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    timeout=30,
+    follow_redirects=True,
+)
+
+
+# Un sticker déjà téléchargé est réutilisé pendant cette durée (aucun appel externe)
+WINDOW_STICKER_CACHE_DAYS = 30
+
+# Largeur max des images de sticker dans les emails
+EMAIL_IMAGE_MAX_WIDTH = 800
+
+# Téléchargement des stickers: taille max acceptée et taille des blocs lus
+WINDOW_STICKER_MAX_BYTES = 10_000_000
+WINDOW_STICKER_CHUNK_SIZE = 65536
+
+# ============ TEMPLATES EMAIL ============
+# Compilés une seule fois à l'import; l'autoescape protège les valeurs venant
+# de la requête (VIN, données de location)
+_EMAIL_TEMPLATES = Environment(autoescape=True)
+
+LEASE_EMAIL_TEMPLATE = _EMAIL_TEMPLATES.from_string("""
+    <div style="margin-top:25px; border-top:2px solid #FFD700; padding-top:20px;">
+        <div style="font-size:12px; color:#666; text-transform:uppercase; letter-spacing:1px; margin-bottom:10px; border-bottom:1px solid #eee; padding-bottom:5px;">
+            📋 Location SCI
+        </div>
+        
+        <table style="width:100%; border-collapse:collapse; margin-bottom:12px;">
+            <tr><td style="padding:8px 0; border-bottom:1px solid #eee; color:#666;">Kilométrage / an</td><td style="padding:8px 0; border-bottom:1px solid #eee; text-align:right; font-weight:600;">{{ km_k }}k km</td></tr>
+            <tr><td style="padding:8px 0; border-bottom:1px solid #eee; color:#666;">Terme location</td><td style="padding:8px 0; border-bottom:1px solid #eee; text-align:right; font-weight:600;">{{ term }} mois</td></tr>
+            <tr><td style="padding:8px 0; border-bottom:1px solid #eee; color:#666;">Résiduel</td><td style="padding:8px 0; border-bottom:1px solid #eee; text-align:right; font-weight:600;">{{ residual_pct }}%{% if km_adj %} (+{{ km_adj }}%){% endif %} = {{ residual_value }} $</td></tr>
+        </table>
+        {% if best_lease and standard and alternative %}
+        <div style="background:#fffde7; border:2px solid #FFD700; border-radius:8px; padding:12px; text-align:center; margin:10px 0;">
+            <div style="font-size:16px; font-weight:bold; color:#F57F17;">🏆 {{ "Std + Lease Cash" if best_lease == 'standard' else "Taux Alternatif" }} = Meilleur choix location!</div>
+            {% if lease_savings %}<div style='font-size:13px; color:#F57F17; margin-top:4px;'>Économies de <strong>{{ lease_savings }} $</strong></div>{% endif %}
+        </div>
+        {% endif %}
+        <div style="display:flex; gap:10px;">
+        {% if standard %}
+        <div style="flex:1; border:2px solid #ddd; border-radius:8px; padding:15px; background:#fafafa; {% if best_lease == 'standard' %}border-color:#FFD700; background:#fffff0;{% endif %}">
+            <div style="font-size:15px; font-weight:bold; color:#E65100; margin-bottom:8px;">Std + Lease Cash {% if best_lease == 'standard' %}<span style="display:inline-block; background:#FFD700; color:#000; font-size:10px; padding:2px 8px; border-radius:10px; margin-left:5px;">✓</span>{% endif %}</div>
+            {% if standard.lease_cash %}<div style='display:flex; justify-content:space-between; font-size:13px; margin-bottom:4px;'><span style='color:#666;'>Lease Cash:</span><span style='color:#2E7D32; font-weight:600;'>-{{ standard.lease_cash }} $</span></div>{% endif %}
+            <div style="display:flex; justify-content:space-between; font-size:13px; margin-bottom:4px;"><span style="color:#666;">Taux:</span><span style="color:#E65100; font-weight:600;">{{ standard.rate }}%</span></div>
+            <div style="background:#fff5ee; border-radius:6px; padding:12px; text-align:center; margin-top:10px; border-top:3px solid #E65100;">
+                <div style="font-size:12px; color:#666;">{{ freq_label }}</div>
+                <div style="font-size:24px; font-weight:bold; color:#E65100; margin:5px 0;">{{ standard.payment }} $</div>
+                <div style="font-size:12px; color:#666;">Total ({{ term }} mois): <strong>{{ standard.total }} $</strong></div>
+            </div>
+        </div>
+        {% endif %}
+        {% if alternative %}
+        <div style="flex:1; border:2px solid #ddd; border-radius:8px; padding:15px; background:#fafafa; {% if best_lease == 'alternative' %}border-color:#FFD700; background:#fffff0;{% endif %}">
+            <div style="font-size:15px; font-weight:bold; color:#0277BD; margin-bottom:8px;">Taux Alternatif {% if best_lease == 'alternative' %}<span style="display:inline-block; background:#FFD700; color:#000; font-size:10px; padding:2px 8px; border-radius:10px; margin-left:5px;">✓</span>{% endif %}</div>
+            <div style="display:flex; justify-content:space-between; font-size:13px; margin-bottom:4px;"><span style="color:#666;">Lease Cash:</span><span>$0</span></div>
+            <div style="display:flex; justify-content:space-between; font-size:13px; margin-bottom:4px;"><span style="color:#666;">Taux:</span><span style="color:#0277BD; font-weight:600;">{{ alternative.rate }}%</span></div>
+            <div style="background:#f0f7ff; border-radius:6px; padding:12px; text-align:center; margin-top:10px; border-top:3px solid #0277BD;">
+                <div style="font-size:12px; color:#666;">{{ freq_label }}</div>
+                <div style="font-size:24px; font-weight:bold; color:#0277BD; margin:5px 0;">{{ alternative.payment }} $</div>
+                <div style="font-size:12px; color:#666;">Total ({{ term }} mois): <strong>{{ alternative.total }} $</strong></div>
+            </div>
+        </div>
+        {% endif %}
+        </div>
+    </div>
+""")
+
+WINDOW_STICKER_EMAIL_TEMPLATE = _EMAIL_TEMPLATES.from_string("""
+    {% if has_images %}
+            <div style="margin-top: 25px; page-break-inside: avoid;">
+                <div style="text-align: center; margin-bottom: 10px;">
+                    <span style="font-size: 14px; font-weight: bold; color: #333;">📋 Window Sticker Officiel</span>
+                    <br/>
+                    <span style="font-size: 12px; color: #666;">VIN: {{ vin }}</span>
+                </div>
+                <div style="text-align: center; border: 1px solid #ddd; border-radius: 8px; padding: 10px; background: #fff;">
+                    <img src="cid:windowsticker_{{ vin }}" 
+                         alt="Window Sticker {{ vin }}" 
+                         style="max-width: 100%; height: auto; border-radius: 4px;" />
+                </div>
+                {% if pdf_url %}
+                <div style="text-align: center; margin-top: 10px;">
+                    <a href="{{ pdf_url }}" 
+                       style="display: inline-block; background: #1565C0; color: white; padding: 8px 20px; text-decoration: none; border-radius: 5px; font-size: 13px;">
+                        📥 Télécharger le PDF
+                    </a>
+                </div>
+                {% endif %}
+            </div>
+    {% else %}
+            <div style="margin-top: 25px;">
+                <div style="background: #e8f4fd; border: 1px solid #2196F3; border-radius: 6px; padding: 15px; text-align: center;">
+                    <p style="margin: 0 0 10px 0; color: #1565C0; font-weight: bold;">📋 Window Sticker Officiel</p>
+                    <p style="margin: 0 0 10px 0; font-size: 12px; color: #666;">VIN: {{ vin }}</p>
+                    <a href="{{ pdf_url }}" 
+                       style="display: inline-block; background: #1565C0; color: white; padding: 10px 25px; text-decoration: none; border-radius: 5px; font-size: 14px;">
+                        📥 Voir le Window Sticker
+                    </a>
+                </div>
+            </div>
+    {% endif %}
+""")
+
+
+# Navigateur headless partagé (fallback Playwright): lancé au premier besoin puis
+# réutilisé; chaque téléchargement n'ouvre qu'un contexte isolé
+_playwright = None
+_browser = None
+_browser_lock = asyncio.Lock()
+
+
+async def _get_playwright_browser():
+    """Navigateur Chromium partagé (relancé s'il a été fermé ou a planté)"""
+    global _playwright, _browser
+    async with _browser_lock:
+        if _browser is None or not _browser.is_connected():
+            from playwright.async_api import async_playwright
+            if _playwright is None:
+                _playwright = await async_playwright().start()
+            _browser = await _playwright.chromium.launch(headless=True)
+        return _browser
+
+
+async def close_window_sticker_client():
+    """Ferme le client HTTP et le navigateur partagés (appelé au shutdown de l'app)"""
+    global _playwright, _browser
+    await WS_CLIENT.aclose()
+    try:
+        if _browser is not None:
+            await _browser.close()
+        if _playwright is not None:
+            await _playwright.stop()
+    except Exception as e:
+        logger.warning(f"Playwright shutdown error: {e}")
+    _playwright = _browser = None
+
+
 def convert_pdf_to_images(pdf_bytes: bytes, max_pages: int = 2, dpi: int = 100) -> list:
     """
     Convertit un PDF en images JPEG optimisées pour email.
@@ -24,7 +233,7 @@ def convert_pdf_to_images(pdf_bytes: bytes, max_pages: int = 2, dpi: int = 100)
         dpi: Résolution (100 = optimisé pour email, petite taille)
     
     Returns:
-        Liste de dicts avec image_base64, width, height
+        Liste de dicts avec jpeg (bytes), base64, width, height
     """
     try:
         import fitz  # PyMuPDF
@@ -37,20 +246,15 @@ def convert_pdf_to_images(pdf_bytes: bytes, max_pages: int = 2, dpi: int = 100)
         for page_num in range(min(len(doc), max_pages)):
             page = doc[page_num]
             
-            # Convertir en image avec le DPI spécifié
-            zoom = dpi / 72  # 72 est le DPI par défaut des PDF
+            # Rendu directement à la taille email (max 800px de large): le zoom
+            # est plafonné au lieu de rendre au DPI demandé puis redimensionner
+            zoom = min(dpi / 72, EMAIL_IMAGE_MAX_WIDTH / page.rect.width)  # 72 = DPI par défaut des PDF
             mat = fitz.Matrix(zoom, zoom)
-            pix = page.get_pixmap(matrix=mat)
+            pix = page.get_pixmap(matrix=mat, alpha=False)
             
-            # Convertir via PIL pour meilleure compression
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            
-            # Redimensionner si trop grand (max 800px de large pour email)
-            max_width = 800
-            if img.width > max_width:
-                ratio = max_width / img.width
-                new_size = (max_width, int(img.height * ratio))
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
+            # Encodage JPEG via PIL (libjpeg-turbo, plus rapide que pix.tobytes("jpeg")):
+            # lu directement dans le buffer du pixmap, sans copie intermédiaire de pix.samples
+            img = Image.frombuffer("RGB", (pix.width, pix.height), pix.samples_mv, "raw", "RGB", pix.stride, 1)
             
             # Compresser en JPEG avec qualité réduite
             buffer = BytesIO()
@@ -59,6 +263,7 @@ def convert_pdf_to_images(pdf_bytes: bytes, max_pages: int = 2, dpi: int = 100)
             img_base64 = base64.b64encode(img_bytes).decode("utf-8")
             
             images.append({
+                "jpeg": img_bytes,
                 "base64": img_base64,
                 "width": img.width,
                 "height": img.height,
@@ -76,107 +281,58 @@ def convert_pdf_to_images(pdf_bytes: bytes, max_pages: int = 2, dpi: int = 100)
         return []
 
 
+async def convert_pdf_to_images_async(pdf_bytes: bytes, max_pages: int = 2, dpi: int = 100) -> list:
+    """convert_pdf_to_images dans un thread (rendu + JPEG bloquent la boucle d'événements)"""
+    return await asyncio.to_thread(convert_pdf_to_images, pdf_bytes, max_pages, dpi)
+
+
+def _lease_payment(option_data, freq):
+    """Paiement de l'option de location pour la fréquence choisie"""
+    if not option_data:
+        return 0
+    if freq == 'weekly':
+        return option_data.get('weekly', 0)
+    elif freq == 'biweekly':
+        return option_data.get('biweekly', 0)
+    return option_data.get('monthly', 0)
+
 
 def generate_lease_email_html(lease_data, freq, freq_label, fmt, fmt2):
     """Génère le HTML pour la section Location SCI dans l'email."""
     if not lease_data:
         return ""
     
-    term = lease_data.get('term', 0)
-    km_per_year = lease_data.get('km_per_year', 24000)
-    residual_pct = lease_data.get('residual_pct', 0)
-    residual_value = lease_data.get('residual_value', 0)
-    km_adj = lease_data.get('km_adjustment', 0)
-    best_lease = lease_data.get('best_lease', '')
-    lease_savings = lease_data.get('lease_savings', 0)
     standard = lease_data.get('standard')
     alternative = lease_data.get('alternative')
     
     if not standard and not alternative:
         return ""
     
-    def get_payment(option_data):
-        if not option_data:
-            return 0
-        if freq == 'weekly':
-            return option_data.get('weekly', 0)
-        elif freq == 'biweekly':
-            return option_data.get('biweekly', 0)
-        return option_data.get('monthly', 0)
-    
-    # Best choice banner
-    best_banner = ""
-    if best_lease and standard and alternative:
-        best_label = "Std + Lease Cash" if best_lease == 'standard' else "Taux Alternatif"
-        savings_text = f"<div style='font-size:13px; color:#F57F17; margin-top:4px;'>Économies de <strong>{fmt(round(lease_savings))} $</strong></div>" if lease_savings > 0 else ""
-        best_banner = f"""
-        <div style="background:#fffde7; border:2px solid #FFD700; border-radius:8px; padding:12px; text-align:center; margin:10px 0;">
-            <div style="font-size:16px; font-weight:bold; color:#F57F17;">🏆 {best_label} = Meilleur choix location!</div>
-            {savings_text}
-        </div>
-        """
-    
-    # Standard option card
-    std_card = ""
-    if standard:
-        std_payment = get_payment(standard)
-        std_winner = "border-color:#FFD700; background:#fffff0;" if best_lease == 'standard' else ""
-        std_badge = '<span style="display:inline-block; background:#FFD700; color:#000; font-size:10px; padding:2px 8px; border-radius:10px; margin-left:5px;">✓</span>' if best_lease == 'standard' else ""
-        lease_cash_row = f"<div style='display:flex; justify-content:space-between; font-size:13px; margin-bottom:4px;'><span style='color:#666;'>Lease Cash:</span><span style='color:#2E7D32; font-weight:600;'>-{fmt(round(standard.get('lease_cash', 0)))} $</span></div>" if standard.get('lease_cash', 0) > 0 else ""
-        std_card = f"""
-        <div style="flex:1; border:2px solid #ddd; border-radius:8px; padding:15px; background:#fafafa; {std_winner}">
-            <div style="font-size:15px; font-weight:bold; color:#E65100; margin-bottom:8px;">Std + Lease Cash {std_badge}</div>
-            {lease_cash_row}
-            <div style="display:flex; justify-content:space-between; font-size:13px; margin-bottom:4px;"><span style="color:#666;">Taux:</span><span style="color:#E65100; font-weight:600;">{standard.get('rate', 0)}%</span></div>
-            <div style="background:#fff5ee; border-radius:6px; padding:12px; text-align:center; margin-top:10px; border-top:3px solid #E65100;">
-                <div style="font-size:12px; color:#666;">{freq_label}</div>
-                <div style="font-size:24px; font-weight:bold; color:#E65100; margin:5px 0;">{fmt2(std_payment)} $</div>
-                <div style="font-size:12px; color:#666;">Total ({term} mois): <strong>{fmt(round(standard.get('total', 0)))} $</strong></div>
-            </div>
-        </div>
-        """
-    
-    # Alternative option card
-    alt_card = ""
-    if alternative:
-        alt_payment = get_payment(alternative)
-        alt_winner = "border-color:#FFD700; background:#fffff0;" if best_lease == 'alternative' else ""
-        alt_badge = '<span style="display:inline-block; background:#FFD700; color:#000; font-size:10px; padding:2px 8px; border-radius:10px; margin-left:5px;">✓</span>' if best_lease == 'alternative' else ""
-        alt_card = f"""
-        <div style="flex:1; border:2px solid #ddd; border-radius:8px; padding:15px; background:#fafafa; {alt_winner}">
-            <div style="font-size:15px; font-weight:bold; color:#0277BD; margin-bottom:8px;">Taux Alternatif {alt_badge}</div>
-            <div style="display:flex; justify-content:space-between; font-size:13px; margin-bottom:4px;"><span style="color:#666;">Lease Cash:</span><span>$0</span></div>
-            <div style="display:flex; justify-content:space-between; font-size:13px; margin-bottom:4px;"><span style="color:#666;">Taux:</span><span style="color:#0277BD; font-weight:600;">{alternative.get('rate', 0)}%</span></div>
-            <div style="background:#f0f7ff; border-radius:6px; padding:12px; text-align:center; margin-top:10px; border-top:3px solid #0277BD;">
-                <div style="font-size:12px; color:#666;">{freq_label}</div>
-                <div style="font-size:24px; font-weight:bold; color:#0277BD; margin:5px 0;">{fmt2(alt_payment)} $</div>
-                <div style="font-size:12px; color:#666;">Total ({term} mois): <strong>{fmt(round(alternative.get('total', 0)))} $</strong></div>
-            </div>
-        </div>
-        """
-    
-    km_adj_text = f" (+{km_adj}%)" if km_adj > 0 else ""
+    km_per_year = lease_data.get('km_per_year', 24000)
+    km_adj = lease_data.get('km_adjustment', 0)
+    lease_savings = lease_data.get('lease_savings', 0)
     
-    return f"""
-    <div style="margin-top:25px; border-top:2px solid #FFD700; padding-top:20px;">
-        <div style="font-size:12px; color:#666; text-transform:uppercase; letter-spacing:1px; margin-bottom:10px; border-bottom:1px solid #eee; padding-bottom:5px;">
-            📋 Location SCI
-        </div>
-        
-        <table style="width:100%; border-collapse:collapse; margin-bottom:12px;">
-            <tr><td style="padding:8px 0; border-bottom:1px solid #eee; color:#666;">Kilométrage / an</td><td style="padding:8px 0; border-bottom:1px solid #eee; text-align:right; font-weight:600;">{int(km_per_year/1000)}k km</td></tr>
-            <tr><td style="padding:8px 0; border-bottom:1px solid #eee; color:#666;">Terme location</td><td style="padding:8px 0; border-bottom:1px solid #eee; text-align:right; font-weight:600;">{term} mois</td></tr>
-            <tr><td style="padding:8px 0; border-bottom:1px solid #eee; color:#666;">Résiduel</td><td style="padding:8px 0; border-bottom:1px solid #eee; text-align:right; font-weight:600;">{residual_pct}%{km_adj_text} = {fmt(round(residual_value))} $</td></tr>
-        </table>
-        
-        {best_banner}
-        
-        <div style="display:flex; gap:10px;">
-            {std_card}
-            {alt_card}
-        </div>
-    </div>
-    """
+    return LEASE_EMAIL_TEMPLATE.render(
+        term=lease_data.get('term', 0),
+        km_k=int(km_per_year / 1000),
+        residual_pct=lease_data.get('residual_pct', 0),
+        km_adj=km_adj if km_adj > 0 else 0,
+        residual_value=fmt(round(lease_data.get('residual_value', 0))),
+        best_lease=lease_data.get('best_lease', ''),
+        lease_savings=fmt(round(lease_savings)) if lease_savings > 0 else None,
+        freq_label=freq_label,
+        standard=standard and {
+            "rate": standard.get('rate', 0),
+            "lease_cash": fmt(round(standard.get('lease_cash', 0))) if standard.get('lease_cash', 0) > 0 else None,
+            "payment": fmt2(_lease_payment(standard, freq)),
+            "total": fmt(round(standard.get('total', 0))),
+        },
+        alternative=alternative and {
+            "rate": alternative.get('rate', 0),
+            "payment": fmt2(_lease_payment(alternative, freq)),
+            "total": fmt(round(alternative.get('total', 0))),
+        },
+    )
 
 
 def generate_window_sticker_html(vin: str, images: list, pdf_url: str, pdf_bytes: bytes = None) -> str:
@@ -187,70 +343,50 @@ def generate_window_sticker_html(vin: str, images: list, pdf_url: str, pdf_bytes
     if not vin or len(vin) != 17:
         return ""
     
-    # Si on a des images converties du PDF, les afficher avec CID
-    if images and len(images) > 0:
-        # Utiliser CID au lieu de data: pour Gmail compatibility
-        cid = f"windowsticker_{vin}"
-        
-        return f'''
-            <div style="margin-top: 25px; page-break-inside: avoid;">
-                <div style="text-align: center; margin-bottom: 10px;">
-                    <span style="font-size: 14px; font-weight: bold; color: #333;">📋 Window Sticker Officiel</span>
-                    <br/>
-                    <span style="font-size: 12px; color: #666;">VIN: {vin}</span>
-                </div>
-                <div style="text-align: center; border: 1px solid #ddd; border-radius: 8px; padding: 10px; background: #fff;">
-                    <img src="cid:{cid}" 
-                         alt="Window Sticker {vin}" 
-                         style="max-width: 100%; height: auto; border-radius: 4px;" />
-                </div>
-                <div style="text-align: center; margin-top: 10px;">
-                    <a href="{pdf_url}" 
-                       style="display: inline-block; background: #1565C0; color: white; padding: 8px 20px; text-decoration: none; border-radius: 5px; font-size: 13px;">
-                        📥 Télécharger le PDF
-                    </a>
-                </div>
-            </div>
-        '''
-    
-    # Fallback: pas d'images, juste le lien
-    elif pdf_url:
-        return f'''
-            <div style="margin-top: 25px;">
-                <div style="background: #e8f4fd; border: 1px solid #2196F3; border-radius: 6px; padding: 15px; text-align: center;">
-                    <p style="margin: 0 0 10px 0; color: #1565C0; font-weight: bold;">📋 Window Sticker Officiel</p>
-                    <p style="margin: 0 0 10px 0; font-size: 12px; color: #666;">VIN: {vin}</p>
-                    <a href="{pdf_url}" 
-                       style="display: inline-block; background: #1565C0; color: white; padding: 10px 25px; text-decoration: none; border-radius: 5px; font-size: 14px;">
-                        📥 Voir le Window Sticker
-                    </a>
-                </div>
-            </div>
-        '''
+    if not images and not pdf_url:
+        return ""
     
-    return ""
+    # Si on a des images converties du PDF, elles sont affichées avec CID
+    # (au lieu de data:) pour la compatibilité Gmail; sinon juste le lien
+    return WINDOW_STICKER_EMAIL_TEMPLATE.render(vin=vin, has_images=bool(images), pdf_url=pdf_url)
 
 
 async def fetch_window_sticker(vin: str, brand: str = None) -> dict:
     """
     Télécharge le Window Sticker PDF pour un VIN donné.
-    Approche KenBot: HTTP humain + validation PDF + fallback Playwright
+    Approche KenBot: HTTP humain (marques en parallèle) + validation PDF + fallback Playwright
     
     Returns:
         dict avec:
         - success: bool
-        - pdf_base64: str (PDF encodé en base64)
-        - pdf_url: str (URL directe)
+        - pdf_bytes: bytes (PDF brut)
+        - pdf_url: str (URL directe, None si servi depuis le cache MongoDB)
         - size_bytes: int
+        - method: "cache" | "http" | "playwright" (pas de re-sauvegarde si "cache")
         - error: str (si échec)
     """
-    import requests
-    
     MIN_PDF_SIZE = 20_000  # 20 KB minimum pour un vrai sticker
     
     if not vin or len(vin) != 17:
         return {"success": False, "error": "VIN invalide (doit être 17 caractères)"}
     
+    # Sticker récent déjà en base: aucun appel aux sites Stellantis
+    cached = await db.window_stickers.find_one(
+        {"vin": vin, "created_at": {"$gte": datetime.utcnow() - timedelta(days=WINDOW_STICKER_CACHE_DAYS)}},
+        {"_id": 0, "pdf": 1, "pdf_base64": 1, "size_bytes": 1}
+    )
+    cached_pdf = window_sticker_pdf_bytes(cached)
+    if cached_pdf:
+        logger.info(f"Window Sticker trouvé en cache: VIN={vin}")
+        return {
+            "success": True,
+            "pdf_bytes": cached_pdf,
+            "pdf_url": None,
+            "size_bytes": cached.get("size_bytes", 0),
+            "brand_source": "cache",
+            "method": "cache"
+        }
+    
     def validate_pdf(data: bytes) -> tuple[bool, str]:
         """Valide que les bytes sont un vrai PDF Window Sticker"""
         if len(data) < MIN_PDF_SIZE:
@@ -260,39 +396,42 @@ async def fetch_window_sticker(vin: str, brand: str = None) -> dict:
             return False, f"Pas un PDF (head={head!r}) — probablement HTML/Not found/anti-bot"
         return True, "OK"
     
-    def download_pdf_human(pdf_url: str, referer: str) -> bytes:
+    async def download_pdf_human(pdf_url: str, referer: str) -> bytes:
         """Télécharge le PDF avec headers humains"""
-        headers = {
-            "User-Agent": (
-                "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-                "AppleWebKit/537.36 (KHTML, like Gecko) "
-                "Chrome/122.0.0.0 Safari/537.36"
-            ),
-            "Accept": "application/pdf,application/octet-stream;q=0.9,*/*;q=0.8",
-            "Accept-Language": "fr-CA,fr;q=0.9,en;q=0.8",
-            "Referer": referer,
-            "Connection": "keep-alive",
-            "Cache-Control": "no-cache",
-        }
+        headers = {**_WS_HTTP_HEADERS, "Referer": referer}
         
-        response = requests.get(pdf_url, headers=headers, timeout=30, allow_redirects=True)
-        response.raise_for_status()
-        return response.content
+        # Lecture par blocs: une page HTML (anti-bot, Not found) est rejetée dès
+        # le premier bloc et un PDF démesuré est coupé à WINDOW_STICKER_MAX_BYTES
+        async with WS_CLIENT.stream("GET", pdf_url, headers=headers) as response:
+            response.raise_for_status()
+            if int(response.headers.get("content-length") or 0) > WINDOW_STICKER_MAX_BYTES:
+                raise ValueError(f"PDF trop gros ({response.headers['content-length']} bytes)")
+            buf = bytearray()
+            async for chunk in response.aiter_bytes(WINDOW_STICKER_CHUNK_SIZE):
+                buf.extend(chunk)
+                if len(buf) > WINDOW_STICKER_MAX_BYTES:
+                    raise ValueError(f"PDF trop gros (> {WINDOW_STICKER_MAX_BYTES} bytes)")
+                if len(buf) >= 4 and not buf.startswith(b"%PDF"):
+                    raise ValueError(f"Pas un PDF (head={bytes(buf[:30])!r}) — probablement HTML/Not found/anti-bot")
+        return bytes(buf)
     
     async def download_pdf_playwright(pdf_url: str) -> bytes:
         """Fallback: télécharge via navigateur headless (async) - OPTIONNEL"""
         try:
-            from playwright.async_api import async_playwright
+            browser = await _get_playwright_browser()
         except ImportError:
             logger.warning("Playwright non installé - fallback désactivé")
             raise RuntimeError("Playwright non disponible")
+        except Exception as e:
+            logger.warning(f"Playwright error: {e}")
+            raise RuntimeError(f"Playwright failed: {e}")
         
         pdf_bytes = None
         
         try:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(headless=True)
-                page = await browser.new_page()
+            context = await browser.new_context()
+            try:
+                page = await context.new_page()
                 
                 async def on_response(resp):
                     nonlocal pdf_bytes
@@ -312,8 +451,8 @@ async def fetch_window_sticker(vin: str, brand: str = None) -> dict:
                         await page.wait_for_timeout(3000)
                 except Exception as e:
                     logger.warning(f"Playwright navigation error: {e}")
-                
-                await browser.close()
+            finally:
+                await context.close()
         except Exception as e:
             logger.warning(f"Playwright error: {e}")
             raise RuntimeError(f"Playwright failed: {e}")
@@ -322,92 +461,81 @@ async def fetch_window_sticker(vin: str, brand: str = None) -> dict:
             raise RuntimeError("PDF non capturé via Playwright")
         return pdf_bytes
     
-    # Déterminer les URLs à essayer basées sur la marque
-    urls_to_try = []
-    
-    if brand:
-        brand_lower = brand.lower()
-        for key in WINDOW_STICKER_URLS:
-            if key in brand_lower or brand_lower in key:
-                urls_to_try.append((key, WINDOW_STICKER_URLS[key] + vin))
-                break
+    # Marque connue: un seul site; sinon tous les sites Stellantis
+    resolved_brand = resolve_window_sticker_brand(brand)
+    brands_to_try = (resolved_brand,) if resolved_brand else WINDOW_STICKER_BRAND_PRIORITY
+    urls_to_try = [(key, WINDOW_STICKER_BRANDS[key][0] + vin) for key in brands_to_try]
     
-    # Si pas de marque ou pas trouvé, essayer toutes les URLs Stellantis
-    if not urls_to_try:
-        priority = ["jeep", "chrysler", "dodge", "ram", "fiat", "alfa"]
-        for key in priority:
-            urls_to_try.append((key, WINDOW_STICKER_URLS[key] + vin))
+    async def try_http(brand_key: str, url: str) -> bytes:
+        """Étape 1: HTTP "humain" + validation du PDF"""
+        referer = WINDOW_STICKER_BRANDS[brand_key][1]
+        logger.info(f"Window Sticker HTTP fetch: VIN={vin}, Brand={brand_key}")
+        pdf_bytes = await download_pdf_human(url, referer)
+        is_valid, msg = validate_pdf(pdf_bytes)
+        if not is_valid:
+            raise ValueError(msg)
+        return pdf_bytes
     
-    # Referers par marque
-    referers = {
-        "jeep": "https://www.jeep.com/",
-        "chrysler": "https://www.chrysler.com/",
-        "dodge": "https://www.dodge.com/",
-        "ram": "https://www.ramtrucks.com/",
-        "fiat": "https://www.fiatusa.com/",
-        "alfa": "https://www.alfaromeousa.com/",
-    }
+    def success(brand_key: str, url: str, pdf_bytes: bytes, method: str) -> dict:
+        logger.info(f"Window Sticker téléchargé ({method}): VIN={vin}, Size={len(pdf_bytes)} bytes")
+        return {
+            "success": True,
+            "pdf_bytes": pdf_bytes,
+            "pdf_url": url,
+            "size_bytes": len(pdf_bytes),
+            "brand_source": brand_key,
+            "method": method
+        }
     
     last_error = None
     
+    # === Étape 1: toutes les marques en parallèle, le premier PDF valide gagne ===
+    # Un seul site Stellantis a le sticker d'un VIN: on n'attend pas les timeouts
+    # des autres, qui sont annulés dès qu'un PDF valide arrive.
+    tasks = {asyncio.create_task(try_http(brand_key, url)): (brand_key, url) for brand_key, url in urls_to_try}
+    pending = set(tasks)
+    found = None
+    try:
+        while pending and found is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                brand_key, url = tasks[task]
+                try:
+                    pdf_bytes = task.result()
+                except Exception as e:
+                    logger.warning(f"Window Sticker HTTP failed for {brand_key}: {e}")
+                    last_error = str(e)
+                    continue
+                if found is None:
+                    found = (brand_key, url, pdf_bytes)
+    finally:
+        for task in pending:
+            task.cancel()
+    
+    if found:
+        return success(*found, "http")
+    
+    # === Étape 2: Fallback Playwright (seulement si aucun HTTP n'a abouti) ===
     for brand_key, url in urls_to_try:
-        referer = referers.get(brand_key, "https://www.chrysler.com/")
-        
-        # === Étape 1: HTTP "humain" ===
-        try:
-            logger.info(f"Window Sticker HTTP fetch: VIN={vin}, Brand={brand_key}")
-            pdf_bytes = download_pdf_human(url, referer)
-            
-            is_valid, msg = validate_pdf(pdf_bytes)
-            if is_valid:
-                pdf_base64 = base64.b64encode(pdf_bytes).decode("utf-8")
-                logger.info(f"Window Sticker téléchargé (HTTP): VIN={vin}, Size={len(pdf_bytes)} bytes")
-                return {
-                    "success": True,
-                    "pdf_base64": pdf_base64,
-                    "pdf_url": url,
-                    "size_bytes": len(pdf_bytes),
-                    "brand_source": brand_key,
-                    "method": "http"
-                }
-            else:
-                logger.warning(f"Window Sticker HTTP invalid: {msg}")
-                last_error = msg
-        except Exception as e:
-            logger.warning(f"Window Sticker HTTP failed for {brand_key}: {e}")
-            last_error = str(e)
-        
-        # === Étape 2: Fallback Playwright ===
         try:
             logger.info(f"Window Sticker Playwright fallback: VIN={vin}, Brand={brand_key}")
             pdf_bytes = await download_pdf_playwright(url)
             
             is_valid, msg = validate_pdf(pdf_bytes)
             if is_valid:
-                pdf_base64 = base64.b64encode(pdf_bytes).decode("utf-8")
-                logger.info(f"Window Sticker téléchargé (Playwright): VIN={vin}, Size={len(pdf_bytes)} bytes")
-                return {
-                    "success": True,
-                    "pdf_base64": pdf_base64,
-                    "pdf_url": url,
-                    "size_bytes": len(pdf_bytes),
-                    "brand_source": brand_key,
-                    "method": "playwright"
-                }
-            else:
-                logger.warning(f"Window Sticker Playwright invalid: {msg}")
-                last_error = msg
+                return success(brand_key, url, pdf_bytes, "playwright")
+            logger.warning(f"Window Sticker Playwright invalid: {msg}")
+            last_error = msg
         except Exception as e:
             logger.warning(f"Window Sticker Playwright failed for {brand_key}: {e}")
             last_error = str(e)
-            continue
     
     return {"success": False, "error": f"Window Sticker non trouvé: {last_error}"}
 
 
-async def save_window_sticker_to_db(vin: str, pdf_base64: str, owner_id: str) -> str:
+async def save_window_sticker_to_db(vin: str, pdf_bytes: bytes, owner_id: str) -> str:
     """
-    Sauvegarde le Window Sticker PDF dans MongoDB.
+    Sauvegarde le Window Sticker PDF dans MongoDB (octets bruts, BSON Binary).
     
     Returns:
         ID du document créé
@@ -416,16 +544,46 @@ async def save_window_sticker_to_db(vin: str, pdf_base64: str, owner_id: str) ->
     
     await db.window_stickers.update_one(
         {"vin": vin},
-        {"$set": {
-            "id": doc_id,
-            "vin": vin,
-            "pdf_base64": pdf_base64,
-            "owner_id": owner_id,
-            "created_at": datetime.utcnow(),
-            "size_bytes": len(base64.b64decode(pdf_base64))
-        }},
+        {
+            "$set": {
+                "id": doc_id,
+                "vin": vin,
+                "pdf": Binary(pdf_bytes),
+                "owner_id": owner_id,
+                "created_at": datetime.utcnow(),
+                "size_bytes": len(pdf_bytes)
+            },
+            # Ancien format (PDF en base64) remplacé par le champ binaire;
+            # l'aperçu JPEG de l'ancien PDF n'est plus valide
+            "$unset": {"pdf_base64": "", "preview_jpeg": "", "preview_wh": ""}
+        },
         upsert=True
     )
     
     return doc_id
 
+
+async def save_window_sticker_preview(vin: str, image: dict):
+    """
+    Mémorise l'image JPEG de la 1re page (image inline des emails) sur le
+    document window_stickers: les envois suivants pour ce VIN ne refont pas le rendu.
+    """
+    await db.window_stickers.update_one(
+        {"vin": vin},
+        {"$set": {
+            "preview_jpeg": Binary(image["jpeg"]),
+            "preview_wh": [image["width"], image["height"]]
+        }}
+    )
+
+
+def window_sticker_pdf_bytes(doc: dict):
+    """Octets du PDF d'un document window_stickers (binaire, ou ancien format base64)"""
+    if not doc:
+        return None
+    if doc.get("pdf"):
+        return bytes(doc["pdf"])
+    if doc.get("pdf_base64"):
+        return base64.b64decode(doc["pdf_base64"])
+    return None
+
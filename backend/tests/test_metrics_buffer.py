@@ -0,0 +1,92 @@
+"""
+Tests du buffer d'écriture par lots des métriques de parsing
+(services/metrics_buffer.py). La collection MongoDB est remplacée par une
+collection en mémoire qui enregistre chaque insert_many.
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "calcauto_test")
+
+from services.metrics_buffer import MetricsBuffer
+
+
+class FakeCollection:
+    """insert_many enregistré; le premier appel peut rester bloqué (arrêt pendant l'écriture)"""
+
+    def __init__(self, block_first=False):
+        self.batches = []
+        self.calls = 0
+        self.block_first = block_first
+        self.first_call_started = asyncio.Event()
+
+    async def insert_many(self, docs, ordered=True):
+        self.calls += 1
+        if self.block_first and self.calls == 1:
+            self.first_call_started.set()
+            await asyncio.Event().wait()
+        self.batches.append(list(docs))
+
+
+def make_buffer(max_batch=3, interval=10.0, **kwargs):
+    buffer = MetricsBuffer("parsing_metrics", max_batch=max_batch, interval=interval)
+    buffer._collection = FakeCollection(**kwargs)
+    return buffer
+
+
+class TestMetricsBuffer:
+
+    def test_flush_on_max_batch(self):
+        """Un lot plein est écrit sans attendre l'intervalle"""
+        async def scenario():
+            buffer = make_buffer(max_batch=3, interval=10.0)
+            for i in range(4):
+                buffer.push({"n": i})
+            await asyncio.sleep(0.05)
+            written = list(buffer._collection.batches)
+            await buffer.stop()
+            return written, buffer._collection.batches
+
+        before_stop, after_stop = asyncio.run(scenario())
+        assert before_stop == [[{"n": 0}, {"n": 1}, {"n": 2}]]
+        assert after_stop[-1] == [{"n": 3}]
+
+    def test_flush_on_interval(self):
+        async def scenario():
+            buffer = make_buffer(max_batch=100, interval=0.05)
+            buffer.push({"n": 1})
+            buffer.push({"n": 2})
+            await asyncio.sleep(0.2)
+            written = list(buffer._collection.batches)
+            await buffer.stop()
+            return written
+
+        assert asyncio.run(scenario()) == [[{"n": 1}, {"n": 2}]]
+
+    def test_flush_on_stop(self):
+        """Les entrées en attente sont écrites au shutdown"""
+        async def scenario():
+            buffer = make_buffer(max_batch=100, interval=10.0)
+            for i in range(5):
+                buffer.push({"n": i})
+            await asyncio.sleep(0)
+            await buffer.stop()
+            return buffer._collection.batches
+
+        batches = asyncio.run(scenario())
+        assert [doc["n"] for batch in batches for doc in batch] == [0, 1, 2, 3, 4]
+
+    def test_stop_during_write_keeps_batch(self):
+        """Un arrêt pendant insert_many ne perd pas le lot en cours"""
+        async def scenario():
+            buffer = make_buffer(max_batch=2, interval=10.0, block_first=True)
+            buffer.push({"n": 1})
+            buffer.push({"n": 2})
+            await buffer._collection.first_call_started.wait()
+            await buffer.stop()
+            return buffer._collection.batches
+
+        assert asyncio.run(scenario()) == [[{"n": 1}, {"n": 2}]]
@@ -24,7 +24,8 @@ from parser import (
 from validation import (
     validate_ep_pdco,
     validate_pdco_minimum,
-    calculate_validation_score
+    calculate_validation_score,
+    get_blocking_errors
 )
 
 
@@ -207,6 +208,16 @@ class TestValidation:
         result = calculate_validation_score(data)
         assert result["score"] >= 70
         assert result["status"] in ["valid", "review"]
+    
+    def test_blocking_errors(self):
+        """Erreurs bloquantes: VIN, EP, PDCO, EP >= PDCO"""
+        assert get_blocking_errors({"vin": "1C4RJKBG5S8123456", "ep_cost": 55000, "pdco": 65000}) == []
+        
+        errors = get_blocking_errors({"vin": "1C4RJ", "ep_cost": None, "pdco": 0})
+        assert len(errors) == 3
+        
+        errors = get_blocking_errors({"vin": "1C4RJKBG5S8123456", "ep_cost": 65000, "pdco": 55000})
+        assert errors == ["EP (65000) doit être inférieur à PDCO (55000)"]
 
 
 # =====================================
@@ -390,6 +401,102 @@ YGV 17 L SUPPLEMENTAIRES D ESSENCE
         assert "YGV" in codes
 
 
+def _invoice_module():
+    """routers.invoice (database exige MONGO_URL/DB_NAME; aucune connexion n'est ouverte)"""
+    import os
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "calcauto_test")
+    import routers.invoice as invoice
+    return invoice
+
+
+class _FakeScanCacheCollection:
+    """Collection scan_cache en mémoire (find_one/replace_one par _id)"""
+
+    def __init__(self):
+        self.docs = {}
+        self.lookups = []
+
+    async def find_one(self, query, projection=None):
+        self.lookups.append(query["_id"])
+        return self.docs.get(query["_id"])
+
+    async def replace_one(self, query, doc, upsert=False):
+        self.docs[query["_id"]] = doc
+
+
+class TestScanResultCache:
+    """Cache des scans de factures (mémoire + scan_cache), propre à chaque utilisateur"""
+
+    def _run(self, coro_factory):
+        import asyncio
+        from types import SimpleNamespace
+        from unittest.mock import patch
+        invoice = _invoice_module()
+        collection = _FakeScanCacheCollection()
+        with patch.object(invoice, "db", SimpleNamespace(scan_cache=collection)), \
+                patch.dict(invoice._scan_result_cache, clear=True):
+            return asyncio.run(coro_factory(invoice)), collection
+
+    def test_hit_after_store(self):
+        result = {"success": True, "vehicle": {"vin": "1C4RJKBG5S8123456"}}
+
+        async def scenario(invoice):
+            await invoice._store_scan_result(("user-1", "abc", True), result)
+            hit = await invoice._get_cached_scan(("user-1", "abc", True))
+            hit["vehicle"]["vin"] = "modifié"
+            return hit, await invoice._get_cached_scan(("user-1", "abc", True))
+
+        (first, second), collection = self._run(scenario)
+        assert first["success"] is True
+        # Une réponse modifiée par l'appelant ne corrompt pas le cache
+        assert second["vehicle"]["vin"] == "1C4RJKBG5S8123456"
+        # Servi depuis la mémoire: MongoDB n'est pas interrogé
+        assert collection.lookups == []
+        assert collection.docs["user-1:abc:pdf"]["owner_id"] == "user-1"
+
+    def test_miss_for_other_user(self):
+        async def scenario(invoice):
+            await invoice._store_scan_result(("user-1", "abc", True), {"success": True})
+            return await invoice._get_cached_scan(("user-2", "abc", True))
+
+        hit, collection = self._run(scenario)
+        assert hit is None
+        assert collection.lookups == ["user-2:abc:pdf"]
+
+    def test_miss_pdf_vs_image(self):
+        async def scenario(invoice):
+            await invoice._store_scan_result(("user-1", "abc", True), {"success": True})
+            return await invoice._get_cached_scan(("user-1", "abc", False))
+
+        hit, _ = self._run(scenario)
+        assert hit is None
+
+    def test_mongo_hit_fills_memory(self):
+        async def scenario(invoice):
+            invoice.db.scan_cache.docs["user-1:abc:img"] = {"result": {"success": True}}
+            first = await invoice._get_cached_scan(("user-1", "abc", False))
+            second = await invoice._get_cached_scan(("user-1", "abc", False))
+            return first, second
+
+        (first, second), collection = self._run(scenario)
+        assert first == second == {"success": True}
+        assert collection.lookups == ["user-1:abc:img"]
+
+    def test_fifo_eviction(self):
+        async def scenario(invoice):
+            size = invoice._SCAN_RESULT_CACHE_MAX
+            for i in range(size + 1):
+                invoice._remember_scan_result(("user-1", f"h{i}", True), {"n": i})
+            return size, dict(invoice._scan_result_cache)
+
+        (size, cache), _ = self._run(scenario)
+        assert size == 512
+        assert len(cache) == size
+        assert ("user-1", "h0", True) not in cache
+        assert cache[("user-1", f"h{size}", True)] == {"n": size}
+
+
 if __name__ == "__main__":
     # Exécuter avec pytest
     pytest.main([__file__, "-v", "--tb=short"])
@@ -0,0 +1,149 @@
+"""
+Tests des endpoints de statistiques basés sur une agrégation d'un seul document
+(stats inventaire, stats parsing admin, stats scans utilisateur).
+
+db est remplacé par des collections factices dont aggregate() renvoie un
+curseur asynchrone en mémoire (to_list / __aiter__), donc aucun MongoDB
+n'est nécessaire.
+"""
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "calcauto_test")
+
+import routers.admin as admin
+import routers.inventory as inventory
+
+
+USER = {"id": "user-1", "email": "vendeur@example.com"}
+
+
+class FakeCursor:
+    """Curseur d'agrégation en mémoire: itération asynchrone et to_list"""
+
+    def __init__(self, docs):
+        self._docs = list(docs)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._docs:
+            yield doc
+
+    async def to_list(self, length=None):
+        return self._docs[:length] if length else list(self._docs)
+
+
+class FakeCollection:
+    def __init__(self, name, docs, pipelines):
+        self.name = name
+        self._docs = docs
+        self._pipelines = pipelines
+
+    def aggregate(self, pipeline, *args, **kwargs):
+        self._pipelines.append((self.name, pipeline))
+        return FakeCursor(self._docs)
+
+
+def run_with_aggregate(results, coro_factory):
+    """Exécute l'endpoint; aggregate() renvoie results[nom de la collection]"""
+    pipelines = []
+    fake_db = SimpleNamespace(**{
+        name: FakeCollection(name, results.get(name, []), pipelines)
+        for name in ("inventory", "parsing_metrics")
+    })
+
+    async def fake_user(authorization=None):
+        return USER
+
+    with patch.object(admin, "db", fake_db), \
+            patch.object(inventory, "db", fake_db), \
+            patch.object(admin, "require_admin", fake_user), \
+            patch.object(admin, "get_current_user", fake_user), \
+            patch.object(inventory, "get_current_user", fake_user):
+        return asyncio.run(coro_factory()), pipelines
+
+
+class TestInventoryStats:
+
+    def test_facet_counts(self):
+        facet = {
+            "by_status": [{"_id": "disponible", "n": 3}, {"_id": "vendu", "n": 2}],
+            "by_type": [{"_id": "neuf", "n": 4}, {"_id": "occasion", "n": 1}],
+            "totals": [{"_id": None, "total_msrp": 150000, "total_cost": 120000}],
+            "total": [{"n": 5}],
+        }
+        stats, pipelines = run_with_aggregate(
+            {"inventory": [facet]}, lambda: inventory.get_inventory_stats("Bearer t")
+        )
+        assert stats["total"] == 5
+        assert stats["disponible"] == 3
+        assert stats["vendu"] == 2
+        assert stats["neuf"] == 4
+        assert stats["potential_profit"] == 30000
+        assert pipelines[0][1][0] == {"$match": {"owner_id": USER["id"]}}
+
+    def test_empty_inventory(self):
+        stats, _ = run_with_aggregate(
+            {"inventory": [{"by_status": [], "by_type": [], "totals": [], "total": []}]},
+            lambda: inventory.get_inventory_stats("Bearer t")
+        )
+        assert stats["total"] == 0
+        assert stats["total_msrp"] == 0
+
+
+class TestParsingStats:
+
+    def test_rates(self):
+        facet = {
+            "total": [{"n": 10}],
+            "by_status": [{"_id": "auto", "count": 8}, {"_id": "review", "count": 2}],
+            "avgs": [{"_id": None, "avg_score": 88.456, "avg_time": 3.219}],
+        }
+        stats, _ = run_with_aggregate(
+            {"parsing_metrics": [facet]}, lambda: admin.get_parsing_stats("Bearer t")
+        )
+        assert stats["total_scans"] == 10
+        assert stats["auto_rate"] == 80.0
+        assert stats["review_rate"] == 20.0
+        assert stats["avg_score"] == 88.46
+        assert stats["quality_alert"] is False
+
+    def test_no_scans(self):
+        stats, _ = run_with_aggregate(
+            {"parsing_metrics": [{"total": [], "by_status": [], "avgs": []}]},
+            lambda: admin.get_parsing_stats("Bearer t")
+        )
+        assert stats["total_scans"] == 0
+        assert stats["message"] == "Aucun scan enregistré"
+
+
+class TestUserScanStats:
+
+    def test_group_result(self):
+        group = {
+            "_id": None, "total": 4, "avg_score": 91.25, "avg_duration": 2.5,
+            "total_cost": 0.006, "success_count": 3,
+            "google_vision_count": 2, "tesseract_count": 2, "gpt4_vision_count": 0,
+        }
+        stats, pipelines = run_with_aggregate(
+            {"parsing_metrics": [group]}, lambda: admin.get_user_scan_stats(30, "Bearer t")
+        )
+        assert stats["total_scans"] == 4
+        assert stats["success_rate"] == 75.0
+        assert stats["methods_breakdown"]["google_vision_hybrid"] == 2
+        assert stats["free_quota_remaining"] == 998
+        assert pipelines[0][1][0]["$match"]["owner_id"] == USER["id"]
+
+    def test_no_scans_in_period(self):
+        stats, _ = run_with_aggregate(
+            {"parsing_metrics": []}, lambda: admin.get_user_scan_stats(7, "Bearer t")
+        )
+        assert stats["total_scans"] == 0
+        assert stats["period_days"] == 7
@@ -0,0 +1,152 @@
+"""
+Tests du cache des utilisateurs authentifiés (dependencies.get_current_user):
+TTL, invalidation par token / par utilisateur, éviction FIFO, et invalidation
+au demo-login. MongoDB est remplacé par des collections en mémoire.
+"""
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "calcauto_test")
+
+import dependencies
+import routers.auth as auth
+
+
+class FakeCollection:
+    """find_one sur égalité de champs, compteur d'appels"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.find_calls = 0
+
+    async def find_one(self, query, projection=None):
+        self.find_calls += 1
+        for doc in self.docs:
+            if all(doc.get(k) == v for k, v in query.items()):
+                return dict(doc)
+        return None
+
+    async def update_one(self, query, update):
+        for doc in self.docs:
+            if all(doc.get(k) == v for k, v in query.items()):
+                doc.update(update.get("$set", {}))
+
+    async def insert_one(self, doc):
+        self.docs.append(doc)
+
+
+def make_db(users, tokens):
+    return SimpleNamespace(users=FakeCollection(users), tokens=FakeCollection(tokens))
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def run(fake_db, clock, coro_factory):
+    with patch.object(dependencies, "db", fake_db), \
+            patch.object(dependencies, "time", clock), \
+            patch.dict(dependencies._user_cache, clear=True):
+        return asyncio.run(coro_factory())
+
+
+USERS = [
+    {"id": "u1", "email": "a@example.com", "is_admin": False},
+    {"id": "u2", "email": "b@example.com", "is_admin": False},
+]
+TOKENS = [
+    {"token": "t1", "user_id": "u1"},
+    {"token": "t1b", "user_id": "u1"},
+    {"token": "t2", "user_id": "u2"},
+]
+
+
+class TestUserCache:
+
+    def test_cache_hit_within_ttl(self):
+        fake_db, clock = make_db(list(USERS), list(TOKENS)), Clock()
+
+        async def scenario():
+            first = await dependencies.get_current_user("Bearer t1")
+            first["is_admin"] = True  # copie: ne modifie pas le cache
+            clock.now += dependencies._USER_CACHE_TTL - 1
+            return await dependencies.get_current_user("Bearer t1")
+
+        user = run(fake_db, clock, scenario)
+        assert user["id"] == "u1"
+        assert user["is_admin"] is False
+        assert fake_db.users.find_calls == 1
+
+    def test_ttl_expiry(self):
+        fake_db, clock = make_db(list(USERS), list(TOKENS)), Clock()
+
+        async def scenario():
+            await dependencies.get_current_user("Bearer t1")
+            fake_db.users.docs[0]["is_admin"] = True
+            clock.now += dependencies._USER_CACHE_TTL + 1
+            return await dependencies.get_current_user("Bearer t1")
+
+        user = run(fake_db, clock, scenario)
+        assert user["is_admin"] is True
+        assert fake_db.users.find_calls == 2
+
+    def test_invalidate_token(self):
+        fake_db, clock = make_db(list(USERS), list(TOKENS)), Clock()
+
+        async def scenario():
+            for token in ("t1", "t1b", "t2"):
+                await dependencies.get_current_user(token)
+            dependencies.invalidate_user_cache(token="t1")
+            return set(dependencies._user_cache)
+
+        assert run(fake_db, clock, scenario) == {"t1b", "t2"}
+
+    def test_invalidate_user_id(self):
+        fake_db, clock = make_db(list(USERS), list(TOKENS)), Clock()
+
+        async def scenario():
+            for token in ("t1", "t1b", "t2"):
+                await dependencies.get_current_user(token)
+            dependencies.invalidate_user_cache(user_id="u1")
+            return set(dependencies._user_cache)
+
+        assert run(fake_db, clock, scenario) == {"t2"}
+
+    def test_fifo_eviction_at_max(self):
+        size = dependencies._USER_CACHE_MAX
+        tokens = [{"token": f"tok{i}", "user_id": "u1"} for i in range(size + 1)]
+        fake_db, clock = make_db(list(USERS), tokens), Clock()
+
+        async def scenario():
+            for i in range(size + 1):
+                await dependencies.get_current_user(f"tok{i}")
+            return dict(dependencies._user_cache)
+
+        cache = run(fake_db, clock, scenario)
+        assert size == 4096
+        assert len(cache) == size
+        assert "tok0" not in cache
+        assert "tok1" in cache and f"tok{size}" in cache
+
+    def test_demo_login_invalidates_cached_privileges(self):
+        demo = {"id": "demo", "email": "demo@calcauto.ca", "is_admin": False, "name": "Demo Admin"}
+        fake_db, clock = make_db([demo], [{"token": "old", "user_id": "demo"}]), Clock()
+
+        async def scenario():
+            await dependencies.get_current_user("old")
+            with patch.object(auth, "db", fake_db):
+                await auth.demo_login()
+            return "old" in dependencies._user_cache, await dependencies.get_current_user("old")
+
+        still_cached, user = run(fake_db, clock, scenario)
+        assert still_cached is False
+        assert user["is_admin"] is True
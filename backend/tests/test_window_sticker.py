@@ -0,0 +1,49 @@
+"""
+Tests de la résolution de marque des Window Stickers
+(services/window_sticker.py): clé exacte, alias, marque composée et
+repli sur le site Jeep.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "calcauto_test")
+
+from services.window_sticker import (
+    WINDOW_STICKER_BRANDS,
+    resolve_window_sticker_brand,
+    window_sticker_pdf_url,
+)
+
+VIN = "1C4RJKBG5P8000001"
+
+
+class TestResolveWindowStickerBrand:
+
+    def test_exact_key(self):
+        assert resolve_window_sticker_brand(" Ram ") == "ram"
+
+    def test_alias(self):
+        assert resolve_window_sticker_brand("Alfa Romeo") == "alfa"
+        assert resolve_window_sticker_brand("Grand Cherokee") == "jeep"
+
+    def test_compound_brand_uses_first_word(self):
+        assert resolve_window_sticker_brand("Dodge Durango") == "dodge"
+        assert resolve_window_sticker_brand("Chrysler Pacifica") == "chrysler"
+
+    def test_unknown_brand(self):
+        assert resolve_window_sticker_brand("Toyota Corolla") is None
+        assert resolve_window_sticker_brand("   ") is None
+        assert resolve_window_sticker_brand(None) is None
+
+
+class TestWindowStickerPdfUrl:
+
+    def test_compound_brand_url(self):
+        assert window_sticker_pdf_url(VIN, "Dodge Durango") == WINDOW_STICKER_BRANDS["dodge"][0] + VIN
+        assert window_sticker_pdf_url(VIN, "Chrysler Pacifica") == WINDOW_STICKER_BRANDS["chrysler"][0] + VIN
+
+    def test_unknown_brand_falls_back_to_jeep(self):
+        assert window_sticker_pdf_url(VIN, "Toyota") == WINDOW_STICKER_BRANDS["jeep"][0] + VIN
+        assert window_sticker_pdf_url(VIN, None) == WINDOW_STICKER_BRANDS["jeep"][0] + VIN
@@ -281,6 +281,30 @@ def validate_invoice_data(data: Dict[str, Any]) -> Dict[str, Any]:
     return result
 
 
+def get_blocking_errors(data: Dict[str, Any]) -> List[str]:
+    """
+    Règle d'or: erreurs bloquantes avant tout enregistrement.
+    - VIN invalide (ou manquant)
+    - EP manquant
+    - PDCO manquant
+    - EP >= PDCO
+    """
+    vin = data.get("vin", "")
+    ep = data.get("ep_cost", 0) or 0
+    pdco = data.get("pdco", 0) or 0
+    
+    errors = []
+    if not vin or len(vin) != 17:
+        errors.append("VIN manquant ou invalide (doit être 17 caractères)")
+    if ep <= 0:
+        errors.append("EP (Employee Price) manquant")
+    if pdco <= 0:
+        errors.append("PDCO (Dealer Price) manquant")
+    elif ep > 0 and ep >= pdco:
+        errors.append(f"EP ({ep}) doit être inférieur à PDCO ({pdco})")
+    return errors
+
+
 def determine_parse_method_needed(pdf_text_success: bool, ocr_score: int) -> str:
     """
     Détermine si on doit utiliser le fallback AI.
@@ -28,6 +28,16 @@ VIN_TRANSLITERATION = {
 # Poids par position (1-17)
 VIN_WEIGHTS = [8, 7, 6, 5, 4, 3, 2, 10, 0, 9, 8, 7, 6, 5, 4, 3, 2]
 
+# Contribution pondérée précalculée: _VIN_CONTRIB[position][octet ASCII]
+# (poids 0 en position 9: le check digit ne compte pas dans la somme)
+_VIN_CONTRIB = tuple(
+    tuple(VIN_TRANSLITERATION.get(chr(b), 0) * weight for b in range(256))
+    for weight in VIN_WEIGHTS
+)
+
+# Check digit attendu pour chaque reste modulo 11
+_VIN_CHECK_CHARS = "0123456789X"
+
 
 def calculate_check_digit(vin: str) -> str:
     """
@@ -42,18 +52,9 @@ def calculate_check_digit(vin: str) -> str:
     if len(vin) != 17:
         return ""
     
-    vin = vin.upper()
-    total = 0
-    
-    for i, char in enumerate(vin):
-        if i == 8:  # Position 9 (index 8) est le check digit lui-même
-            continue
-        
-        value = VIN_TRANSLITERATION.get(char, 0)
-        total += value * VIN_WEIGHTS[i]
-    
-    remainder = total % 11
-    return 'X' if remainder == 10 else str(remainder)
+    buf = vin.upper().encode("ascii", "replace")
+    total = sum(contrib[b] for contrib, b in zip(_VIN_CONTRIB, buf))
+    return _VIN_CHECK_CHARS[total % 11]
 
 
 def validate_vin_checksum(vin: str) -> bool:
@@ -83,9 +84,15 @@ OCR_CORRECTIONS = {
     'q': '0',
 }
 
+# Table de traduction (appliquée en un seul str.translate)
+_OCR_CORRECTIONS_TABLE = str.maketrans(OCR_CORRECTIONS)
+
 # Caractères invalides dans un VIN (I, O, Q)
 INVALID_VIN_CHARS = set('IOQ')
 
+# Tout caractère hors alphabet VIN (nettoyage avant validation)
+_VIN_INVALID_CHARS_RE = re.compile(r'[^A-HJ-NPR-Z0-9]')
+
 # NOUVEAU: Paires de confusion OCR fréquentes (source → destinations possibles)
 # Utilisé pour correction intelligente quand le checksum échoue
 OCR_CONFUSION_PAIRS = {
@@ -123,14 +130,7 @@ def correct_vin_ocr_errors(vin: str) -> str:
     if not vin:
         return vin
     
-    corrected = []
-    for char in vin.upper():
-        if char in OCR_CORRECTIONS:
-            corrected.append(OCR_CORRECTIONS[char])
-        else:
-            corrected.append(char)
-    
-    result = ''.join(corrected)
+    result = vin.upper().translate(_OCR_CORRECTIONS_TABLE)
     
     # Correction spécifique Jeep: position 5 devrait être K, pas X
     # Les VIN Jeep commencent par 1C4RJK, pas 1C4RJX
@@ -444,7 +444,7 @@ def validate_and_correct_vin(vin: str) -> Dict[str, any]:
         return result
     
     # Nettoyage
-    vin_clean = re.sub(r'[^A-HJ-NPR-Z0-9]', '', vin.upper())
+    vin_clean = _VIN_INVALID_CHARS_RE.sub('', vin.upper())
     
     if len(vin_clean) != 17:
         return result